@@ -3,6 +3,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Row, Column, Submit
+from .models import UserProfile
 
 
 class UserRegistrationForm(UserCreationForm):
@@ -47,11 +48,11 @@ class UserRegistrationForm(UserCreationForm):
         user.last_name = self.cleaned_data['last_name']
         if commit:
             user.save()
-            # Save profile data
-            profile = user.userprofile
-            profile.phone_number = self.cleaned_data.get('phone_number', '')
-            profile.address = self.cleaned_data.get('address', '')
-            profile.save()
+            # Profiles are created lazily, so only store one if there's data for it
+            phone_number = self.cleaned_data.get('phone_number', '')
+            address = self.cleaned_data.get('address', '')
+            if phone_number or address:
+                UserProfile.objects.create(user=user, phone_number=phone_number, address=address)
         return user
 
 
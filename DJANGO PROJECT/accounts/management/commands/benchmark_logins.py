@@ -0,0 +1,89 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import authenticate, login
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.db.models.signals import post_save
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from accounts.models import UserProfile
+
+
+USERNAME = 'login-benchmark'
+PASSWORD = 'login-Benchmark-123'
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def legacy_save_user_profile(sender, instance, **kwargs):
+    """The old receiver: write the profile on every User save, last_login updates included."""
+    if hasattr(instance, 'userprofile'):
+        models.Model.save(instance.userprofile)
+
+
+def benchmark_user():
+    user, created = User.objects.get_or_create(username=USERNAME)
+    if created:
+        user.set_password(PASSWORD)
+        user.save()
+    profile = UserProfile.for_user(user)
+    if profile.pk is None:
+        profile.phone_number = '555-0100'
+        profile.save()
+    return user
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the login write path: logins per second, queries and writes per login, '
+        'with the old save-the-profile-on-every-User-save receiver (before) and the current '
+        'update_fields-aware one (after).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=500)
+        parser.add_argument('--authenticate', action='store_true',
+                            help='Include password checking (dominated by the password hasher)')
+
+    def run(self, user, count, with_authenticate):
+        engine = import_module(settings.SESSION_ENGINE)
+        factory = RequestFactory()
+        queries = writes = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            request = factory.post('/login/')
+            request.session = engine.SessionStore()
+            with CaptureQueriesContext(connection) as ctx:
+                if with_authenticate:
+                    logged_in = authenticate(request, username=USERNAME, password=PASSWORD)
+                else:
+                    # What the auth backend hands to login(): a freshly loaded User
+                    logged_in = User.objects.get(pk=user.pk)
+                login(request, logged_in)
+                request.session.save()
+            queries += len(ctx.captured_queries)
+            writes += sum(1 for query in ctx.captured_queries
+                          if query['sql'].lstrip().upper().startswith(WRITE_STATEMENTS))
+        elapsed = time.perf_counter() - started
+        return count / elapsed, queries / count, writes / count
+
+    def handle(self, *args, **options):
+        user = benchmark_user()
+        count = options['logins']
+
+        post_save.connect(legacy_save_user_profile, sender=User, dispatch_uid='legacy-save-user-profile')
+        try:
+            before = self.run(user, count, options['authenticate'])
+        finally:
+            post_save.disconnect(sender=User, dispatch_uid='legacy-save-user-profile')
+        after = self.run(user, count, options['authenticate'])
+
+        self.stdout.write(f'{"":<24} {"logins/s":>10} {"queries/login":>14} {"writes/login":>13}')
+        for label, (rate, queries, writes) in (('before (legacy receiver)', before), ('after', after)):
+            self.stdout.write(f'{label:<24} {rate:>10.1f} {queries:>14.1f} {writes:>13.1f}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{before[2] - after[2]:.1f} fewer writes per login, {after[0] / before[0]:.2f}x login throughput'
+        ))
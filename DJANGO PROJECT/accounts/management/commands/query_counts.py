@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from fertilizer_planner.cache import measure_db_time
+from fertilizers.models import FertilizerRecommendation
+from parcels.models import LandParcel
+from accounts.backends import user_cache_key
+
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+CACHED_BACKEND = 'accounts.backends.CachedModelBackend'
+
+CONFIGURATIONS = {
+    'db sessions (baseline)': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'AUTHENTICATION_BACKENDS': [MODEL_BACKEND],
+    },
+    'cached_db + cached user': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'AUTHENTICATION_BACKENDS': [CACHED_BACKEND],
+        'USER_CACHE_TIMEOUT': 60,
+    },
+    'signed_cookies + cached user': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies',
+        'AUTHENTICATION_BACKENDS': [CACHED_BACKEND],
+        'USER_CACHE_TIMEOUT': 60,
+    },
+}
+
+
+def page_urls(user):
+    """The authenticated GET pages, using the user's own objects for detail URLs."""
+    urls = {
+        'accounts:profile': reverse('accounts:profile'),
+        'parcels:dashboard': reverse('parcels:dashboard'),
+        'parcels:parcel_list': reverse('parcels:parcel_list'),
+        'parcels:crop_list': reverse('parcels:crop_list'),
+        'fertilizers:product_list': reverse('fertilizers:product_list'),
+        'reports:recommendation_history': reverse('reports:recommendation_history'),
+    }
+    parcel = LandParcel.objects.filter(user=user).values_list('pk', flat=True).first()
+    if parcel:
+        urls['parcels:parcel_detail'] = reverse('parcels:parcel_detail', args=[parcel])
+    recommendation = FertilizerRecommendation.objects.filter(user=user).values_list('pk', flat=True).first()
+    if recommendation:
+        urls['reports:recommendation_detail'] = reverse('reports:recommendation_detail', args=[recommendation])
+    return urls
+
+
+def count_queries(user, urls):
+    """Log in with the active settings and count the queries of a warm request to each URL."""
+    cache.delete(user_cache_key(user.pk))
+    client = Client()
+    client.force_login(user)
+    counts = {}
+    for name, url in urls.items():
+        client.get(url)  # warm-up: fills the session and user caches
+        with measure_db_time() as timings:
+            response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'{url} returned {response.status_code}')
+        counts[name] = len(timings)
+    return counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the database queries of each page for one user, with DB-backed sessions '
+        '(the baseline) and with cached_db / signed-cookie sessions plus the cached User.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+
+        urls = page_urls(user)
+        results = {}
+        for label, overrides in CONFIGURATIONS.items():
+            with override_settings(**overrides):
+                results[label] = count_queries(user, urls)
+
+        labels = list(CONFIGURATIONS)
+        header = f'{"url name":<34}' + ''.join(f'{label:>30}' for label in labels)
+        self.stdout.write(header)
+        for name in urls:
+            self.stdout.write(f'{name:<34}' + ''.join(f'{results[label][name]:>30}' for label in labels))
+        totals = {label: sum(results[label].values()) for label in labels}
+        self.stdout.write(f'{"total":<34}' + ''.join(f'{totals[label]:>30}' for label in labels))
@@ -0,0 +1,76 @@
+import os
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from accounts.models import UserShard
+from fertilizer_planner.sharding import move_user, shard_aliases, target_shard, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or migrate the shard databases (SQLITE_SHARDS), copy the crops and fertilizer products '
+        'to them, and move every user whose rows are not on the shard their id maps to: users from '
+        'before sharding was turned on, or about a share of all users after adding shards. One user '
+        'is moved per transaction; their parcels, soil tests and recommendations get new ids.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help='Only move this user (repeatable)')
+        parser.add_argument('--limit', type=int, help='Stop after moving this many users')
+        parser.add_argument('--skip-migrate', action='store_true', help="Don't migrate the shards first")
+        parser.add_argument('--dry-run', action='store_true', help='Only list the moves')
+
+    def handle(self, *args, **options):
+        if not shard_aliases():
+            raise CommandError('Sharding is off: set SQLITE_SHARDS to the number of shard databases.')
+
+        if not options['dry_run'] and not options['skip_migrate']:
+            os.makedirs(settings.SQLITE_SHARD_DIR, exist_ok=True)
+            for alias in shard_aliases():
+                # post_migrate seeds the shard's id range and copies the reference data
+                with use_shard(alias):
+                    call_command('migrate', database=alias, interactive=False, verbosity=0)
+                self.stdout.write(f'{alias}: {settings.DATABASES[alias]["NAME"]} migrated')
+
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        assigned = dict(UserShard.objects.values_list('user_id', 'alias'))
+        moves = []
+        for user_id in users.values_list('pk', flat=True):
+            source, target = assigned.get(user_id, DEFAULT_DB_ALIAS), target_shard(user_id)
+            if source != target:
+                moves.append((user_id, source, target))
+        if options['limit'] is not None:
+            moves = moves[:options['limit']]
+
+        missing = {source for _, source, _ in moves} - set(settings.DATABASES)
+        if missing:
+            raise CommandError(
+                f'Users are assigned to {", ".join(sorted(missing))}, which is no longer configured; '
+                f'shards can be added but not removed.'
+            )
+
+        for (source, target), count in sorted(Counter((s, t) for _, s, t in moves).items()):
+            self.stdout.write(f'{source} -> {target}: {count} users')
+        if not moves:
+            self.stdout.write('Every user is on their shard.')
+        if options['dry_run'] or not moves:
+            return
+
+        started = time.perf_counter()
+        rows = 0
+        for index, (user_id, source, target) in enumerate(moves, 1):
+            rows += move_user(user_id, source, target)
+            if index % 100 == 0:
+                self.stdout.write(f'{index}/{len(moves)} users moved')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(moves)} users moved ({rows} rows) in {elapsed:.2f}s.'
+        ))
@@ -1,7 +1,13 @@
-from django.db import models
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_delete
 from django.dispatch import receiver
+from fertilizer_planner.cache import bump_user_version
+from fertilizer_planner.sharding import (
+    assign_shard, delete_user_from_shard, forget_shard, prepare_shard, rename_user, shard_for_user, target_shard,
+)
+from .backends import forget_user
 
 
 class UserProfile(models.Model):
@@ -11,22 +17,122 @@ class UserProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Fields edited by users; saves are skipped unless one of them changed
+    TRACKED_FIELDS = ('phone_number', 'address')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_values = self._tracked_values()
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    @classmethod
+    def for_user(cls, user):
+        """
+        Return the user's profile. Profiles are created lazily: a user without
+        one gets an unsaved, empty profile that is inserted on its first save.
+        """
+        try:
+            return user.userprofile
+        except cls.DoesNotExist:
+            return cls(user=user)
+
+    def _tracked_values(self):
+        return {field: getattr(self, field) for field in self.TRACKED_FIELDS}
+
+    def changed_fields(self):
+        return [field for field, value in self._saved_values.items() if getattr(self, field) != value]
+
+    def save(self, *args, **kwargs):
+        # Existing profiles only write the fields that changed (plus updated_at)
+        if self.pk is not None and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            changed = self.changed_fields()
+            if not changed:
+                return
+            kwargs['update_fields'] = changed + ['updated_at']
+        super().save(*args, **kwargs)
+        self._saved_values = self._tracked_values()
+
     class Meta:
         verbose_name = "User Profile"
         verbose_name_plural = "User Profiles"
 
 
+class UserShard(models.Model):
+    """
+    The shard database holding a user's parcels, soil tests and
+    recommendations (see fertilizer_planner.sharding). Users without one
+    are in 'default'.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard')
+    alias = models.CharField(max_length=50)
+    assigned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"User {self.user_id} on {self.alias}"
+
+
+@receiver(post_save, sender=User)
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    # Partial saves (e.g. the last_login update on every login) never touch the
+    # profile, and a profile that was never loaded can't have been edited
+    if update_fields is not None or not User.userprofile.is_cached(instance):
+        return
+    instance.userprofile.save()
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_cache(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which no cached page shows
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_user_version(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        UserProfile.objects.create(user=instance)
+def assign_new_user_shard(sender, instance, created, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if created and not raw and using == DEFAULT_DB_ALIAS and settings.SHARD_DATABASES:
+        assign_shard(instance.pk, target_shard(instance.pk))
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    if hasattr(instance, 'userprofile'):
-        instance.userprofile.save()
+def rename_user_stand_in(sender, instance, created, update_fields=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    # The shard's copy of the user carries the username the admin shows
+    if created or using != DEFAULT_DB_ALIAS or not settings.SHARD_DATABASES:
+        return
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    user_id, username = instance.pk, instance.username
+    transaction.on_commit(lambda: rename_user(user_id, username), using=DEFAULT_DB_ALIAS)
+
+
+@receiver(pre_delete, sender=User)
+def remember_user_shard(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # The UserShard row is deleted along with the user
+    if using == DEFAULT_DB_ALIAS:
+        instance._shard = shard_for_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def delete_user_shard_rows(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # The delete in 'default' only cascades to the rows stored there
+    alias = getattr(instance, '_shard', DEFAULT_DB_ALIAS)
+    if using != DEFAULT_DB_ALIAS or alias == DEFAULT_DB_ALIAS:
+        return
+    user_id = instance.pk
+    forget_shard(user_id)
+    transaction.on_commit(lambda: delete_user_from_shard(user_id, alias), using=DEFAULT_DB_ALIAS)
+
 
+@receiver(post_migrate)
+def prepare_shard_database(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Sent once per app; every app's tables exist by then
+    if sender.label == 'accounts' and using in settings.SHARD_DATABASES:
+        prepare_shard(using)
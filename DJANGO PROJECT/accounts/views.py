@@ -36,7 +36,7 @@ def profile(request):
     else:
         user_form = UserProfileUpdateForm(instance=request.user)
     
-    profile = UserProfile.objects.get(user=request.user)
+    profile = UserProfile.for_user(request.user)
     context = {
         'user_form': user_form,
         'profile': profile,
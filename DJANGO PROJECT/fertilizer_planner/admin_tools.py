@@ -0,0 +1,123 @@
+"""
+Admin helpers for large tables.
+
+EstimatedCountPaginator replaces the changelist's COUNT(*) over a whole
+table with an estimate: pg_class.reltuples on PostgreSQL, and on SQLite
+the span of primary keys, read from the ends of the primary key index.
+Filtered changelists still get an exact count. Pair it with
+show_full_result_count = False so the changelist doesn't also count the
+unfiltered table.
+
+PaginatedInlineMixin shows the rows of a tabular inline a page at a time
+instead of loading and rendering all of them.
+
+ShardedModelAdmin is for the models kept on per-user shards: the admin
+edits one database at a time and its changelist switches between them.
+"""
+
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+
+from .sharding import ADMIN_SHARD_PARAM, current_shard, data_aliases, shard_aliases, shard_for_user
+
+
+# Below this many rows an exact count is cheap enough
+ESTIMATE_THRESHOLD = 10000
+
+
+def estimate_row_count(queryset):
+    """An estimate of the number of rows in a queryset's table, or None."""
+    model = queryset.model
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] >= 0 else None
+    bounds = model._default_manager.using(queryset.db).aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['last'] is None or not isinstance(bounds['last'], int):
+        return None
+    # Deleted and archived rows leave gaps, so this errs on the high side
+    return bounds['last'] - bounds['first'] + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimate_row_count(self.object_list)
+            if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class PaginatedInlineMixin:
+    """
+    For InlineModelAdmin classes: show per_page rows at a time, paged with
+    a ?<model name>_page= query parameter. The change form posts back to
+    the same URL, so a save applies to the page being shown.
+    """
+    per_page = 20
+    template = 'admin/edit_inline/paginated_tabular.html'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset_class = super().get_formset(request, obj, **kwargs)
+        per_page = self.per_page
+        page_parameter = f'{self.model._meta.model_name}_page'
+
+        class PaginatedFormSet(formset_class):
+            def get_queryset(self):
+                if not hasattr(self, '_queryset'):
+                    queryset = super().get_queryset()
+                    self.page = Paginator(queryset, per_page).get_page(request.GET.get(page_parameter))
+                    self.page_parameter = page_parameter
+                    self._queryset = self.page.object_list
+                return self._queryset
+
+        return PaginatedFormSet
+
+
+class PaginatedTabularInline(PaginatedInlineMixin, admin.TabularInline):
+    pass
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """
+    For models in SHARDED_MODELS. With sharding on, ShardMiddleware routes
+    the admin's queries to the database picked for the session, and the
+    changelist links to every database holding such rows. A row's owner
+    must be a user whose data is on that database.
+    """
+    change_list_template = 'admin/sharded_change_list.html'
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {
+            'shard_databases': data_aliases() if shard_aliases() else [],
+            'current_database': current_shard(),
+            'shard_param': ADMIN_SHARD_PARAM,
+            **(extra_context or {}),
+        }
+        return super().changelist_view(request, extra_context)
+
+    def get_form(self, request, obj=None, **kwargs):
+        form_class = super().get_form(request, obj, **kwargs)
+        if not shard_aliases() or 'user' not in form_class.base_fields:
+            return form_class
+        database = current_shard()
+
+        class ShardForm(form_class):
+            def clean_user(self):
+                user = self.cleaned_data['user']
+                alias = shard_for_user(user.pk) if user is not None else database
+                if alias != database:
+                    raise ValidationError(
+                        f"{user}'s data is on {alias}; switch the admin to that database first."
+                    )
+                return user
+
+        return ShardForm
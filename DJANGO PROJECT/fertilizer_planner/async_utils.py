@@ -0,0 +1,60 @@
+"""
+Helpers for async views.
+
+Django 4.2's login_required only wraps sync views, and touching
+request.user from async code would run the session/user queries on the
+event loop. async_login_required resolves the user in a worker thread first.
+
+CPU-bound work (e.g. ReportLab PDF builds) is handed to a bounded pool with
+run_cpu_bound() so it never blocks the event loop. By default this is a
+thread pool in the web process. PDF builds hold the GIL, so they do not run
+in parallel there; set EXPORT_POOL=process to build them in worker
+processes instead, at the cost of pickling the inputs and a set-up Django in
+each worker.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial, wraps
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if settings.EXPORT_POOL == 'process':
+            # Workers unpickle model instances, so they need Django set up
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.EXPORT_WORKERS,
+                initializer=django.setup,
+            )
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EXPORT_WORKERS,
+                thread_name_prefix='export-worker',
+            )
+    return _executor
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Run a CPU-bound function in the bounded export pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+
+def async_login_required(view):
+    """login_required for async views."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,279 @@
+"""
+Versioned cache keys.
+
+Each namespace (e.g. 'crops', 'catalog', 'user:42') has a version number
+stored in the cache. Cached values are stored under keys that include the
+current version, so bumping the version invalidates every entry of that
+namespace at once without having to know or delete the individual keys.
+
+Values cached with set_with_dependencies() instead record the versions of
+every namespace they were built from, and get_with_dependencies() only
+returns them while all of those versions are unchanged. That suits values
+that depend on a handful of narrow namespaces (one recommendation, one
+parcel, the products it lists) rather than one broad one.
+
+With CACHE_STATS_SAMPLE_PERCENT set, that share of the lookups made through
+get_or_set_versioned(), get_with_dependencies() and cache_per_user() is
+counted per name, together with the database time spent on misses, so
+`manage.py cache_report` can show what the caches save. The counters are
+only ever changed with the cache's atomic incr.
+"""
+
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+
+from .sharding import current_shard
+
+
+STATS_KEY = 'cache-stats'
+
+STATS_FIELDS = ('hits', 'misses', 'db_us')
+
+# Names this process has added to the list of counted caches
+_registered_stats = set()
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_version(namespace):
+    """Return the current version of a cache namespace."""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Start from a timestamp so an evicted version never reuses old keys
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(namespace):
+    """Invalidate every cached value in a namespace."""
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def bump_version_on_commit(namespace):
+    """Bump a namespace once the current transaction (on the current shard) commits."""
+    transaction.on_commit(lambda: bump_version(namespace), using=current_shard())
+
+
+def invalidate_on_commit(namespaces):
+    """
+    Invalidate many namespaces in one cache round trip once the current
+    transaction commits. Their version keys are dropped, so the next
+    get_version() starts each one afresh from the clock.
+    """
+    keys = [_version_key(namespace) for namespace in namespaces]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys), using=current_shard())
+
+
+def versioned_key(namespace, *parts):
+    """Build a cache key tied to the current version of a namespace."""
+    suffix = ':'.join(str(part) for part in parts)
+    return f'{namespace}:{get_version(namespace)}:{suffix}'
+
+
+def user_namespace(user_id):
+    return f'user:{user_id}'
+
+
+def bump_user_version(user_id):
+    """Invalidate a user's cached pages once the current transaction commits."""
+    if user_id is not None:
+        bump_version_on_commit(user_namespace(user_id))
+
+
+def is_cascaded_delete(sender, origin):
+    """
+    True when a post_delete signal comes from deleting another model (e.g.
+    a parcel's soil test removed with the parcel), whose own receiver already
+    bumps the owner's namespace.
+    """
+    if origin is None:
+        return False
+    model = origin.model if hasattr(origin, 'model') else type(origin)
+    return model is not sender
+
+
+@contextmanager
+def measure_db_time():
+    """Collect the time spent in SQL queries, on every connection, into a list."""
+    timings = []
+
+    def wrapper(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            timings.append(time.perf_counter() - start)
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield timings
+
+
+def _incr(key, amount):
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        if cache.add(key, amount, timeout=None):
+            return amount
+        return cache.incr(key, amount)
+
+
+def _register_stats_name(name):
+    """
+    Add name to the list cache_stats() reads, once per process: each
+    registration takes a fresh slot from an incr'd counter, so concurrent
+    processes never overwrite each other's.
+    """
+    if name not in _registered_stats:
+        slot = _incr(f'{STATS_KEY}:names', 1)
+        cache.set(f'{STATS_KEY}:names:{slot}', name, timeout=None)
+        _registered_stats.add(name)
+
+
+def stats_sampled():
+    """Whether to count this cache lookup, per CACHE_STATS_SAMPLE_PERCENT."""
+    percent = settings.CACHE_STATS_SAMPLE_PERCENT
+    return percent >= 100 or percent > 0 and random.random() * 100 < percent
+
+
+def record_cache_access(name, hit, db_seconds=0):
+    """Count a sampled hit or miss (and the DB time a miss cost) for the cache report."""
+    _register_stats_name(name)
+    _incr(f'{STATS_KEY}:{name}:{"hits" if hit else "misses"}', 1)
+    if db_seconds:
+        _incr(f'{STATS_KEY}:{name}:db_us', int(db_seconds * 1e6))
+
+
+def _stats_names():
+    count = cache.get(f'{STATS_KEY}:names', 0)
+    slots = cache.get_many([f'{STATS_KEY}:names:{slot}' for slot in range(1, count + 1)])
+    return sorted(set(slots.values()))
+
+
+def cache_stats():
+    """Return {name: {'hits', 'misses', 'db_us'}} for every counted cache."""
+    stats = {}
+    for name in _stats_names():
+        keys = {field: f'{STATS_KEY}:{name}:{field}' for field in STATS_FIELDS}
+        values = cache.get_many(list(keys.values()))
+        stats[name] = {field: values.get(key, 0) for field, key in keys.items()}
+    return stats
+
+
+def reset_cache_stats():
+    # The names stay listed: other processes won't register them again
+    cache.delete_many([f'{STATS_KEY}:{name}:{field}' for name in _stats_names() for field in STATS_FIELDS])
+
+
+def get_or_set_versioned(namespace, parts, default, timeout=None):
+    """
+    Fetch a value from a versioned namespace, computing it with `default()`
+    on a miss.
+    """
+    key = versioned_key(namespace, *parts)
+    value = cache.get(key)
+    sampled = stats_sampled()
+    if value is not None:
+        if sampled:
+            record_cache_access(namespace, hit=True)
+        return value
+    with ExitStack() as stack:
+        timings = stack.enter_context(measure_db_time()) if sampled else []
+        value = default()
+    cache.set(key, value, timeout)
+    if sampled:
+        record_cache_access(namespace, hit=False, db_seconds=sum(timings))
+    return value
+
+
+def dependency_versions(namespaces):
+    """
+    The current versions of some namespaces, for set_with_dependencies().
+    Read them before loading the data being cached, so a change that lands
+    in between invalidates the entry rather than being missed.
+    """
+    return {namespace: get_version(namespace) for namespace in namespaces}
+
+
+def get_with_dependencies(name, key):
+    """
+    A value stored by set_with_dependencies(), or None if it is missing or
+    any namespace it depends on has been bumped since. Two cache reads.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, versions = entry
+        current = cache.get_many([_version_key(namespace) for namespace in versions])
+        if all(current.get(_version_key(namespace)) == version for namespace, version in versions.items()):
+            if stats_sampled():
+                record_cache_access(name, hit=True)
+            return value
+    return None
+
+
+def set_with_dependencies(name, key, value, versions, timeout=None, db_seconds=0):
+    """Cache a value with the dependency_versions() it was built from, counting the miss."""
+    cache.set(key, (value, versions), timeout)
+    if stats_sampled():
+        record_cache_access(name, hit=False, db_seconds=db_seconds)
+
+
+def cache_per_user(name, timeout=None, depends_on=()):
+    """
+    Cache a view's rendered GET responses per user.
+
+    The key includes the user's namespace version (bumped by model signals
+    when their data changes), the versions of the shared namespaces listed
+    in `depends_on` and the full request path. The body is cached with the
+    view's headers (Content-Type included). Requests carrying flash
+    messages bypass the cache, as the messages are part of the page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or len(messages.get_messages(request)):
+                return view(request, *args, **kwargs)
+
+            versions = [get_version(namespace) for namespace in depends_on]
+            key = versioned_key(user_namespace(request.user.pk), 'response', name, *versions, request.get_full_path())
+            cached = cache.get(key)
+            sampled = stats_sampled()
+            if cached is not None:
+                if sampled:
+                    record_cache_access(f'view:{name}', hit=True)
+                content, headers = cached
+                response = HttpResponse(content, headers=headers)
+            else:
+                with ExitStack() as stack:
+                    timings = stack.enter_context(measure_db_time()) if sampled else []
+                    response = view(request, *args, **kwargs)
+                if sampled:
+                    record_cache_access(f'view:{name}', hit=False, db_seconds=sum(timings))
+                if response.status_code == 200 and not response.streaming:
+                    cache.set(key, (response.content, dict(response.headers)), timeout)
+            patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,33 @@
+from django.conf import settings
+
+from fertilizers.cache import catalog_version
+from parcels.cache import crops_version
+from .cache import get_version, user_namespace
+
+
+def cache_versions(request):
+    """
+    Cache namespace versions for {% cache %} fragment keys.
+
+    The values are callables, so the templates resolve (and the cache is
+    asked for) only the versions a page actually uses.
+    """
+    def user_cache_version():
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return 0
+        return get_version(user_namespace(user.pk))
+
+    return {
+        'user_cache_version': user_cache_version,
+        'crops_version': crops_version,
+        'catalog_version': catalog_version,
+    }
+
+
+def cache_timeouts(request):
+    """Lifetimes (seconds) for {% cache %} fragments, from the settings."""
+    return {
+        'catalog_cache_timeout': settings.CATALOG_CACHE_TIMEOUT,
+        'page_cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+    }
@@ -0,0 +1,220 @@
+"""
+Request profiling.
+
+With PROFILING_ENABLED, ProfilingMiddleware times every request: SQL query
+count and time, template render time and total time. The figures go out in a
+Server-Timing header (shown by the browser dev tools). For a sample of
+PROFILING_SAMPLE_PERCENT of requests they are also appended to
+PROFILING_DIR/requests.ndjson, which is rotated to requests.ndjson.1 (dropping
+the previous one and its dumps) once it reaches PROFILING_MAX_BYTES, and the request is run under cProfile and
+dumped to PROFILING_DIR/<url name>.<time>.<pid>.prof. `manage.py
+profile_report` summarizes both, grouped by URL name.
+
+Queries are recorded by a wrapper installed on every new database
+connection, and templates are timed by ProfiledDjangoTemplates, which
+settings only installs with PROFILING_ENABLED. Both report
+to the profile of the current request through a context variable, so work
+that async views hand to sync_to_async threads is counted too. cProfile only
+sees the thread that serves the request, though, so for async views the
+dumps show the view's own code rather than the ORM calls it awaits.
+"""
+
+import contextvars
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+TIMINGS_FILE = 'requests.ndjson'
+# TIMINGS_FILE is renamed to this when it reaches PROFILING_MAX_BYTES
+ROTATED_TIMINGS_FILE = TIMINGS_FILE + '.1'
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+
+# Only one cProfile profiler can run per thread, and async requests share the
+# event loop thread, so at most one request is profiled at a time
+_sampling = threading.Lock()
+
+_timings_lock = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ProfiledTemplate(Template):
+    def render(self, context=None, request=None):
+        profile = _current_profile.get()
+        if profile is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.template_time += time.perf_counter() - start
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates whose templates report their render time to the request profile."""
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return ProfiledTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def url_name(request):
+    """The namespaced URL name of a request, e.g. 'parcels:dashboard'."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or 'unnamed'
+
+
+def rotate_timings(path):
+    """Move TIMINGS_FILE to ROTATED_TIMINGS_FILE, deleting the dumps of the records it replaces."""
+    rotated = os.path.join(settings.PROFILING_DIR, ROTATED_TIMINGS_FILE)
+    try:
+        with open(rotated) as f:
+            dumps = [json.loads(line)['profile'] for line in f]
+    except (FileNotFoundError, ValueError, KeyError):
+        dumps = []
+    for dump in filter(None, dumps):
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, dump))
+        except FileNotFoundError:
+            pass
+    os.replace(path, rotated)
+
+
+def append_timing(record):
+    """Append a request's timings to TIMINGS_FILE, rotating it first if it is full."""
+    path = os.path.join(settings.PROFILING_DIR, TIMINGS_FILE)
+    with _timings_lock:
+        try:
+            if os.path.getsize(path) >= settings.PROFILING_MAX_BYTES:
+                rotate_timings(path)
+        except FileNotFoundError:
+            pass
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def server_timing(profile):
+    return ', '.join([
+        f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"',
+        f'tpl;dur={profile.template_time * 1000:.1f};desc="templates"',
+        f'total;dur={profile.total_time * 1000:.1f};desc="total"',
+    ])
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        connection_created.connect(install_query_recorder, dispatch_uid='profiling-query-recorder')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile, token, sampled, profiler = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(profile, token, profiler)
+        return self.finish(request, response, profile, sampled, profiler)
+
+    async def __acall__(self, request):
+        profile, token, sampled, profiler = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(profile, token, profiler)
+        return self.finish(request, response, profile, sampled, profiler)
+
+    def start(self):
+        # Connections opened before the middleware was loaded missed the signal
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(None, connection)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        sampled = random.random() * 100 < settings.PROFILING_SAMPLE_PERCENT
+        profiler = None
+        if sampled and _sampling.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        profile.total_time = time.perf_counter()
+        return profile, token, sampled, profiler
+
+    def stop(self, profile, token, profiler):
+        profile.total_time = time.perf_counter() - profile.total_time
+        if profiler is not None:
+            profiler.disable()
+            _sampling.release()
+        _current_profile.reset(token)
+
+    def finish(self, request, response, profile, sampled, profiler):
+        response['Server-Timing'] = server_timing(profile)
+        if not sampled:
+            return response
+
+        name = url_name(request)
+        dump = None
+        if profiler is not None:
+            dump = f'{name.replace(":", "-")}.{int(time.time() * 1000)}.{os.getpid()}.prof'
+            profiler.dump_stats(os.path.join(settings.PROFILING_DIR, dump))
+        append_timing({
+            'url_name': name,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(profile.total_time * 1000, 2),
+            'db_ms': round(profile.db_time * 1000, 2),
+            'queries': profile.queries,
+            'template_ms': round(profile.template_time * 1000, 2),
+            'profile': dump,
+        })
+        return response
@@ -0,0 +1,124 @@
+"""
+Database routing for read-only report views and per-user shards.
+
+Views decorated with @read_only_database send their ORM reads to the
+'readonly' connection: the same SQLite file opened with mode=ro. In WAL
+mode, readers on that connection never block or wait for writers on
+'default'.
+
+ShardRouter comes first and sends the user-owned models to the current
+user's shard (see fertilizer_planner.sharding); everything it leaves alone
+falls through to ReadOnlyRouter.
+"""
+
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .sharding import SHARDED_MODELS, NoShardContext, current_shard, in_shard_context, shard_for_user
+
+
+READONLY_ALIAS = 'readonly'
+
+_use_readonly = ContextVar('use_readonly', default=False)
+
+
+def read_only_database(view):
+    """Route the ORM reads of a view to the read-only connection."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = _use_readonly.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _use_readonly.reset(token)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = _use_readonly.set(True)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _use_readonly.reset(token)
+    return wrapper
+
+
+class ReadOnlyRouter:
+    """Send reads to 'readonly' inside @read_only_database views."""
+
+    def db_for_read(self, model, **hints):
+        if _use_readonly.get() and READONLY_ALIAS in settings.DATABASES:
+            return READONLY_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point at the same database file
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != READONLY_ALIAS
+
+
+def owner_shard(instance):
+    """
+    The shard of whoever owns instance: the user it is (for a user's
+    related managers) or belongs to, or the loaded sharded row it points
+    at. None when none of those is known.
+    """
+    if instance._meta.label == settings.AUTH_USER_MODEL:
+        return shard_for_user(instance.pk) if instance.pk is not None else None
+    for field in instance._meta.concrete_fields:
+        if not field.is_relation:
+            continue
+        if field.related_model._meta.label == settings.AUTH_USER_MODEL and field.name == 'user':
+            user_id = getattr(instance, field.attname)
+            if user_id is not None:
+                return shard_for_user(user_id)
+        elif field.related_model._meta.label_lower in SHARDED_MODELS and field.is_cached(instance):
+            related = field.get_cached_value(instance)
+            if related is not None and related._state.db:
+                return related._state.db
+    return None
+
+
+class ShardRouter:
+    """
+    Send the reads and writes of SHARDED_MODELS to the current shard, or
+    to the shard of the sharded row they are reached from. Outside a shard
+    context (the shell, scripts, management commands) a row goes to its
+    owner's shard and a user's related managers read from it; a write
+    whose owner can't be told raises NoShardContext. Queries for 'default'
+    are left to the next router.
+    """
+
+    def shard_for(self, model, hints, write=False):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._meta.label_lower in SHARDED_MODELS and instance._state.db:
+            alias = instance._state.db
+        elif in_shard_context():
+            alias = current_shard()
+        else:
+            alias = owner_shard(instance) if instance is not None else None
+            if alias is None:
+                if write and settings.SHARD_DATABASES:
+                    raise NoShardContext(
+                        f'Writing {model._meta.label} rows outside use_shard(): '
+                        f'pick the shard of the user they belong to with use_shard(shard_for_user(user_id)).'
+                    )
+                alias = DEFAULT_DB_ALIAS
+        return alias if alias in settings.SHARD_DATABASES else None
+
+    def db_for_read(self, model, **hints):
+        return self.shard_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.shard_for(model, hints, write=True)
@@ -40,8 +40,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'fertilizer_planner.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'fertilizer_planner.sharding.ShardMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -62,6 +64,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'fertilizer_planner.context_processors.cache_versions',
+                'fertilizer_planner.context_processors.cache_timeouts',
             ],
         },
     },
@@ -73,13 +77,101 @@ WSGI_APPLICATION = 'fertilizer_planner.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite is tuned for concurrent use: WAL lets readers and a writer work at
+# the same time, and writes take the lock up front (BEGIN IMMEDIATE) instead
+# of failing with "database is locked" when upgrading a read transaction.
+SQLITE_PATH = config('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3'))
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)  # ms
+SQLITE_PRAGMAS = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='WAL'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=268435456, cast=int),  # 256 MB
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-20000, cast=int),  # negative = KiB
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': 'fertilizer_planner.sqlite_backend',
+        'NAME': SQLITE_PATH,
+        'CONN_MAX_AGE': config('CONN_MAX_AGE', default=60, cast=int),
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT / 1000,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': SQLITE_PRAGMAS,
+        },
+    },
+}
+
+# Read-only connection to the same file, used by the report views
+if config('SQLITE_READONLY_CONNECTION', default=True, cast=bool):
+    DATABASES['readonly'] = {
+        'ENGINE': 'fertilizer_planner.sqlite_backend',
+        'NAME': f'file:{SQLITE_PATH}?mode=ro',
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT / 1000,
+            'pragmas': {
+                'mmap_size': SQLITE_PRAGMAS['mmap_size'],
+                'cache_size': SQLITE_PRAGMAS['cache_size'],
+            },
+        },
+        'TEST': {'MIRROR': 'default'},
     }
+
+# Per-user shards (off with 0): each new user's parcels, soil tests and
+# recommendations go to one of SQLITE_SHARDS further files in SQLITE_SHARD_DIR,
+# picked by user id. See fertilizer_planner/sharding.py and `manage.py rebalance_shards`.
+SQLITE_SHARDS = config('SQLITE_SHARDS', default=0, cast=int)
+SQLITE_SHARD_DIR = config('SQLITE_SHARD_DIR', default=str(BASE_DIR / 'shards'))
+SHARD_DATABASES = [f'shard_{index}' for index in range(SQLITE_SHARDS)]
+DATABASES.update({
+    alias: {**DATABASES['default'], 'NAME': os.path.join(SQLITE_SHARD_DIR, f'{alias}.sqlite3')}
+    for alias in SHARD_DATABASES
+})
+
+# A user's shard is looked up once per this many seconds (per process with the locmem cache)
+SHARD_CACHE_TIMEOUT = config('SHARD_CACHE_TIMEOUT', default=300, cast=int)
+
+DATABASE_ROUTERS = [
+    'fertilizer_planner.routers.ShardRouter',
+    'fertilizer_planner.routers.ReadOnlyRouter',
+]
+
+
+# Cache
+# CACHE_BACKEND selects the store: 'locmem' (per process, the default),
+# 'file' (shared by the processes of one host) or 'redis' (shared by every
+# host; needs the `redis` package). Versioned namespaces are only shared
+# between processes with 'file' or 'redis'.
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fertilizer-planner',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache')),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_LOCATION', default='redis://127.0.0.1:6379/0'),
+    },
 }
 
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS[CACHE_BACKEND],
+        'TIMEOUT': config('CACHE_TIMEOUT', default=300, cast=int),
+        'KEY_PREFIX': 'fertilizer-planner',
+    },
+}
+
+# Percentage of cache lookups counted for `manage.py cache_report` (a cache
+# increment or two per counted lookup); 0 turns the counting off
+CACHE_STATS_SAMPLE_PERCENT = config('CACHE_STATS_SAMPLE_PERCENT', default=1, cast=float)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -137,6 +229,54 @@ LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'parcels:dashboard'
 LOGOUT_REDIRECT_URL = 'accounts:login'
 
+# The authenticated User is cached for this many seconds (0 disables)
+AUTHENTICATION_BACKENDS = ['accounts.backends.CachedModelBackend']
+USER_CACHE_TIMEOUT = config('USER_CACHE_TIMEOUT', default=60, cast=int)
+
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours
 
+# SESSION_BACKEND: 'db' (default), 'cached_db' (reads from the cache and
+# writes through to the database; use with a shared cache) or
+# 'signed_cookies' (no server-side storage at all)
+SESSION_BACKEND = config('SESSION_BACKEND', default='db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_BACKEND}'
+
+
+# Background parsing of uploaded soil lab reports
+SOIL_REPORT_WORKERS = config('SOIL_REPORT_WORKERS', default=2, cast=int)
+SOIL_REPORT_QUEUE_SIZE = config('SOIL_REPORT_QUEUE_SIZE', default=100, cast=int)
+
+# Admin bulk actions (fertilizers.bulk_jobs): rows per transaction, and whether
+# the web process runs them on a thread or leaves them to `manage.py run_bulk_jobs`
+BULK_JOB_BATCH_SIZE = config('BULK_JOB_BATCH_SIZE', default=500, cast=int)
+BULK_JOB_IN_PROCESS = config('BULK_JOB_IN_PROCESS', default=True, cast=bool)
+
+# Versioned caches of crop and fertilizer catalog listings and their rendered tables (seconds)
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Per-user caches of rendered pages and fragments (dashboard, recommendation detail,
+# navbar, parcel and history tables) (seconds)
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=600, cast=int)
+
+# Rendered recommendation detail bodies, invalidated precisely when what they show changes (seconds)
+RECOMMENDATION_PAGE_CACHE_TIMEOUT = config('RECOMMENDATION_PAGE_CACHE_TIMEOUT', default=86400, cast=int)
+
+# Recommendations older than this are moved to the archive by `manage.py archive_recommendations` (days)
+RECOMMENDATION_RETENTION_DAYS = config('RECOMMENDATION_RETENTION_DAYS', default=730, cast=int)
+
+# Bounded pool ('thread', or 'process' to build PDFs outside the GIL) for CPU-bound export work in async views
+EXPORT_POOL = config('EXPORT_POOL', default='thread')
+EXPORT_WORKERS = config('EXPORT_WORKERS', default=4, cast=int)
+
+# Request profiling: Server-Timing headers, and for a sample of requests their
+# timings and a cProfile dump in PROFILING_DIR (see `manage.py profile_report`).
+# The timings file is rotated once it reaches PROFILING_MAX_BYTES.
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_SAMPLE_PERCENT = config('PROFILING_SAMPLE_PERCENT', default=1.0, cast=float)
+PROFILING_DIR = config('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILING_MAX_BYTES = config('PROFILING_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+
+if PROFILING_ENABLED:
+    # Times template rendering for the Server-Timing header
+    TEMPLATES[0]['BACKEND'] = 'fertilizer_planner.profiling.ProfiledDjangoTemplates'
@@ -0,0 +1,448 @@
+"""
+Per-user database sharding.
+
+With SQLITE_SHARDS = N, every user created from then on is assigned one of
+N further SQLite databases, shard_0 ... shard_<N-1>, picked by user id
+modulo N. The shard holds the user's parcels, soil tests, recommendations
+and everything hanging off them (SHARDED_MODELS), so writes by users on
+different shards take different files' write locks instead of queueing on
+one.
+
+Everything else stays in 'default': users, sessions, profiles, bulk jobs,
+and the reference data. Crops and fertilizer products, which the sharded
+rows point at, are copied to every shard as they change so foreign keys and
+joins work within a shard; they are still read from 'default'. A shard also
+holds a stand-in row (id and username) for each user it serves.
+
+ShardMiddleware sets the shard of the logged-in user for each request and
+ShardRouter (fertilizer_planner.routers) sends the sharded models there.
+The admin works on one database at a time, picked with ?_shard=<alias>
+(see ShardedModelAdmin); bulk jobs run on the database they were queued
+from.
+Code outside a request, or working across users, picks a shard with
+use_shard() or loops over data_aliases(). Without one, a saved or deleted
+row still goes to its owner's shard, but a queryset write (update(),
+delete(), create(), bulk_create()) raises NoShardContext rather than
+landing in 'default', where the owner would never see it. Users without a
+shard, such as those created before sharding was turned on, stay in
+'default' until `manage.py rebalance_shards` moves them.
+
+Each shard's ids start at (index + 1) << ID_RANGE_BITS, so ids stay unique
+across databases and the cache keys built on them remain valid.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.http import HttpResponseRedirect
+from django.urls import reverse
+from django.utils.functional import cached_property
+
+
+# Models whose rows belong to one user and live on that user's shard
+SHARDED_MODELS = frozenset({
+    'parcels.landparcel',
+    'parcels.soiltest',
+    'fertilizers.inputsnapshot',
+    'fertilizers.fertilizerrecommendation',
+    'fertilizers.recommendationitem',
+    'fertilizers.archivedrecommendation',
+    'fertilizers.recommendationstatuschange',
+})
+
+# Reference data written to 'default' and copied to every shard
+REPLICATED_MODELS = ('parcels.Crop', 'fertilizers.FertilizerProduct')
+
+ID_RANGE_BITS = 40
+
+COPY_BATCH_SIZE = 500
+
+# The admin's database is kept in the session and changed with ?_shard=<alias>
+ADMIN_SHARD_PARAM = '_shard'
+ADMIN_SHARD_SESSION_KEY = '_admin_shard'
+
+# None outside any use_shard() block
+_current_shard = ContextVar('current_shard', default=None)
+
+
+class NoShardContext(RuntimeError):
+    """Raised for a write to a sharded model whose shard can't be told."""
+
+
+def shard_aliases():
+    return settings.SHARD_DATABASES
+
+
+def data_aliases():
+    """Every database holding sharded rows: 'default' (unassigned users) and the shards."""
+    return [DEFAULT_DB_ALIAS, *settings.SHARD_DATABASES]
+
+
+def current_shard():
+    return _current_shard.get() or DEFAULT_DB_ALIAS
+
+
+def in_shard_context():
+    """Whether a shard was picked, by use_shard() or ShardMiddleware."""
+    return _current_shard.get() is not None
+
+
+@contextmanager
+def use_shard(alias):
+    """Route the sharded models to alias inside the block."""
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+def on_sender_database(receiver):
+    """
+    Run a signal receiver of a sharded model with the sharded models routed
+    to the database the signal came from, so its own queries follow the row
+    when it was saved outside a shard context.
+    """
+    @wraps(receiver)
+    def wrapper(sender, **kwargs):
+        with use_shard(kwargs.get('using') or DEFAULT_DB_ALIAS):
+            return receiver(sender, **kwargs)
+    return wrapper
+
+
+def target_shard(user_id):
+    """The shard a user's id maps to with the configured shards ('default' with sharding off)."""
+    aliases = shard_aliases()
+    return aliases[user_id % len(aliases)] if aliases else DEFAULT_DB_ALIAS
+
+
+def shard_cache_key(user_id):
+    return f'user-shard:{user_id}'
+
+
+def forget_shard(user_id):
+    cache.delete(shard_cache_key(user_id))
+
+
+def shard_for_user(user_id):
+    """The database holding a user's rows, cached for SHARD_CACHE_TIMEOUT seconds."""
+    if not shard_aliases():
+        return DEFAULT_DB_ALIAS
+    key = shard_cache_key(user_id)
+    alias = cache.get(key)
+    if alias is None:
+        from accounts.models import UserShard
+        alias = (
+            UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id)
+            .values_list('alias', flat=True).first()
+        ) or DEFAULT_DB_ALIAS
+        cache.set(key, alias, settings.SHARD_CACHE_TIMEOUT)
+    return alias
+
+
+def _copy(model, objects, alias, **kwargs):
+    """
+    bulk_create objects in alias, keeping their auto_now/auto_now_add
+    values, which bulk_create would overwrite with the current time.
+    """
+    timestamps = [
+        field.attname for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [{name: getattr(obj, name) for name in timestamps} for obj in objects]
+    manager = model._base_manager.using(alias)
+    manager.bulk_create(objects, batch_size=COPY_BATCH_SIZE, **kwargs)
+    if timestamps and objects:
+        for obj, values in zip(objects, saved):
+            for name, value in values.items():
+                setattr(obj, name, value)
+        manager.bulk_update(objects, timestamps, batch_size=COPY_BATCH_SIZE)
+
+
+def copy_users(user_ids, alias):
+    """
+    Give a shard a stand-in row for each user, for the foreign keys of
+    their rows and for the admin, which lists and searches them by
+    username. Existing stand-ins get the current username. A stand-in is
+    inactive and has no usable password; logins always go to 'default'.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    users = []
+    for user_id, username in User._base_manager.using(DEFAULT_DB_ALIAS).filter(pk__in=user_ids).values_list(
+            'pk', 'username'):
+        user = User(pk=user_id, username=username, is_active=False)
+        user.set_unusable_password()
+        users.append(user)
+    User._base_manager.using(alias).bulk_create(
+        users, batch_size=COPY_BATCH_SIZE, update_conflicts=True, unique_fields=['id'], update_fields=['username'],
+    )
+
+
+def rename_user(user_id, username):
+    """Give a user's stand-in on their shard their new username."""
+    alias = shard_for_user(user_id)
+    if alias != DEFAULT_DB_ALIAS:
+        User = apps.get_model(settings.AUTH_USER_MODEL)
+        User._base_manager.using(alias).filter(pk=user_id).update(username=username)
+
+
+def sync_users(alias):
+    """Refresh the stand-ins of every user assigned to a shard."""
+    from accounts.models import UserShard
+    user_ids = list(UserShard.objects.using(DEFAULT_DB_ALIAS).filter(alias=alias).values_list('user_id', flat=True))
+    for start in range(0, len(user_ids), COPY_BATCH_SIZE):
+        copy_users(user_ids[start:start + COPY_BATCH_SIZE], alias)
+
+
+def assign_shard(user_id, alias):
+    """Record the database holding a user's rows."""
+    from accounts.models import UserShard
+    if alias != DEFAULT_DB_ALIAS:
+        copy_users([user_id], alias)
+    UserShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(user_id=user_id, defaults={'alias': alias})
+    forget_shard(user_id)
+
+
+def _status_log(user_id, alias):
+    """A user's status changes, including those of their archived recommendations."""
+    from fertilizers.models import ArchivedRecommendation, FertilizerRecommendation, RecommendationStatusChange
+
+    return RecommendationStatusChange.objects.using(alias).filter(
+        models.Q(recommendation_id__in=FertilizerRecommendation.objects.filter(user_id=user_id).values('pk'))
+        | models.Q(recommendation_id__in=ArchivedRecommendation.objects.filter(user_id=user_id).values('original_id'))
+    )
+
+
+def delete_user_rows(user_id, alias):
+    """Delete a user's sharded rows (not their user row) from one database."""
+    from fertilizers.models import ArchivedRecommendation, FertilizerRecommendation
+    from parcels.models import LandParcel
+
+    with use_shard(alias):
+        # The log's one way out: its rows were copied to the user's new
+        # database (or are the copies an interrupted move left behind)
+        _status_log(user_id, alias).delete_moved()
+        ArchivedRecommendation.objects.using(alias).filter(user_id=user_id).delete()
+        # Cascades to the soil tests, recommendations and items
+        LandParcel.objects.using(alias).filter(user_id=user_id).delete()
+        FertilizerRecommendation.objects.using(alias).filter(user_id=user_id).delete()
+
+
+def delete_user_from_shard(user_id, alias):
+    """Delete a user's stand-in row from a shard, and with it all their rows there."""
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    with use_shard(alias):
+        User._base_manager.using(alias).filter(pk=user_id).delete()
+
+
+def _copy_rows(model, objects, alias, **remap):
+    """
+    Insert objects into alias as new rows (new ids from its range),
+    replacing the foreign keys named in remap ({attname: {old id: new id}}).
+    Returns {old id: new id}.
+    """
+    old_ids = [obj.pk for obj in objects]
+    for obj in objects:
+        obj.pk = None
+        obj._state.adding = True
+        for attname, ids in remap.items():
+            value = getattr(obj, attname)
+            setattr(obj, attname, ids.get(value, value))
+    _copy(model, objects, alias)
+    return dict(zip(old_ids, (obj.pk for obj in objects)))
+
+
+def _copy_user_rows(user_id, source, target):
+    from fertilizers.models import (
+        ArchivedRecommendation, FertilizerRecommendation, InputSnapshot, RecommendationItem,
+        RecommendationStatusChange,
+    )
+    from parcels.models import LandParcel, SoilTest
+
+    parcels = list(LandParcel.objects.using(source).filter(user_id=user_id).order_by('pk'))
+    parcel_ids = _copy_rows(LandParcel, parcels, target)
+    soil_tests = list(SoilTest.objects.using(source).filter(parcel__user_id=user_id).order_by('pk'))
+    _copy_rows(SoilTest, soil_tests, target, parcel_id=parcel_ids)
+
+    recommendations = list(FertilizerRecommendation.objects.using(source).filter(user_id=user_id).order_by('pk'))
+    # Snapshots are shared by content, so look them up (or add them) by their values
+    snapshots = list(InputSnapshot.objects.using(source).filter(recommendations__user_id=user_id).distinct())
+    snapshot_ids = {}
+    for start in range(0, len(snapshots), COPY_BATCH_SIZE):
+        batch = snapshots[start:start + COPY_BATCH_SIZE]
+        copies = InputSnapshot.objects.db_manager(target).for_values([
+            {field: getattr(snapshot, field) for field in InputSnapshot.VALUE_FIELDS} for snapshot in batch
+        ])
+        snapshot_ids.update((snapshot.pk, copy.pk) for snapshot, copy in zip(batch, copies))
+    recommendation_ids = _copy_rows(
+        FertilizerRecommendation, recommendations, target, parcel_id=parcel_ids, inputs_id=snapshot_ids,
+    )
+    items = list(RecommendationItem.objects.using(source).filter(recommendation__user_id=user_id).order_by('pk'))
+    _copy_rows(RecommendationItem, items, target, recommendation_id=recommendation_ids)
+
+    archived = list(ArchivedRecommendation.objects.using(source).filter(user_id=user_id).order_by('pk'))
+    _copy_rows(ArchivedRecommendation, archived, target, parcel_id=parcel_ids)
+    # Changes to archived recommendations keep pointing at their original ids
+    log = list(_status_log(user_id, source).order_by('pk'))
+    _copy_rows(RecommendationStatusChange, log, target, recommendation_id=recommendation_ids)
+
+    return len(parcels) + len(soil_tests) + len(recommendations) + len(items) + len(archived) + len(log)
+
+
+def move_user(user_id, source, target):
+    """
+    Move a user's rows from source to target (either can be 'default') and
+    record target as their database. The rows get new ids from the
+    target's range. Returns the number of rows moved.
+
+    Source's write lock is held throughout, so the user's own writes wait
+    for the move rather than landing on the database being emptied.
+    """
+    with transaction.atomic(using=source):
+        with transaction.atomic(using=target):
+            if target != DEFAULT_DB_ALIAS:
+                copy_users([user_id], target)
+            # Left over from an interrupted move
+            delete_user_rows(user_id, target)
+            moved = _copy_user_rows(user_id, source, target)
+        assign_shard(user_id, target)
+        delete_user_rows(user_id, source)
+        if source != DEFAULT_DB_ALIAS:
+            delete_user_from_shard(user_id, source)
+    return moved
+
+
+def replicate(model, pks, aliases=None):
+    """Copy rows of a REPLICATED_MODELS model from 'default' to the shards, inserting or updating them."""
+    aliases = shard_aliases() if aliases is None else aliases
+    if not aliases:
+        return
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    pks = list(pks)
+    for start in range(0, len(pks), COPY_BATCH_SIZE):
+        rows = model._base_manager.using(DEFAULT_DB_ALIAS).filter(pk__in=pks[start:start + COPY_BATCH_SIZE])
+        for alias in aliases:
+            # Fresh instances per shard: bulk_create records the database on them
+            _copy(model, list(rows), alias, update_conflicts=True,
+                  unique_fields=[model._meta.pk.name], update_fields=fields)
+
+
+def replicate_delete(model, pks, aliases=None):
+    """Delete rows of a REPLICATED_MODELS model from the shards, cascading there as in 'default'."""
+    for alias in shard_aliases() if aliases is None else aliases:
+        with use_shard(alias):
+            model._base_manager.using(alias).filter(pk__in=list(pks)).delete()
+
+
+def replicate_on_commit(model, pks, deleted=False):
+    """Replicate saves (or deletes) of reference rows made in 'default' once they commit."""
+    if not shard_aliases():
+        return
+    pks = list(pks)
+    if deleted:
+        transaction.on_commit(lambda: replicate_delete(model, pks), using=DEFAULT_DB_ALIAS)
+    else:
+        transaction.on_commit(lambda: replicate(model, pks), using=DEFAULT_DB_ALIAS)
+
+
+def sync_reference_data(alias):
+    """Bring a shard's copy of every REPLICATED_MODELS model in line with 'default'."""
+    for label in REPLICATED_MODELS:
+        model = apps.get_model(label)
+        pks = set(model._base_manager.using(DEFAULT_DB_ALIAS).values_list('pk', flat=True))
+        extra = set(model._base_manager.using(alias).values_list('pk', flat=True)) - pks
+        if extra:
+            replicate_delete(model, extra, [alias])
+        replicate(model, sorted(pks), [alias])
+
+
+def seed_id_range(alias):
+    """Start the ids of a shard's sharded tables at the shard's base, unless they are past it."""
+    base = (shard_aliases().index(alias) + 1) << ID_RANGE_BITS
+    with connections[alias].cursor() as cursor:
+        for label in sorted(SHARDED_MODELS):
+            table = apps.get_model(label)._meta.db_table
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, base])
+            elif row[0] < base:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [base, table])
+
+
+def prepare_shard(alias):
+    """Seed a freshly migrated shard's id range and copy the reference data and user stand-ins to it."""
+    with transaction.atomic(using=alias):
+        seed_id_range(alias)
+        sync_reference_data(alias)
+        sync_users(alias)
+
+
+def admin_shard(request):
+    """The database the admin works on for this session."""
+    alias = request.session.get(ADMIN_SHARD_SESSION_KEY, DEFAULT_DB_ALIAS)
+    return alias if alias in data_aliases() else DEFAULT_DB_ALIAS
+
+
+class ShardMiddleware:
+    """
+    Route the sharded models to the logged-in user's shard for the request.
+    Reads the user id straight from the session, so it adds no query of
+    its own. Admin pages use the session's admin_shard() instead;
+    ?_shard=<alias> changes it and redirects to the page without it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not shard_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    @cached_property
+    def admin_prefix(self):
+        return reverse('admin:index')
+
+    def shard_for(self, request):
+        """The request's database, or a redirect after switching the admin's."""
+        if request.path_info.startswith(self.admin_prefix):
+            if ADMIN_SHARD_PARAM in request.GET:
+                alias = request.GET[ADMIN_SHARD_PARAM]
+                if alias in data_aliases():
+                    request.session[ADMIN_SHARD_SESSION_KEY] = alias
+                query = request.GET.copy()
+                del query[ADMIN_SHARD_PARAM]
+                return None, HttpResponseRedirect(f'{request.path}?{query.urlencode()}' if query else request.path)
+            return admin_shard(request), None
+        user_id = request.session.get(SESSION_KEY)
+        if user_id is None:
+            return DEFAULT_DB_ALIAS, None
+        return shard_for_user(int(user_id)), None
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        alias, redirect = self.shard_for(request)
+        if redirect is not None:
+            return redirect
+        with use_shard(alias):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        alias, redirect = await sync_to_async(self.shard_for)(request)
+        if redirect is not None:
+            return redirect
+        with use_shard(alias):
+            return await self.get_response(request)
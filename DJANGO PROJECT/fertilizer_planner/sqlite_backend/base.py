@@ -0,0 +1,35 @@
+"""
+SQLite backend with connection-level tuning.
+
+Extends Django's sqlite3 backend with two extra OPTIONS:
+
+- 'pragmas': dict of PRAGMA name -> value run on every new connection
+  (journal_mode, synchronous, mmap_size, cache_size, ...)
+- 'transaction_mode': e.g. 'IMMEDIATE', used for the BEGIN issued by
+  atomic(). Taking the write lock up front avoids the "database is locked"
+  error SQLite raises when a read transaction tries to upgrade to a write
+  while another connection is writing.
+"""
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute(f'BEGIN {self.transaction_mode}')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,196 @@
+from datetime import date
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import DEFAULT_DB_ALIAS
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import UserShard
+from fertilizers.models import FertilizerRecommendation, RecommendationStatusChange
+from fertilizers.recommendation_engine import generate_recommendation
+from fertilizers.transitions import transition
+from parcels.models import Crop, LandParcel, SoilTest
+from .cache import get_version, user_namespace
+from .routers import ShardRouter
+from .sharding import (
+    ID_RANGE_BITS, NoShardContext, current_shard, data_aliases, in_shard_context, move_user, shard_for_user,
+    target_shard, use_shard,
+)
+
+
+SHARDS = ['shard_0', 'shard_1']
+
+
+@override_settings(SHARD_DATABASES=SHARDS)
+class ShardRouterTests(SimpleTestCase):
+    router = ShardRouter()
+
+    def test_sharded_models_follow_the_current_shard(self):
+        with use_shard('shard_1'):
+            self.assertEqual(self.router.db_for_write(LandParcel), 'shard_1')
+            self.assertEqual(self.router.db_for_read(FertilizerRecommendation), 'shard_1')
+            self.assertEqual(self.router.db_for_read(RecommendationStatusChange), 'shard_1')
+
+    def test_default_is_left_to_the_next_router(self):
+        self.assertEqual(current_shard(), DEFAULT_DB_ALIAS)
+        self.assertIsNone(self.router.db_for_read(LandParcel))
+        with use_shard(DEFAULT_DB_ALIAS):
+            self.assertIsNone(self.router.db_for_write(LandParcel))
+        with use_shard('shard_0'):
+            self.assertIsNone(self.router.db_for_read(Crop))
+            self.assertIsNone(self.router.db_for_write(User))
+
+    def test_writes_without_a_shard_or_owner_are_refused(self):
+        self.assertFalse(in_shard_context())
+        with self.assertRaises(NoShardContext):
+            self.router.db_for_write(LandParcel)
+        self.assertIsNone(self.router.db_for_write(Crop))
+        with override_settings(SHARD_DATABASES=[]):
+            self.assertIsNone(self.router.db_for_write(LandParcel))
+
+    def test_rows_saved_outside_a_shard_go_to_their_parent(self):
+        parcel = LandParcel()
+        parcel._state.db = 'shard_1'
+        self.assertEqual(self.router.db_for_write(SoilTest, instance=SoilTest(parcel=parcel)), 'shard_1')
+
+    def test_related_rows_stay_with_the_instance(self):
+        parcel = LandParcel()
+        parcel._state.db = 'shard_0'
+        with use_shard('shard_1'):
+            self.assertEqual(self.router.db_for_read(SoilTest, instance=parcel), 'shard_0')
+
+    def test_use_shard_restores_the_previous_shard(self):
+        with use_shard('shard_0'):
+            with use_shard('shard_1'):
+                self.assertEqual(current_shard(), 'shard_1')
+            self.assertEqual(current_shard(), 'shard_0')
+        self.assertEqual(current_shard(), DEFAULT_DB_ALIAS)
+
+    def test_target_shard(self):
+        self.assertEqual(target_shard(4), 'shard_0')
+        self.assertEqual(target_shard(5), 'shard_1')
+        with override_settings(SHARD_DATABASES=[]):
+            self.assertEqual(target_shard(5), DEFAULT_DB_ALIAS)
+
+
+class ShardForUserTests(TestCase):
+    databases = set(data_aliases())
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('farmer')
+
+    def test_assigned_shard(self):
+        UserShard.objects.update_or_create(user=self.user, defaults={'alias': 'shard_1'})
+        with override_settings(SHARD_DATABASES=SHARDS):
+            self.assertEqual(shard_for_user(self.user.pk), 'shard_1')
+
+    def test_unassigned_users_stay_in_default(self):
+        UserShard.objects.filter(user=self.user).delete()
+        with override_settings(SHARD_DATABASES=SHARDS):
+            self.assertEqual(shard_for_user(self.user.pk), DEFAULT_DB_ALIAS)
+
+    def test_rows_saved_outside_a_shard_go_to_their_owners(self):
+        UserShard.objects.update_or_create(user=self.user, defaults={'alias': 'shard_1'})
+        router = ShardRouter()
+        with override_settings(SHARD_DATABASES=SHARDS):
+            self.assertEqual(router.db_for_write(LandParcel, instance=LandParcel(user=self.user)), 'shard_1')
+            # A user's related managers read from their shard
+            self.assertEqual(router.db_for_read(LandParcel, instance=self.user), 'shard_1')
+
+    def test_lookup_is_cached(self):
+        with override_settings(SHARD_DATABASES=SHARDS):
+            shard_for_user(self.user.pk)
+            with self.assertNumQueries(0):
+                shard_for_user(self.user.pk)
+
+
+@skipUnless(settings.SHARD_DATABASES, 'Set SQLITE_SHARDS to test with shard databases')
+class ShardedDataTests(TestCase):
+    databases = set(data_aliases())
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crop = Crop.objects.create(
+                name='Maize', nitrogen_requirement=150, phosphorus_requirement=60, potassium_requirement=80,
+            )
+        self.user = User.objects.create_user('farmer')
+        self.alias = shard_for_user(self.user.pk)
+
+    def create_parcel(self):
+        with use_shard(self.alias):
+            parcel = LandParcel.objects.create(
+                user=self.user, name='North field', location='Valley', area_hectares=2, crop=self.crop,
+            )
+            SoilTest.objects.create(parcel=parcel, test_date=date(2026, 1, 1), nitrogen_ppm=10)
+        return parcel
+
+    def test_new_users_get_their_target_shard(self):
+        self.assertEqual(self.alias, target_shard(self.user.pk))
+        self.assertTrue(User.objects.using(self.alias).filter(pk=self.user.pk, username='farmer').exists())
+
+    def test_rows_are_written_to_the_users_shard(self):
+        parcel = self.create_parcel()
+        index = settings.SHARD_DATABASES.index(self.alias)
+        self.assertGreater(parcel.pk, (index + 1) << ID_RANGE_BITS)
+        self.assertTrue(LandParcel.objects.using(self.alias).filter(pk=parcel.pk).exists())
+        self.assertFalse(LandParcel.objects.using(DEFAULT_DB_ALIAS).filter(user=self.user).exists())
+
+    def test_saves_outside_a_shard_go_to_the_users_shard(self):
+        parcel = LandParcel(user=self.user, name='South field', location='Valley', area_hectares=1, crop=self.crop)
+        parcel.save()
+        SoilTest(parcel=parcel, test_date=date(2026, 1, 1), nitrogen_ppm=10).save()
+
+        self.assertEqual(parcel._state.db, self.alias)
+        self.assertTrue(SoilTest.objects.using(self.alias).filter(parcel_id=parcel.pk).exists())
+        self.assertEqual(self.user.land_parcels.get().pk, parcel.pk)
+        with self.assertRaises(NoShardContext):
+            LandParcel.objects.filter(user=self.user).update(name='Renamed')
+
+    def test_reference_data_is_replicated(self):
+        self.assertTrue(Crop.objects.using(self.alias).filter(pk=self.crop.pk, name='Maize').exists())
+
+    def test_move_user_takes_the_status_log(self):
+        parcel = self.create_parcel()
+        with use_shard(self.alias):
+            generate_recommendation(parcel.pk, self.user)
+            transition(FertilizerRecommendation.objects.filter(user=self.user), 'finalized')
+        target = next(alias for alias in settings.SHARD_DATABASES if alias != self.alias)
+
+        moved = move_user(self.user.pk, self.alias, target)
+
+        self.assertEqual(shard_for_user(self.user.pk), target)
+        self.assertFalse(LandParcel.objects.using(self.alias).filter(user=self.user).exists())
+        self.assertFalse(RecommendationStatusChange.objects.using(self.alias).exists())
+        self.assertFalse(User.objects.using(self.alias).filter(pk=self.user.pk).exists())
+        with use_shard(target):
+            recommendation = FertilizerRecommendation.objects.get(user=self.user)
+            self.assertEqual(recommendation.status, 'finalized')
+            self.assertEqual(recommendation.status_changes.count(), 1)
+        self.assertGreater(moved, 0)
+
+
+class FragmentCacheTests(TestCase):
+    databases = set(data_aliases())
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('farmer')
+        self.client.force_login(self.user)
+
+    def navbar_key(self):
+        return make_template_fragment_key('navbar', [self.user.pk, get_version(user_namespace(self.user.pk))])
+
+    def test_fragments_are_cached_for_the_configured_time(self):
+        self.client.get(reverse('parcels:crop_list'))
+        self.assertIsNotNone(cache.get(self.navbar_key()))
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_zero_timeout_disables_the_fragment_cache(self):
+        self.client.get(reverse('parcels:crop_list'))
+        self.assertIsNone(cache.get(self.navbar_key()))
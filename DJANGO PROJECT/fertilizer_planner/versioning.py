@@ -0,0 +1,45 @@
+"""
+Versioned models.
+
+A VersionedModel carries a `version` that goes up whenever one of its
+VERSIONED_FIELDS changes on save. Records computed from it store the version
+they saw, so they can tell when they are out of date; after each save,
+`version_changed` says whether that save bumped it, which is what the
+staleness receivers check.
+"""
+
+from django.db import models
+
+
+class VersionedModel(models.Model):
+    # Fields (attnames) whose changes bump the version
+    VERSIONED_FIELDS = ()
+
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._versioned_values = self._current_versioned_values()
+        self.version_changed = False
+
+    def _current_versioned_values(self):
+        # Deferred fields are left out rather than loaded
+        return {field: self.__dict__[field] for field in self.VERSIONED_FIELDS if field in self.__dict__}
+
+    def changed_versioned_fields(self):
+        current = self._current_versioned_values()
+        return [field for field, value in self._versioned_values.items()
+                if field in current and current[field] != value]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        self.version_changed = not self._state.adding and bool(self.changed_versioned_fields())
+        if self.version_changed:
+            self.version += 1
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'version'}
+        super().save(*args, **kwargs)
+        self._versioned_values = self._current_versioned_values()
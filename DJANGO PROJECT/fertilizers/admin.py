@@ -1,5 +1,11 @@
 from django.contrib import admin
-from .models import FertilizerProduct, FertilizerRecommendation, RecommendationItem
+from django.utils.html import format_html
+from fertilizer_planner.admin_tools import EstimatedCountPaginator, PaginatedTabularInline, ShardedModelAdmin
+from .bulk_jobs import admin_action
+from .models import (
+    ArchivedRecommendation, BulkJob, FertilizerProduct, FertilizerRecommendation, RecommendationItem,
+    RecommendationStatusChange, PriceHistory,
+)
 
 
 @admin.register(FertilizerProduct)
@@ -9,17 +15,112 @@ class FertilizerProductAdmin(admin.ModelAdmin):
     search_fields = ['name', 'brand']
 
 
-class RecommendationItemInline(admin.TabularInline):
+@admin.register(PriceHistory)
+class PriceHistoryAdmin(admin.ModelAdmin):
+    list_display = ['product', 'old_price', 'new_price', 'changed_at']
+    list_filter = ['changed_at']
+    search_fields = ['product__name', 'product__brand']
+    list_select_related = ['product']
+    autocomplete_fields = ['product']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class RecommendationItemInline(PaginatedTabularInline):
     model = RecommendationItem
     extra = 0
+    autocomplete_fields = ['fertilizer']
     readonly_fields = ['nitrogen_contribution_kg', 'phosphorus_contribution_kg', 'potassium_contribution_kg', 'cost']
 
 
 @admin.register(FertilizerRecommendation)
-class FertilizerRecommendationAdmin(admin.ModelAdmin):
+class FertilizerRecommendationAdmin(ShardedModelAdmin):
     list_display = ['parcel', 'user', 'generated_at', 'status', 'estimated_total_cost']
     list_filter = ['status', 'generated_at']
     search_fields = ['parcel__name', 'user__username']
-    readonly_fields = ['generated_at']
+    readonly_fields = ['generated_at', 'inputs']
     inlines = [RecommendationItemInline]
+    # The parcel's __str__ includes its owner's username
+    list_select_related = ['parcel__user', 'user']
+    autocomplete_fields = ['parcel', 'user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Newest first by primary key rather than an unindexed sort on generated_at
+    ordering = ['-pk']
+    actions = [
+        admin_action('regenerate', 'Regenerate selected drafts in the background', 'change'),
+        admin_action('finalize', 'Finalize selected drafts in the background', 'change'),
+        admin_action('delete', 'Delete selected recommendations in the background', 'delete'),
+    ]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'status' in form.changed_data:
+            RecommendationStatusChange.objects.create(
+                recommendation=obj,
+                from_status=form.initial['status'],
+                to_status=obj.status,
+                changed_by=request.user,
+                source='admin',
+            )
+
+@admin.register(ArchivedRecommendation)
+class ArchivedRecommendationAdmin(ShardedModelAdmin):
+    list_display = ['parcel_name', 'user', 'generated_at', 'status', 'estimated_total_cost', 'archived_at']
+    list_filter = ['status', 'archived_at']
+    search_fields = ['parcel_name', 'user__username']
+    list_select_related = ['user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    exclude = ['data']
+    readonly_fields = ['original_id', 'user', 'parcel', 'parcel_name', 'generated_at', 'status',
+                       'estimated_total_cost', 'archived_at']
+
+
+@admin.register(BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'status', 'progress', 'changed', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'action', 'target']
+    list_select_related = ['created_by']
+    exclude = ['selection', 'lease']
+    readonly_fields = ['action', 'target', 'status', 'progress', 'total', 'processed', 'changed', 'error',
+                       'created_by', 'created_at', 'updated_at', 'finished_at']
+
+    @admin.display(description='Progress')
+    def progress(self, job):
+        if job.total is None:
+            return 'Not started'
+        return format_html(
+            '<progress value="{}" max="{}"></progress> {}/{} ({}%)',
+            job.processed, job.total or 1, job.processed, job.total, job.percent_done,
+        )
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('selection')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RecommendationStatusChange)
+class RecommendationStatusChangeAdmin(ShardedModelAdmin):
+    list_display = ['recommendation_id', 'from_status', 'to_status', 'source', 'changed_by', 'changed_at']
+    list_filter = ['to_status', 'source', 'changed_at']
+    search_fields = ['=recommendation__id']
+    # A LEFT JOIN, so a removed user shows as empty rather than failing the page
+    list_select_related = ['changed_by']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-pk']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,309 @@
+"""
+Batch Recommendation API
+
+Machine clients, such as a farm-management system, authenticate each
+request with HTTP Basic credentials (the user's username and password;
+use HTTPS) and need no session or CSRF token. Requests without an
+Authorization header fall back to the browser session, and must then
+carry the CSRF token like any form post.
+
+POST a JSON body to /fertilizers/api/recommendations/batch/:
+
+    {
+        "parcels": [3, 7, 12],
+        "inputs": [
+            {
+                "ref": "field-a",
+                "area_hectares": 2.5,
+                "crop": {"nitrogen_requirement": 120, "phosphorus_requirement": 60, "potassium_requirement": 50},
+                "soil": {"nitrogen_ppm": 12, "phosphorus_ppm": 8, "potassium_ppm": 40, "ph_level": 6.5}
+            }
+        ],
+        "persist": true
+    }
+
+`inputs` entries may use "crop_id" instead of an inline "crop". The
+catalog is read once for the whole batch and results are streamed back as
+NDJSON, one line per parcel/input as soon as it is computed. Parcel results
+are saved as recommendations unless "persist" is false. Inline inputs have
+no parcel and are never saved, so a persist=false batch of inline inputs
+with inline crops needs no database access beyond the (cached) catalog.
+
+POST to /fertilizers/api/recommendations/transition/ to change the status
+of many of your recommendations at once:
+
+    {"recommendations": [41, 42, 57], "status": "finalized"}
+
+Recommendations whose current status doesn't allow the move (see
+fertilizers.transitions) are left unchanged; the response says how many
+were moved.
+"""
+
+import base64
+import binascii
+import json
+from functools import wraps
+
+from django.contrib.auth import authenticate
+from django.http import JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from fertilizer_planner.sharding import current_shard, shard_for_user, use_shard
+
+from parcels.models import Crop, LandParcel, SoilTest
+from .money import cents_to_float
+from .models import FertilizerRecommendation
+from .recommendation_engine import (
+    compute_recommendation, crop_requirements_of, load_catalog, save_recommendation, soil_ppm_of,
+)
+from .transitions import ALLOWED_TRANSITIONS, transition
+
+
+MAX_BATCH_SIZE = 500
+
+MAX_TRANSITION_SIZE = 10000
+
+CROP_FIELDS = {
+    'nitrogen': 'nitrogen_requirement',
+    'phosphorus': 'phosphorus_requirement',
+    'potassium': 'potassium_requirement',
+}
+
+SOIL_FIELDS = {
+    'nitrogen': 'nitrogen_ppm',
+    'phosphorus': 'phosphorus_ppm',
+    'potassium': 'potassium_ppm',
+}
+
+
+class BatchInputError(ValueError):
+    """Raised for a malformed entry of a batch request."""
+
+
+def basic_auth_user(request):
+    """The active user named by the request's HTTP Basic credentials, or None."""
+    scheme, _, credentials = request.META['HTTP_AUTHORIZATION'].partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials, validate=True).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def api_login_required(view):
+    """
+    Authenticate an API view with HTTP Basic credentials, or with the
+    session and a CSRF token when the request has no Authorization header.
+    Basic-authenticated requests carry no session for ShardMiddleware to
+    read, so they are routed to the user's shard here.
+    """
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if 'HTTP_AUTHORIZATION' in request.META:
+            user = basic_auth_user(request)
+            if user is None:
+                response = JsonResponse({'error': 'Invalid credentials'}, status=401)
+                response['WWW-Authenticate'] = 'Basic realm="api"'
+                return response
+            request.user = user
+            with use_shard(shard_for_user(user.pk)):
+                return view(request, *args, **kwargs)
+
+        if not request.user.is_authenticated:
+            response = JsonResponse({'error': 'Authentication required'}, status=401)
+            response['WWW-Authenticate'] = 'Basic realm="api"'
+            return response
+        # Exempting the view turned off the middleware's check; session callers still need it
+        rejected = CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+        if rejected is not None:
+            return rejected
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def serialize_result(result):
+    return {
+        'nitrogen_needed_kg': round(result['nitrogen_needed_kg'], 2),
+        'phosphorus_needed_kg': round(result['phosphorus_needed_kg'], 2),
+        'potassium_needed_kg': round(result['potassium_needed_kg'], 2),
+        'estimated_total_cost': cents_to_float(result['total_cost_cents']),
+        'items': [
+            {
+                'fertilizer_id': item['fertilizer'].pk,
+                'fertilizer': item['fertilizer'].name,
+                'quantity': item['quantity'],
+                'unit': item['unit'],
+                'cost': cents_to_float(item['cost_cents']),
+            }
+            for item in result['items']
+        ],
+    }
+
+
+def _is_id(value):
+    # bool is an int subclass, but true isn't an id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def invalid_crop_id(inputs):
+    """
+    The index of the first input whose 'crop_id' is not an integer, or
+    None. Checked before the response starts streaming, since a bad id
+    would otherwise fail halfway through the body.
+    """
+    for index, entry in enumerate(inputs):
+        if isinstance(entry, dict) and 'crop' not in entry and 'crop_id' in entry and not _is_id(entry['crop_id']):
+            return index
+    return None
+
+
+def _number(payload, field):
+    try:
+        return float(payload.get(field, 0))
+    except (TypeError, ValueError):
+        raise BatchInputError(f"'{field}' must be a number")
+
+
+def _parse_input(entry, crops):
+    if not isinstance(entry, dict):
+        raise BatchInputError("Each input must be an object")
+
+    if 'crop' in entry:
+        crop = entry['crop'] or {}
+        if not isinstance(crop, dict):
+            raise BatchInputError("'crop' must be an object")
+        crop_requirements = {nutrient: _number(crop, field) for nutrient, field in CROP_FIELDS.items()}
+    elif entry.get('crop_id') in crops:
+        crop_requirements = crop_requirements_of(crops[entry['crop_id']])
+    else:
+        raise BatchInputError("Input needs a 'crop' object or a valid 'crop_id'")
+
+    soil = entry.get('soil')
+    if not isinstance(soil, dict):
+        raise BatchInputError("Input needs a 'soil' object")
+    soil_ppm = {nutrient: _number(soil, field) for nutrient, field in SOIL_FIELDS.items()}
+
+    area_ha = _number(entry, 'area_hectares')
+    if area_ha <= 0:
+        raise BatchInputError("'area_hectares' must be positive")
+    return crop_requirements, soil_ppm, area_ha
+
+
+def _parcel_lines(user, parcel_ids, catalog, persist):
+    parcels = LandParcel.objects.filter(user=user, pk__in=parcel_ids).select_related('crop', 'soil_test')
+    parcels = {parcel.pk: parcel for parcel in parcels}
+
+    for parcel_id in parcel_ids:
+        parcel = parcels.get(parcel_id)
+        if parcel is None:
+            yield {'parcel': parcel_id, 'error': 'Parcel not found'}
+            continue
+        if not parcel.crop:
+            yield {'parcel': parcel_id, 'error': 'Parcel must have a crop assigned'}
+            continue
+        try:
+            soil_test = parcel.soil_test
+        except SoilTest.DoesNotExist:
+            yield {'parcel': parcel_id, 'error': 'Soil test data required for recommendation'}
+            continue
+
+        result = compute_recommendation(
+            crop_requirements_of(parcel.crop), soil_ppm_of(soil_test), parcel.area_hectares, catalog,
+        )
+        line = {'parcel': parcel_id, 'recommendation_id': None}
+        if persist:
+            recommendation = save_recommendation(parcel, user, parcel.crop, soil_test, result)
+            line['recommendation_id'] = recommendation.pk
+        line.update(serialize_result(result))
+        yield line
+
+
+def _input_lines(inputs, catalog):
+    crop_ids = {entry.get('crop_id') for entry in inputs if isinstance(entry, dict) and 'crop' not in entry}
+    crop_ids.discard(None)
+    crops = Crop.objects.in_bulk(list(crop_ids)) if crop_ids else {}
+
+    for index, entry in enumerate(inputs):
+        ref = entry.get('ref', index) if isinstance(entry, dict) else index
+        try:
+            crop_requirements, soil_ppm, area_ha = _parse_input(entry, crops)
+        except BatchInputError as e:
+            yield {'ref': ref, 'error': str(e)}
+            continue
+        line = {'ref': ref}
+        line.update(serialize_result(compute_recommendation(crop_requirements, soil_ppm, area_ha, catalog)))
+        yield line
+
+
+def _stream(lines):
+    for line in lines:
+        yield json.dumps(line) + '\n'
+
+
+@require_POST
+@api_login_required
+def batch_recommendations(request):
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'error': 'Request body must be JSON'}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+
+    parcel_ids = payload.get('parcels', [])
+    inputs = payload.get('inputs', [])
+    persist = payload.get('persist', True) is not False
+    if not isinstance(parcel_ids, list):
+        return JsonResponse({'error': "'parcels' must be a list of parcel IDs"}, status=400)
+    bad_index = next((index for index, pk in enumerate(parcel_ids) if not _is_id(pk)), None)
+    if bad_index is not None:
+        return JsonResponse({'error': f"'parcels'[{bad_index}] must be an integer parcel ID"}, status=400)
+    if not isinstance(inputs, list):
+        return JsonResponse({'error': "'inputs' must be a list"}, status=400)
+    bad_index = invalid_crop_id(inputs)
+    if bad_index is not None:
+        return JsonResponse({'error': f"'inputs'[{bad_index}].crop_id must be an integer crop ID"}, status=400)
+    if len(parcel_ids) + len(inputs) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f'At most {MAX_BATCH_SIZE} entries per batch'}, status=400)
+
+    user = request.user
+    catalog = load_catalog()
+    shard = current_shard()
+
+    def lines():
+        # Streamed after ShardMiddleware has returned, so pick the user's shard again
+        with use_shard(shard):
+            if parcel_ids:
+                yield from _parcel_lines(user, parcel_ids, catalog, persist)
+            if inputs:
+                yield from _input_lines(inputs, catalog)
+
+    return StreamingHttpResponse(_stream(lines()), content_type='application/x-ndjson')
+
+
+@require_POST
+@api_login_required
+def transition_recommendations(request):
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'error': 'Request body must be JSON'}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+
+    ids = payload.get('recommendations')
+    status = payload.get('status')
+    if not isinstance(ids, list) or not all(_is_id(pk) for pk in ids):
+        return JsonResponse({'error': "'recommendations' must be a list of recommendation IDs"}, status=400)
+    if len(ids) > MAX_TRANSITION_SIZE:
+        return JsonResponse({'error': f'At most {MAX_TRANSITION_SIZE} recommendations per request'}, status=400)
+    if status not in ALLOWED_TRANSITIONS:
+        return JsonResponse({'error': f"'status' must be one of {', '.join(ALLOWED_TRANSITIONS)}"}, status=400)
+
+    recommendations = FertilizerRecommendation.objects.filter(user=request.user, pk__in=ids)
+    moved = transition(recommendations, status, request.user.pk, source='api')
+    return JsonResponse({'status': status, 'requested': len(ids), 'changed': moved, 'unchanged': len(ids) - moved})
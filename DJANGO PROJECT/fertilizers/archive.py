@@ -0,0 +1,155 @@
+"""
+Recommendation archive.
+
+Moves old recommendations out of FertilizerRecommendation and
+RecommendationItem into ArchivedRecommendation: each recommendation, its
+items and a snapshot of its parcel become one zlib-compressed JSON
+document. Work is done in small batches, each in its own short
+transaction, so the write lock is never held for long and the app keeps
+serving requests while a large backlog is archived.
+
+Candidates are recommendations generated before a retention cut-off, and
+(optionally) superseded drafts: drafts with a newer recommendation for the
+same parcel. Archived recommendations stay readable from the history page.
+"""
+
+import json
+import zlib
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from fertilizer_planner.sharding import current_shard
+
+from .models import ArchivedRecommendation, FertilizerRecommendation, InputSnapshot
+
+
+DEFAULT_BATCH_SIZE = 100
+
+RECOMMENDATION_FIELDS = [
+    'id', 'user_id', 'parcel_id', 'generated_at', 'status', 'nitrogen_needed_kg', 'phosphorus_needed_kg', 'potassium_needed_kg',
+    'estimated_total_cost', 'notes',
+]
+
+ITEM_FIELDS = [
+    'fertilizer_id', 'quantity', 'unit', 'cost',
+    'nitrogen_contribution_kg', 'phosphorus_contribution_kg', 'potassium_contribution_kg',
+]
+
+
+def archive_candidates(older_than_days=None, superseded_drafts=False):
+    """Recommendations to archive: older than the retention window and/or superseded drafts."""
+    conditions = Q()
+    if older_than_days is not None:
+        conditions |= Q(generated_at__lt=timezone.now() - timedelta(days=older_than_days))
+    if superseded_drafts:
+        newer = FertilizerRecommendation.objects.filter(
+            parcel_id=OuterRef('parcel_id'), generated_at__gt=OuterRef('generated_at'),
+        )
+        conditions |= Q(Exists(newer), status='draft')
+    if not conditions:
+        return FertilizerRecommendation.objects.none()
+    return FertilizerRecommendation.objects.filter(conditions)
+
+
+def serialize(recommendation):
+    """The archive document for a recommendation loaded with its inputs, parcel, crop and items."""
+    parcel = recommendation.parcel
+    return {
+        # The inputs snapshot is inlined: the archive doesn't keep snapshot rows alive
+        'recommendation': dict(
+            {field: getattr(recommendation, field) for field in RECOMMENDATION_FIELDS},
+            **{field: getattr(recommendation.inputs, field) for field in InputSnapshot.VALUE_FIELDS},
+        ),
+        'parcel': {
+            'name': parcel.name,
+            'location': parcel.location,
+            'area_hectares': parcel.area_hectares,
+            'soil_type': parcel.get_soil_type_display(),
+            'crop': parcel.crop.name if parcel.crop else None,
+        },
+        'items': [
+            dict(
+                {field: getattr(item, field) for field in ITEM_FIELDS},
+                fertilizer=item.fertilizer.name,
+                brand=item.fertilizer.brand,
+                npk=[item.fertilizer.nitrogen_percent, item.fertilizer.phosphorus_percent,
+                     item.fertilizer.potassium_percent],
+            )
+            for item in recommendation.items.all()
+        ],
+    }
+
+
+def compress(document):
+    return zlib.compress(json.dumps(document, cls=DjangoJSONEncoder, separators=(',', ':')).encode(), 9)
+
+
+def decompress(data):
+    document = json.loads(zlib.decompress(bytes(data)))
+    document['recommendation']['generated_at'] = parse_datetime(document['recommendation']['generated_at'])
+    return document
+
+
+def archive_batch(candidates, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Archive up to batch_size of the candidate recommendations, oldest first,
+    in one transaction.
+
+    Returns (archived, raw_bytes, compressed_bytes).
+    """
+    with transaction.atomic(using=current_shard()):
+        recommendations = list(
+            candidates
+            .select_related('inputs', 'parcel__crop')
+            .prefetch_related('items__fertilizer')
+            .order_by('generated_at', 'pk')[:batch_size]
+        )
+        if not recommendations:
+            return 0, 0, 0
+
+        archived = []
+        raw_bytes = 0
+        for recommendation in recommendations:
+            document = serialize(recommendation)
+            raw_bytes += len(json.dumps(document, cls=DjangoJSONEncoder))
+            archived.append(ArchivedRecommendation(
+                original_id=recommendation.pk,
+                user_id=recommendation.user_id,
+                parcel_id=recommendation.parcel_id,
+                parcel_name=recommendation.parcel.name,
+                generated_at=recommendation.generated_at,
+                status=recommendation.status,
+                estimated_total_cost=recommendation.estimated_total_cost,
+                data=compress(document),
+            ))
+        ArchivedRecommendation.objects.bulk_create(archived)
+        # The items go with them (CASCADE); post_delete bumps the owners' cached pages
+        FertilizerRecommendation.objects.filter(pk__in=[r.pk for r in recommendations]).delete()
+
+    return len(archived), raw_bytes, sum(len(a.data) for a in archived)
+
+
+def delete_unused_snapshots():
+    """Delete the input snapshots no live recommendation refers to any more. Returns the count."""
+    deleted, _ = InputSnapshot.objects.filter(recommendations__isnull=True).delete()
+    return deleted
+
+
+def archive_recommendations(candidates, batch_size=DEFAULT_BATCH_SIZE, limit=None):
+    """
+    Archive candidates a batch at a time until none are left (or limit
+    recommendations have been archived). Yields the archive_batch() result
+    for each batch.
+    """
+    done = 0
+    while limit is None or done < limit:
+        size = batch_size if limit is None else min(batch_size, limit - done)
+        archived, raw_bytes, compressed_bytes = archive_batch(candidates, size)
+        if not archived:
+            return
+        done += archived
+        yield archived, raw_bytes, compressed_bytes
@@ -0,0 +1,306 @@
+"""
+Background admin bulk actions.
+
+The admin actions on LandParcel and FertilizerRecommendation only record
+a BulkJob holding the selection and return, however many rows were
+selected: the ticked ids or, with "select all", the changelist's filters
+and search term, so no ids are read in the request. The job then walks the
+selection in primary key order, a batch per short transaction that also
+records how far it got, so the write lock is never held for long and an
+interrupted job picks up after the last batch it finished.
+
+A worker claims a job by giving it a fresh lease; each batch saves its
+progress only if the job still carries that lease. A job whose progress
+hasn't moved for ABANDONED_AFTER can be claimed again, and the worker it
+was taken from then rolls its current batch back and stops, so no batch
+is applied twice.
+
+A job runs on the database its rows were selected from: 'default' or, with
+sharding on, the shard the admin was working on. Its progress is kept in
+'default', in a transaction wrapped around the shard's, so a batch whose
+progress couldn't be saved is rolled back too. (If 'default' fails to
+commit after the shard did, the batch runs again when the job resumes.)
+
+Jobs run on a daemon thread in the process that queued them, once the
+admin request commits. With BULK_JOB_IN_PROCESS off they are left for
+`manage.py run_bulk_jobs`, which also resumes jobs abandoned by a worker
+that died.
+"""
+
+import logging
+import queue
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.utils import prepare_lookup_value
+from django.contrib.admin.views.main import ERROR_FLAG, IGNORED_PARAMS, PAGE_VAR, SEARCH_VAR
+from django.db import close_old_connections, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+
+from fertilizer_planner.sharding import use_shard
+from parcels.models import LandParcel
+from .models import BulkJob, FertilizerRecommendation
+from .recommendation_engine import generate_for_parcel, load_catalog
+from .staleness import regenerate
+from .transitions import transition
+
+
+logger = logging.getLogger(__name__)
+
+# A running job whose progress hasn't moved for this long is taken to be abandoned
+ABANDONED_AFTER = timedelta(minutes=10)
+
+TARGETS = {
+    LandParcel: 'parcel',
+    FertilizerRecommendation: 'recommendation',
+}
+TARGET_MODELS = {target: model for model, target in TARGETS.items()}
+
+_queue = None
+_lock = threading.Lock()
+
+
+class LeaseLost(Exception):
+    """Raised when another worker has claimed the job since this one did."""
+
+
+def _regenerate_parcels(ids, user_id):
+    """A new draft recommendation for each parcel that has a crop and a soil test."""
+    catalog = load_catalog()
+    generated = 0
+    for parcel in LandParcel.objects.filter(pk__in=ids).select_related('user', 'crop', 'soil_test'):
+        if parcel.crop is None or getattr(parcel, 'soil_test', None) is None:
+            continue
+        generate_for_parcel(parcel, parcel.user, catalog=catalog)
+        generated += 1
+    return generated
+
+
+def _regenerate_recommendations(ids, user_id):
+    """Recompute drafts in place; finalized and applied recommendations are left as they are."""
+    return regenerate(list(
+        FertilizerRecommendation.objects.filter(pk__in=ids, status='draft')
+        .select_related('parcel__crop', 'parcel__soil_test')
+        .prefetch_related('items')
+    ))
+
+
+def _finalize_parcels(ids, user_id):
+    """Finalize each parcel's latest recommendation, if it is still a draft."""
+    latest = (
+        FertilizerRecommendation.objects.filter(parcel_id=OuterRef('parcel_id'))
+        .order_by('-generated_at', '-pk').values('pk')[:1]
+    )
+    recommendations = FertilizerRecommendation.objects.filter(parcel_id__in=ids, pk=Subquery(latest))
+    return transition(recommendations, 'finalized', user_id, source='bulk_job')
+
+
+def _finalize_recommendations(ids, user_id):
+    return transition(FertilizerRecommendation.objects.filter(pk__in=ids), 'finalized', user_id, source='bulk_job')
+
+
+def _delete_parcels(ids, user_id):
+    # Cascades to their soil tests and recommendations; the receivers bump the owners' pages
+    _, deleted = LandParcel.objects.filter(pk__in=ids).delete()
+    return deleted.get(LandParcel._meta.label, 0)
+
+
+def _delete_recommendations(ids, user_id):
+    _, deleted = FertilizerRecommendation.objects.filter(pk__in=ids).delete()
+    return deleted.get(FertilizerRecommendation._meta.label, 0)
+
+
+# (target, action) -> function of a batch of ids and the id of the user who queued
+# the job, returning the number of rows changed
+OPERATIONS = {
+    ('parcel', 'regenerate'): _regenerate_parcels,
+    ('parcel', 'finalize'): _finalize_parcels,
+    ('parcel', 'delete'): _delete_parcels,
+    ('recommendation', 'regenerate'): _regenerate_recommendations,
+    ('recommendation', 'finalize'): _finalize_recommendations,
+    ('recommendation', 'delete'): _delete_recommendations,
+}
+
+
+def selection_from(request):
+    """
+    The rows an admin action was run on, as stored in BulkJob.selection:
+    {'ids': [...]} for the ticked rows or, with "select all",
+    {'filters': {lookup: value}, 'search': term} from the changelist's
+    query string, which the action form posts back to.
+    """
+    if request.POST.get('select_across') != '1':
+        return {'ids': [int(pk) for pk in request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)]}
+    ignored = {*IGNORED_PARAMS, PAGE_VAR, ERROR_FLAG}
+    return {
+        'filters': {key: value for key, value in request.GET.items() if key not in ignored},
+        'search': request.GET.get(SEARCH_VAR, ''),
+    }
+
+
+def queue_job(action, model, selection, database, user=None):
+    """
+    Record a BulkJob for the selection (see selection_from) of model's rows
+    on database and schedule it to run once the current transaction
+    commits. The rows are counted and read by the worker.
+    """
+    job = BulkJob.objects.create(
+        action=action,
+        target=TARGETS[model],
+        created_by=user,
+        selection=selection,
+        database=database,
+        # Rows added later aren't part of the selection
+        last_id=model._base_manager.using(database).order_by('-pk').values_list('pk', flat=True).first() or 0,
+    )
+    job_id = job.pk
+    transaction.on_commit(lambda: submit(job_id))
+    return job
+
+
+def selection_of(job):
+    """The queryset a job was queued for, up to its last_id."""
+    model = TARGET_MODELS[job.target]
+    queryset = model._default_manager.using(job.database)
+    selection = job.selection
+    if 'ids' in selection:
+        queryset = queryset.filter(pk__in=selection['ids'])
+    else:
+        # The changelist's filter parameters are field lookups
+        queryset = queryset.filter(**{
+            key: prepare_lookup_value(key, value) for key, value in selection['filters'].items()
+        })
+        if selection['search']:
+            # Searched the way the changelist searched them
+            queryset, may_have_duplicates = admin.site._registry[model].get_search_results(
+                None, queryset, selection['search'],
+            )
+            if may_have_duplicates:
+                queryset = queryset.filter(pk__in=Subquery(queryset.values('pk')))
+    return queryset.filter(pk__lte=job.last_id)
+
+
+def claim(job_id=None):
+    """
+    Take the given job, or the oldest queued or abandoned one, mark it
+    running and give it a new lease. Returns the job, or None if there was
+    nothing to take (or another worker took it first).
+    """
+    now = timezone.now()
+    claimable = BulkJob.objects.filter(Q(status='queued') | Q(status='running', updated_at__lt=now - ABANDONED_AFTER))
+    if job_id is not None:
+        claimable = claimable.filter(pk=job_id)
+    for pk in claimable.order_by('created_at').values_list('pk', flat=True)[:5]:
+        # Only one worker's update matches
+        if claimable.filter(pk=pk).update(status='running', lease=uuid.uuid4().hex, updated_at=now):
+            return BulkJob.objects.get(pk=pk)
+    return None
+
+
+def save_progress(job, *fields):
+    """Save fields of a job if it still holds the lease it was claimed with; raise LeaseLost if not."""
+    job.updated_at = timezone.now()
+    values = {field: getattr(job, field) for field in fields}
+    if not BulkJob.objects.filter(pk=job.pk, lease=job.lease).update(updated_at=job.updated_at, **values):
+        raise LeaseLost(job.pk)
+
+
+def run_job(job, batch_size=None):
+    """Work through a claimed job from where it left off. Returns the job."""
+    batch_size = batch_size or settings.BULK_JOB_BATCH_SIZE
+    operation = OPERATIONS[job.target, job.action]
+    selection = selection_of(job)
+    try:
+        if job.total is None:
+            job.total = selection.count()
+            save_progress(job, 'total')
+        while True:
+            with transaction.atomic(), transaction.atomic(using=job.database), use_shard(job.database):
+                ids = list(selection.filter(pk__gt=job.cursor).order_by('pk').values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    break
+                changed = operation(ids, job.created_by_id)
+                job.processed += len(ids)
+                job.changed += changed
+                job.cursor = ids[-1]
+                save_progress(job, 'processed', 'changed', 'cursor')
+    except LeaseLost:
+        logger.warning("Bulk job %s was claimed by another worker; stopping", job.pk)
+        return job
+    except Exception as e:
+        logger.exception("Bulk job %s failed", job.pk)
+        job.refresh_from_db(fields=['processed', 'changed', 'cursor'])
+        job.status = 'failed'
+        job.error = f'{type(e).__name__}: {e}'
+    else:
+        job.status = 'done'
+    job.finished_at = timezone.now()
+    try:
+        save_progress(job, 'status', 'error', 'finished_at')
+    except LeaseLost:
+        logger.warning("Bulk job %s was claimed by another worker; stopping", job.pk)
+    return job
+
+
+def run_pending(batch_size=None):
+    """Run queued and abandoned jobs until none are left. Yields each job when it ends."""
+    while True:
+        job = claim()
+        if job is None:
+            return
+        yield run_job(job, batch_size)
+
+
+def _get_queue():
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = queue.Queue()
+            threading.Thread(target=_worker_loop, name='bulk-job-worker', daemon=True).start()
+        return _queue
+
+
+def _worker_loop():
+    jobs = _queue
+    while True:
+        job_id = jobs.get()
+        try:
+            close_old_connections()
+            job = claim(job_id)
+            if job is not None:
+                run_job(job)
+        except Exception:
+            logger.exception("Failed to run bulk job %s", job_id)
+        finally:
+            close_old_connections()
+            jobs.task_done()
+
+
+def submit(job_id):
+    """Hand a job to this process's worker thread. Returns False when jobs are left to run_bulk_jobs."""
+    if not settings.BULK_JOB_IN_PROCESS:
+        return False
+    _get_queue().put(job_id)
+    return True
+
+
+def admin_action(action, description, permission):
+    """A ModelAdmin action that queues a BulkJob for the selected rows."""
+    @admin.action(description=description, permissions=[permission])
+    def queue_action(modeladmin, request, queryset):
+        job = queue_job(action, queryset.model, selection_from(request), queryset.db, request.user)
+        modeladmin.message_user(request, format_html(
+            'Queued "{}" for the selected {}. <a href="{}">Follow its progress</a>.',
+            job.get_action_display(), job.get_target_display().lower(),
+            reverse('admin:fertilizers_bulkjob_change', args=[job.pk]),
+        ))
+
+    queue_action.__name__ = f'queue_{action}'
+    return queue_action
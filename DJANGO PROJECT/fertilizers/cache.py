@@ -0,0 +1,60 @@
+"""
+Cached fertilizer catalog lookups.
+
+Product listings are cached under the 'catalog' namespace. Its version is
+bumped whenever a FertilizerProduct is saved or deleted, which invalidates
+both the cached querysets and the rendered product table fragments.
+
+Rendered recommendation detail pages depend on narrower namespaces:
+'recommendation:<id>' (bumped when the recommendation or its items
+change) and 'product:<id>' for each product they list.
+"""
+
+from django.conf import settings
+
+from fertilizer_planner.cache import bump_version, get_or_set_versioned, get_version, invalidate_on_commit
+
+
+CATALOG_NAMESPACE = 'catalog'
+
+
+def catalog_version():
+    return get_version(CATALOG_NAMESPACE)
+
+
+def bump_catalog_version():
+    return bump_version(CATALOG_NAMESPACE)
+
+
+def recommendation_namespace(recommendation_id):
+    return f'recommendation:{recommendation_id}'
+
+
+def product_namespace(product_id):
+    return f'product:{product_id}'
+
+
+def invalidate_recommendations(recommendation_ids):
+    """Invalidate the cached pages of some recommendations once the current transaction commits."""
+    invalidate_on_commit([recommendation_namespace(pk) for pk in recommendation_ids])
+
+
+def invalidate_product(product_id):
+    invalidate_on_commit([product_namespace(product_id)])
+
+
+def get_products(active_only=False):
+    """All products (or only active ones), as a cached list."""
+    from .models import FertilizerProduct
+
+    def load():
+        products = FertilizerProduct.objects.all()
+        if active_only:
+            products = products.filter(is_active=True)
+        return list(products)
+
+    return get_or_set_versioned(
+        CATALOG_NAMESPACE, ['products', 'active' if active_only else 'all'],
+        load,
+        settings.CATALOG_CACHE_TIMEOUT,
+    )
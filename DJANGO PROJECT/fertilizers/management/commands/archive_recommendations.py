@@ -0,0 +1,74 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from fertilizer_planner.sharding import data_aliases, use_shard
+from fertilizers.archive import (
+    DEFAULT_BATCH_SIZE, archive_candidates, archive_recommendations, delete_unused_snapshots,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move recommendations older than the retention window (RECOMMENDATION_RETENTION_DAYS), '
+        'and optionally superseded drafts, into the compressed archive table. Deletes in small '
+        'batches, one short transaction each, so the live tables stay writable meanwhile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.RECOMMENDATION_RETENTION_DAYS,
+                            help='Archive recommendations generated more than this many days ago')
+        parser.add_argument('--no-age', action='store_true',
+                            help='Ignore the retention window (e.g. with --superseded-drafts only)')
+        parser.add_argument('--superseded-drafts', action='store_true',
+                            help='Also archive drafts that have a newer recommendation for the same parcel')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--limit', type=int, help='Stop after this many recommendations')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches to leave room for other writers')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the candidates')
+
+    def handle(self, *args, **options):
+        if options['no_age'] and not options['superseded_drafts']:
+            raise CommandError('Nothing to archive: --no-age needs --superseded-drafts.')
+        candidates = archive_candidates(
+            older_than_days=None if options['no_age'] else options['days'],
+            superseded_drafts=options['superseded_drafts'],
+        )
+
+        if options['dry_run']:
+            count = 0
+            for alias in data_aliases():
+                with use_shard(alias):
+                    count += candidates.count()
+            self.stdout.write(f'{count} recommendations would be archived.')
+            return
+
+        started = time.perf_counter()
+        archived = raw_bytes = compressed_bytes = batches = snapshots = 0
+        limit = options['limit']
+        # Each database holding recommendations ('default' and any shards) in turn
+        for alias in data_aliases():
+            if limit is not None and archived >= limit:
+                break
+            with use_shard(alias):
+                archived_here = 0
+                remaining = None if limit is None else limit - archived
+                for batch in archive_recommendations(candidates, options['batch_size'], remaining):
+                    archived_here += batch[0]
+                    raw_bytes += batch[1]
+                    compressed_bytes += batch[2]
+                    batches += 1
+                    if options['pause']:
+                        time.sleep(options['pause'])
+                if archived_here:
+                    snapshots += delete_unused_snapshots()
+            archived += archived_here
+
+        elapsed = time.perf_counter() - started
+        ratio = raw_bytes / compressed_bytes if compressed_bytes else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{archived} recommendations archived in {batches} batches ({elapsed:.2f}s); '
+            f'{raw_bytes / 1024:.1f} KiB of JSON stored as {compressed_bytes / 1024:.1f} KiB ({ratio:.1f}x); '
+            f'{snapshots} unused input snapshots deleted.'
+        ))
@@ -0,0 +1,81 @@
+import random
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.management.base import BaseCommand, CommandError
+from fertilizers.money import cents_to_decimal
+from fertilizers.recommendation_engine import compute_recommendation, load_catalog
+
+
+CENT = Decimal('0.01')
+
+
+def float_costs(lines):
+    """The old path: float costs and a float total, quantized when stored."""
+    items, total = [], 0.0
+    for quantity, product in lines:
+        cost = float(quantity) * float(product.price_per_unit)
+        items.append(Decimal(cost).quantize(CENT, ROUND_HALF_UP))
+        total += cost
+    return items, Decimal(total).quantize(CENT, ROUND_HALF_UP)
+
+
+def decimal_costs(lines):
+    """Exact Decimal arithmetic, rounding each item to cents."""
+    items = [(Decimal(repr(quantity)) * product.price_per_unit).quantize(CENT, ROUND_HALF_UP)
+             for quantity, product in lines]
+    return items, sum(items, Decimal(0))
+
+
+def cents_costs(lines):
+    """The engine's path: integer cents, Decimals only for storage."""
+    items = [round(quantity * product.price_cents) for quantity, product in lines]
+    return [cents_to_decimal(cents) for cents in items], cents_to_decimal(sum(items))
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark recommendation costing on a bulk run: float arithmetic (the old engine), '
+        'Decimal arithmetic and integer cents (the current engine). Reports throughput and how '
+        'many stored totals differ from the sum of their stored item costs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recommendations', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        catalog = load_catalog()
+        products = [product for product in catalog.values() if product is not None]
+        if not products:
+            raise CommandError('No active fertilizer products; run `manage.py load_sample_data` first.')
+
+        rng = random.Random(options['seed'])
+        count = options['recommendations']
+        # One line per nutrient, with quantities like the engine's (unrounded, in product units)
+        runs = [[(rng.uniform(1, 5000), product) for product in products] for _ in range(count)]
+
+        self.stdout.write(f'{"":<10} {"recs/s":>12} {"drifting totals":>16}')
+        rates = {}
+        for label, costs in (('float', float_costs), ('decimal', decimal_costs), ('cents', cents_costs)):
+            started = time.perf_counter()
+            results = [costs(lines) for lines in runs]
+            elapsed = time.perf_counter() - started
+            drift = sum(1 for items, total in results if sum(items, Decimal(0)) != total)
+            rates[label] = count / elapsed
+            self.stdout.write(f'{label:<10} {rates[label]:>12.0f} {drift:>16}')
+
+        crops = [
+            {nutrient: rng.uniform(20, 200) for nutrient in ('nitrogen', 'phosphorus', 'potassium')}
+            for _ in range(min(count, 20000))
+        ]
+        started = time.perf_counter()
+        for crop in crops:
+            compute_recommendation(crop, {'nitrogen': 5, 'phosphorus': 3, 'potassium': 10}, 2.0, catalog)
+        engine_rate = len(crops) / (time.perf_counter() - started)
+
+        self.stdout.write(f'full engine (compute_recommendation): {engine_rate:.0f} recs/s')
+        self.stdout.write(self.style.SUCCESS(
+            f'integer cents: {rates["cents"] / rates["decimal"]:.2f}x Decimal arithmetic, '
+            f'{rates["cents"] / rates["float"]:.2f}x the old float path'
+        ))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from fertilizers.models import FertilizerProduct, FertilizerRecommendation, RecommendationItem
+from fertilizers.recommendation_engine import NUTRIENTS
+from parcels.models import LandParcel
+
+
+def hot_queries():
+    """The queries behind the busiest views and the recommendation engine."""
+    return {
+        **{
+            f'engine: richest active {nutrient} source': FertilizerProduct.objects.filter(
+                is_active=True, **{f'{percent_field}__gt': 0}).order_by(f'-{percent_field}', 'name', 'pk')[:1]
+            for nutrient, percent_field, _, _ in NUTRIENTS
+        },
+        'history: by user': FertilizerRecommendation.objects.filter(user_id=1),
+        'history: by user and parcel': FertilizerRecommendation.objects.filter(user_id=1, parcel_id=1),
+        'parcels: by user': LandParcel.objects.filter(user_id=1),
+        'report: items of a recommendation': RecommendationItem.objects.filter(recommendation_id=1),
+    }
+
+
+def full_scans(plan, limited=False):
+    """
+    Return the plan lines that walk a whole table. A SCAN through an index
+    still visits every row, so only SEARCH steps count as indexed. For a
+    limited query a temp B-tree counts too: it sorts every matching row, so
+    the LIMIT cannot stop early.
+    """
+    scans = []
+    for line in plan.splitlines():
+        detail = line.split(' ', 3)[-1]
+        if detail.startswith('SCAN ') and detail != 'SCAN CONSTANT ROW':
+            scans.append(detail)
+        elif limited and detail.startswith('USE TEMP B-TREE'):
+            scans.append(detail)
+    return scans
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN on the hot queries and fail if any falls back to a full table scan'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plan checks are written for SQLite.')
+
+        failures = []
+        for name, queryset in hot_queries().items():
+            plan = queryset.explain()
+            scans = full_scans(plan, limited=queryset.query.high_mark is not None)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'FAIL  {name}: {"; ".join(scans)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'ok    {name}'))
+            if options['verbosity'] > 1:
+                self.stdout.write(f'      {plan}'.replace('\n', '\n      '))
+
+        if failures:
+            raise CommandError(f'{len(failures)} hot queries fall back to a full table scan.')
+        self.stdout.write(self.style.SUCCESS('All hot queries use an index.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from fertilizers.price_import import DEFAULT_BATCH_SIZE, PriceSheetError, import_price_sheet
+
+
+class Command(BaseCommand):
+    help = 'Import a supplier price sheet (CSV) into the fertilizer catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with price and id or name/brand columns')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as fh:
+                summary = import_price_sheet(fh, batch_size=options['batch_size'])
+        except (OSError, PriceSheetError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {summary['rows']} rows: {summary['updated']} updated, "
+            f"{summary['unchanged']} unchanged, {summary['skipped']} skipped; "
+            f"{summary['stale']} recommendations marked stale."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from fertilizers.search import index_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of fertilizer products'
+
+    def handle(self, *args, **options):
+        if not index_available():
+            self.stdout.write(self.style.WARNING('Search index is not available on this database; nothing to do.'))
+            return
+
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} fertilizer products.'))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from fertilizers.staleness import DEFAULT_BATCH_SIZE, count_stale, regenerate_stale
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the draft recommendations flagged stale by a change to their soil test, '
+        'crop, parcel or fertilizers, in batches. Runs once, or with --loop as a worker that '
+        'polls for newly flagged recommendations.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Recommendations recomputed per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new work')
+        parser.add_argument('--interval', type=float, default=30.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            batches = self.run_once(options['batch_size'])
+            if not options['loop']:
+                if not batches:
+                    self.stdout.write('No stale draft recommendations.')
+                return
+            time.sleep(options['interval'])
+
+    def run_once(self, batch_size):
+        started = time.perf_counter()
+        regenerated = skipped = batches = 0
+        for batch_regenerated, batch_skipped in regenerate_stale(batch_size):
+            regenerated += batch_regenerated
+            skipped += batch_skipped
+            batches += 1
+        if not batches:
+            return 0
+
+        elapsed = time.perf_counter() - started
+        stale = count_stale()
+        self.stdout.write(self.style.SUCCESS(
+            f'{regenerated} recommendations regenerated in {batches} batches ({elapsed:.2f}s); '
+            f'{skipped} skipped (parcel has no crop or soil test); {stale} still flagged stale.'
+        ))
+        return batches
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from fertilizers.bulk_jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the bulk actions queued from the admin (regenerate, finalize or delete many parcels '
+        'or recommendations), in batches, and resume any abandoned by a worker that stopped. Runs '
+        'once, or with --loop as a worker. Use it with BULK_JOB_IN_PROCESS=False to keep the '
+        'work out of the web processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows per transaction (default: BULK_JOB_BATCH_SIZE)')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new jobs')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = self.run_once(options['batch_size'])
+            if not options['loop']:
+                if not jobs:
+                    self.stdout.write('No queued bulk jobs.')
+                return
+            time.sleep(options['interval'])
+
+    def run_once(self, batch_size):
+        jobs = 0
+        for job in run_pending(batch_size):
+            jobs += 1
+            style = self.style.SUCCESS if job.status == 'done' else self.style.ERROR
+            self.stdout.write(style(
+                f'Job {job.pk} ({job}): {job.get_status_display().lower()}, '
+                f'{job.processed}/{job.total} processed, {job.changed} changed'
+                + (f' - {job.error}' if job.error else '')
+            ))
+        return jobs
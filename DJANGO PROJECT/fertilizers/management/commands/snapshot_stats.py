@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from fertilizer_planner.sharding import data_aliases, use_shard
+from fertilizers.models import FertilizerRecommendation, InputSnapshot
+
+
+# SQLite stores a REAL in 8 bytes and a small integer key in at most 8
+VALUE_BYTES = 8
+KEY_BYTES = 8
+HASH_BYTES = 64
+
+
+def storage_estimate(recommendations, snapshots):
+    """
+    (bytes, bytes) the input values would take copied onto every
+    recommendation, and take as shared snapshots plus a key per
+    recommendation.
+    """
+    fields = len(InputSnapshot.VALUE_FIELDS)
+    copied = recommendations * fields * VALUE_BYTES
+    shared = snapshots * (fields * VALUE_BYTES + HASH_BYTES + KEY_BYTES) + recommendations * KEY_BYTES
+    return copied, shared
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the recommendations and the distinct input snapshots they share on each database, '
+        'and estimate the storage saved over copying the inputs onto every recommendation.'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"database":<10} {"recommendations":>15} {"snapshots":>10} {"copied KiB":>11} '
+            f'{"shared KiB":>11} {"saved KiB":>10}'
+        )
+        total_copied = total_shared = 0
+        for alias in data_aliases():
+            with use_shard(alias):
+                recommendations = FertilizerRecommendation.objects.count()
+                snapshots = InputSnapshot.objects.count()
+            copied, shared = storage_estimate(recommendations, snapshots)
+            total_copied += copied
+            total_shared += shared
+            self.stdout.write(
+                f'{alias:<10} {recommendations:>15} {snapshots:>10} {copied / 1024:>11.1f} '
+                f'{shared / 1024:>11.1f} {(copied - shared) / 1024:>10.1f}'
+            )
+
+        saved = total_copied - total_shared
+        if saved > 0:
+            self.stdout.write(self.style.SUCCESS(
+                f'~{saved / 1024:.1f} KiB saved ({saved / (total_copied or 1):.0%} of the copied inputs).'
+            ))
+        else:
+            self.stdout.write('No saving at this size: too few recommendations share their inputs.')
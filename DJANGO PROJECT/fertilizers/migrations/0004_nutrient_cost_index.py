@@ -0,0 +1,62 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:12
+
+from django.db import migrations, models
+
+
+UNIT_KG = {'kg': 1, 'bag': 50, 'ton': 1000}
+
+
+def backfill_nutrient_costs(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    FertilizerProduct = apps.get_model('fertilizers', 'FertilizerProduct')
+    products = list(FertilizerProduct.objects.using(db_alias).all())
+    for product in products:
+        price_per_kg = float(product.price_per_unit) / UNIT_KG.get(product.unit, 1)
+        fractions = {
+            'cost_per_kg_n': product.nitrogen_percent / 100,
+            'cost_per_kg_p': product.phosphorus_percent / 100 * 0.436,
+            'cost_per_kg_k': product.potassium_percent / 100 * 0.83,
+        }
+        for field, fraction in fractions.items():
+            setattr(product, field, price_per_kg / fraction if fraction > 0 else None)
+    FertilizerProduct.objects.using(db_alias).bulk_update(
+        products, ['cost_per_kg_n', 'cost_per_kg_p', 'cost_per_kg_k'], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0003_price_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fertilizerproduct',
+            name='cost_per_kg_k',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fertilizerproduct',
+            name='cost_per_kg_n',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fertilizerproduct',
+            name='cost_per_kg_p',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['cost_per_kg_n'], name='fert_product_cost_n_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['cost_per_kg_p'], name='fert_product_cost_p_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['cost_per_kg_k'], name='fert_product_cost_k_idx'),
+        ),
+        migrations.RunPython(backfill_nutrient_costs, migrations.RunPython.noop),
+    ]
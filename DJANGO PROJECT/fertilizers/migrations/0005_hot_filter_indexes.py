@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0004_nutrient_cost_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-nitrogen_percent'], name='fert_product_active_n_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-phosphorus_percent'], name='fert_product_active_p_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-potassium_percent'], name='fert_product_active_k_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerrecommendation',
+            index=models.Index(fields=['user', '-generated_at'], name='fert_rec_user_generated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerrecommendation',
+            index=models.Index(fields=['user', 'parcel', '-generated_at'], name='fert_rec_user_parcel_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recommendationitem',
+            index=models.Index(fields=['recommendation', 'fertilizer'], name='fert_rec_item_rec_idx'),
+        ),
+    ]
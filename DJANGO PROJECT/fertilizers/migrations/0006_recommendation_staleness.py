@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0005_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fertilizerproduct',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='fertilizerrecommendation',
+            name='crop_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='fertilizerrecommendation',
+            name='is_stale',
+            field=models.BooleanField(default=False, help_text='An input changed after this was computed'),
+        ),
+        migrations.AddField(
+            model_name='fertilizerrecommendation',
+            name='parcel_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='fertilizerrecommendation',
+            name='soil_test_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recommendationitem',
+            name='fertilizer_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerrecommendation',
+            index=models.Index(condition=models.Q(('is_stale', True), ('status', 'draft')), fields=['id'], name='fert_rec_stale_draft_idx'),
+        ),
+    ]
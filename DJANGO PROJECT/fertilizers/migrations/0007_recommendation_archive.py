@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parcels', '0003_input_versions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fertilizers', '0006_recommendation_staleness'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveIntegerField(unique=True)),
+                ('parcel_name', models.CharField(max_length=200)),
+                ('generated_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('finalized', 'Finalized'), ('applied', 'Applied')], max_length=20)),
+                ('estimated_total_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('data', models.BinaryField()),
+                ('parcel', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_recommendations', to='parcels.landparcel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_recommendations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-generated_at'],
+                'indexes': [models.Index(fields=['user', '-generated_at'], name='fert_archive_user_gen_idx')],
+            },
+        ),
+    ]
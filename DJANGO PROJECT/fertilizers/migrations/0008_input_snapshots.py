@@ -0,0 +1,145 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:05
+
+import hashlib
+import json
+import logging
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+VALUE_FIELDS = [
+    'crop_nitrogen_requirement', 'crop_phosphorus_requirement', 'crop_potassium_requirement',
+    'soil_nitrogen_ppm', 'soil_phosphorus_ppm', 'soil_potassium_ppm', 'soil_ph',
+]
+
+BATCH_SIZE = 2000
+
+# SQLite stores a REAL in 8 bytes and a small integer key in at most 8
+VALUE_BYTES = 8
+KEY_BYTES = 8
+
+logger = logging.getLogger('django.db.migrations')
+
+
+def hash_values(values):
+    payload = json.dumps([float(value) for value in values])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def backfill_input_snapshots(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    FertilizerRecommendation = apps.get_model('fertilizers', 'FertilizerRecommendation')
+    InputSnapshot = apps.get_model('fertilizers', 'InputSnapshot')
+
+    snapshot_ids = {}
+    rows = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            FertilizerRecommendation.objects.using(db_alias).filter(pk__gt=last_pk)
+            .order_by('pk').values_list('pk', *VALUE_FIELDS)[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        rows += len(batch)
+
+        by_hash = {hash_values(row[1:]): row[1:] for row in batch}
+        missing = [content_hash for content_hash in by_hash if content_hash not in snapshot_ids]
+        InputSnapshot.objects.using(db_alias).bulk_create([
+            InputSnapshot(content_hash=content_hash, **dict(zip(VALUE_FIELDS, by_hash[content_hash])))
+            for content_hash in missing
+        ])
+        snapshot_ids.update(
+            InputSnapshot.objects.using(db_alias).filter(content_hash__in=missing).values_list('content_hash', 'pk')
+        )
+
+        pks_by_snapshot = defaultdict(list)
+        for row in batch:
+            pks_by_snapshot[snapshot_ids[hash_values(row[1:])]].append(row[0])
+        for snapshot_id, pks in pks_by_snapshot.items():
+            FertilizerRecommendation.objects.using(db_alias).filter(pk__in=pks).update(inputs_id=snapshot_id)
+
+    if rows:
+        # `manage.py snapshot_stats` reports the same figures later on
+        before = rows * len(VALUE_FIELDS) * VALUE_BYTES
+        after = len(snapshot_ids) * (len(VALUE_FIELDS) * VALUE_BYTES + 64 + KEY_BYTES) + rows * KEY_BYTES
+        logger.info(
+            '%s: %d recommendations share %d input snapshots; ~%.1f KiB of copied values now take ~%.1f KiB',
+            db_alias, rows, len(snapshot_ids), before / 1024, after / 1024,
+        )
+
+
+def restore_copied_inputs(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    FertilizerRecommendation = apps.get_model('fertilizers', 'FertilizerRecommendation')
+    InputSnapshot = apps.get_model('fertilizers', 'InputSnapshot')
+    for snapshot in InputSnapshot.objects.using(db_alias).all():
+        FertilizerRecommendation.objects.using(db_alias).filter(inputs_id=snapshot.pk).update(
+            **{field: getattr(snapshot, field) for field in VALUE_FIELDS}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0007_recommendation_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InputSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(editable=False, max_length=64, unique=True)),
+                ('crop_nitrogen_requirement', models.FloatField(default=0)),
+                ('crop_phosphorus_requirement', models.FloatField(default=0)),
+                ('crop_potassium_requirement', models.FloatField(default=0)),
+                ('soil_nitrogen_ppm', models.FloatField(default=0)),
+                ('soil_phosphorus_ppm', models.FloatField(default=0)),
+                ('soil_potassium_ppm', models.FloatField(default=0)),
+                ('soil_ph', models.FloatField(default=7.0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fertilizerrecommendation',
+            name='inputs',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='recommendations', to='fertilizers.inputsnapshot'),
+        ),
+        migrations.RunPython(backfill_input_snapshots, restore_copied_inputs),
+        migrations.RemoveField(
+            model_name='fertilizerrecommendation',
+            name='crop_nitrogen_requirement',
+        ),
+        migrations.RemoveField(
+            model_name='fertilizerrecommendation',
+            name='crop_phosphorus_requirement',
+        ),
+        migrations.RemoveField(
+            model_name='fertilizerrecommendation',
+            name='crop_potassium_requirement',
+        ),
+        migrations.RemoveField(
+            model_name='fertilizerrecommendation',
+            name='soil_nitrogen_ppm',
+        ),
+        migrations.RemoveField(
+            model_name='fertilizerrecommendation',
+            name='soil_phosphorus_ppm',
+        ),
+        migrations.RemoveField(
+            model_name='fertilizerrecommendation',
+            name='soil_potassium_ppm',
+        ),
+        migrations.RemoveField(
+            model_name='fertilizerrecommendation',
+            name='soil_ph',
+        ),
+        migrations.AlterField(
+            model_name='fertilizerrecommendation',
+            name='inputs',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='recommendations', to='fertilizers.inputsnapshot'),
+        ),
+    ]
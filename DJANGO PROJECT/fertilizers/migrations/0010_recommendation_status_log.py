@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('fertilizers', '0009_bulk_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('draft', 'Draft'), ('finalized', 'Finalized'), ('applied', 'Applied')], max_length=20)),
+                ('to_status', models.CharField(choices=[('draft', 'Draft'), ('finalized', 'Finalized'), ('applied', 'Applied')], max_length=20)),
+                ('source', models.CharField(choices=[('api', 'API'), ('web', 'Web'), ('admin', 'Admin'), ('bulk_job', 'Admin bulk job')], max_length=20)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-changed_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerrecommendation',
+            index=models.Index(fields=['user', 'status', '-generated_at'], name='fert_rec_user_status_idx'),
+        ),
+        migrations.AddField(
+            model_name='recommendationstatuschange',
+            name='changed_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='recommendationstatuschange',
+            name='recommendation',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='status_changes', to='fertilizers.fertilizerrecommendation'),
+        ),
+        migrations.AddIndex(
+            model_name='recommendationstatuschange',
+            index=models.Index(fields=['recommendation', 'changed_at'], name='fert_status_change_rec_idx'),
+        ),
+    ]
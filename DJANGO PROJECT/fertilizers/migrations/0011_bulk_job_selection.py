@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:40
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_unfinished_jobs(apps, schema_editor):
+    # Their selections were stored as id lists, which the worker no longer reads
+    BulkJob = apps.get_model('fertilizers', 'BulkJob')
+    BulkJob.objects.using(schema_editor.connection.alias).filter(status__in=['queued', 'running']).update(
+        status='failed',
+        error='Queued before bulk jobs stored their selection as a query; run the action again.',
+        finished_at=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0010_recommendation_status_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_unfinished_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='bulkjob',
+            name='object_ids',
+        ),
+        migrations.AddField(
+            model_name='bulkjob',
+            name='selection',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='bulkjob',
+            name='last_id',
+            field=models.BigIntegerField(default=0, help_text='Highest id when the job was queued'),
+        ),
+        migrations.AddField(
+            model_name='bulkjob',
+            name='cursor',
+            field=models.BigIntegerField(default=0, help_text='Last id processed'),
+        ),
+        migrations.AddField(
+            model_name='bulkjob',
+            name='lease',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='bulkjob',
+            name='total',
+            field=models.PositiveIntegerField(blank=True, help_text='Counted when the job first runs', null=True),
+        ),
+    ]
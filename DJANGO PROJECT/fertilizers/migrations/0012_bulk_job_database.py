@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0011_bulk_job_selection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkjob',
+            name='database',
+            field=models.CharField(default='default', max_length=50),
+        ),
+    ]
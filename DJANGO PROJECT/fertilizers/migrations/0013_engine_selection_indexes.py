@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0012_bulk_job_database'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='fertilizerproduct',
+            name='fert_product_active_n_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='fertilizerproduct',
+            name='fert_product_active_p_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='fertilizerproduct',
+            name='fert_product_active_k_idx',
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-nitrogen_percent', 'name', 'id'], name='fert_product_active_n_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-phosphorus_percent', 'name', 'id'], name='fert_product_active_p_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fertilizerproduct',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-potassium_percent', 'name', 'id'], name='fert_product_active_k_idx'),
+        ),
+    ]
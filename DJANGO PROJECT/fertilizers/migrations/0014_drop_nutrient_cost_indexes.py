@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:52
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0013_engine_selection_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='fertilizerproduct',
+            name='fert_product_cost_n_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='fertilizerproduct',
+            name='fert_product_cost_p_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='fertilizerproduct',
+            name='fert_product_cost_k_idx',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 21:10
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_unfinished_jobs(apps, schema_editor):
+    # Their selections were stored as pickled queries, which the worker no longer reads
+    BulkJob = apps.get_model('fertilizers', 'BulkJob')
+    BulkJob.objects.using(schema_editor.connection.alias).filter(status__in=['queued', 'running']).update(
+        status='failed',
+        error='Queued before bulk jobs stored their selection as filters; run the action again.',
+        finished_at=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fertilizers', '0014_drop_nutrient_cost_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_unfinished_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='bulkjob',
+            name='selection',
+        ),
+        migrations.AddField(
+            model_name='bulkjob',
+            name='selection',
+            field=models.JSONField(default=dict),
+        ),
+    ]
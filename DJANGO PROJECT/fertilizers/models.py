@@ -1,15 +1,57 @@
-from django.db import models
+import hashlib
+import json
+
+from django.db import DEFAULT_DB_ALIAS, models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+from fertilizer_planner.cache import bump_user_version, is_cascaded_delete
+from fertilizer_planner.sharding import on_sender_database, replicate_on_commit
+from fertilizer_planner.versioning import VersionedModel
 from parcels.models import LandParcel
+from .cache import bump_catalog_version, invalidate_product, invalidate_recommendations
+from .money import to_cents
+
+
+# Elemental nutrient content of the oxide forms used on fertilizer labels
+P2O5_TO_P = 0.436
+K2O_TO_K = 0.83
+
+# Kilograms per pricing unit
+UNIT_KG = {
+    'kg': 1,
+    'bag': 50,
+    'ton': 1000,
+}
 
+# Nutrient -> FertilizerProduct field holding its price per kg of the element
+NUTRIENT_COST_FIELDS = {
+    'N': 'cost_per_kg_n',
+    'P': 'cost_per_kg_p',
+    'K': 'cost_per_kg_k',
+}
 
-class FertilizerProduct(models.Model):
+
+class FertilizerProduct(VersionedModel):
     UNIT_CHOICES = [
         ('kg', 'Kilogram'),
         ('ton', 'Ton'),
         ('bag', 'Bag (50kg)'),
     ]
     
+    # Fields derived from the above in save()
+    COST_FIELDS = list(NUTRIENT_COST_FIELDS.values())
+
+    # Fields the recommendation engine reads
+    VERSIONED_FIELDS = ('nitrogen_percent', 'phosphorus_percent', 'potassium_percent',
+                        'price_per_unit', 'unit', 'is_active')
+
+    # Fields that decide which product the engine picks for a nutrient
+    GRADE_FIELDS = ('nitrogen_percent', 'phosphorus_percent', 'potassium_percent')
+    SELECTION_FIELDS = (*GRADE_FIELDS, 'is_active')
+    
     name = models.CharField(max_length=200)
     brand = models.CharField(max_length=100, blank=True)
     nitrogen_percent = models.FloatField(default=0, help_text="N percentage")
@@ -21,12 +63,140 @@ class FertilizerProduct(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    
+    # Price per kg of elemental nutrient (null when the product supplies none)
+    cost_per_kg_n = models.FloatField(null=True, blank=True, editable=False)
+    cost_per_kg_p = models.FloatField(null=True, blank=True, editable=False)
+    cost_per_kg_k = models.FloatField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.name} ({self.nitrogen_percent}-{self.phosphorus_percent}-{self.potassium_percent})"
 
+    @property
+    def kg_per_unit(self):
+        return UNIT_KG.get(self.unit, 1)
+
+    def to_product_units(self, quantity_kg):
+        """Convert a quantity in kg to this product's pricing unit."""
+        return quantity_kg / self.kg_per_unit
+
+    @cached_property
+    def price_cents(self):
+        """Price per unit in integer cents, converted once per instance."""
+        return to_cents(self.price_per_unit)
+
+    @property
+    def selectable(self):
+        """Whether the engine could pick this product for some nutrient."""
+        return self.is_active and any(getattr(self, field) > 0 for field in self.GRADE_FIELDS)
+
+    def selection_fields_changed(self):
+        """Whether a grade or is_active changed since the product was loaded."""
+        return bool(set(self.changed_versioned_fields()) & set(self.SELECTION_FIELDS))
+
+    def update_nutrient_costs(self):
+        """Recompute the cost per kg of N, P and K from price, unit and grade."""
+        self.__dict__.pop('price_cents', None)
+        price_per_kg = float(self.price_per_unit) / self.kg_per_unit
+        nutrient_fractions = {
+            'N': self.nitrogen_percent / 100,
+            'P': self.phosphorus_percent / 100 * P2O5_TO_P,
+            'K': self.potassium_percent / 100 * K2O_TO_K,
+        }
+        for nutrient, fraction in nutrient_fractions.items():
+            setattr(self, NUTRIENT_COST_FIELDS[nutrient], price_per_kg / fraction if fraction > 0 else None)
+
+    def save(self, *args, **kwargs):
+        self.update_nutrient_costs()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | set(self.COST_FIELDS)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Engine lookups: the active product richest in a nutrient, ties by name
+            models.Index(fields=['-nitrogen_percent', 'name', 'id'], name='fert_product_active_n_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['-phosphorus_percent', 'name', 'id'], name='fert_product_active_p_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['-potassium_percent', 'name', 'id'], name='fert_product_active_k_idx', condition=models.Q(is_active=True)),
+        ]
+
+
+class PriceHistory(models.Model):
+    product = models.ForeignKey(FertilizerProduct, on_delete=models.CASCADE, related_name='price_history')
+    old_price = models.DecimalField(max_digits=10, decimal_places=2)
+    new_price = models.DecimalField(max_digits=10, decimal_places=2)
+    changed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.product.name}: {self.old_price} -> {self.new_price}"
+
+    class Meta:
+        ordering = ['-changed_at']
+        verbose_name_plural = "Price history"
+
+
+class InputSnapshotQuerySet(models.QuerySet):
+    def for_values(self, values_list):
+        """
+        Get or create, in bulk, the snapshots for a list of dicts of
+        InputSnapshot.VALUE_FIELDS values: one lookup, then one insert and
+        one lookup for those not stored yet.
+
+        Returns the snapshots in the order of values_list.
+        """
+        hashes = [InputSnapshot.hash_values(values) for values in values_list]
+        found = {snapshot.content_hash: snapshot for snapshot in self.filter(content_hash__in=set(hashes))}
+        missing = {content_hash: values for content_hash, values in zip(hashes, values_list)
+                   if content_hash not in found}
+        if missing:
+            # A concurrent insert of the same inputs is fine: the hash is unique
+            self.bulk_create([
+                InputSnapshot(content_hash=content_hash, **values) for content_hash, values in missing.items()
+            ], ignore_conflicts=True)
+            found.update({snapshot.content_hash: snapshot for snapshot in self.filter(content_hash__in=list(missing))})
+        return [found[content_hash] for content_hash in hashes]
+
+
+class InputSnapshot(models.Model):
+    """
+    The crop requirements and soil values a recommendation was computed
+    from, stored once per distinct set of values and identified by a hash
+    of them, so the many recommendations with identical inputs share a row.
+    """
+    VALUE_FIELDS = [
+        'crop_nitrogen_requirement', 'crop_phosphorus_requirement', 'crop_potassium_requirement',
+        'soil_nitrogen_ppm', 'soil_phosphorus_ppm', 'soil_potassium_ppm', 'soil_ph',
+    ]
+
+    content_hash = models.CharField(max_length=64, unique=True, editable=False)
+
+    # Crop requirements (stored for historical reference)
+    crop_nitrogen_requirement = models.FloatField(default=0)
+    crop_phosphorus_requirement = models.FloatField(default=0)
+    crop_potassium_requirement = models.FloatField(default=0)
+
+    # Soil status (stored for historical reference)
+    soil_nitrogen_ppm = models.FloatField(default=0)
+    soil_phosphorus_ppm = models.FloatField(default=0)
+    soil_potassium_ppm = models.FloatField(default=0)
+    soil_ph = models.FloatField(default=7.0)
+
+    objects = InputSnapshotQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Inputs {self.content_hash[:12]}"
+
+    @classmethod
+    def hash_values(cls, values):
+        """SHA-256 of the VALUE_FIELDS values, as floats in field order."""
+        payload = json.dumps([float(values[field]) for field in cls.VALUE_FIELDS])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.hash_values({field: getattr(self, field) for field in self.VALUE_FIELDS})
+        super().save(*args, **kwargs)
 
 
 class FertilizerRecommendation(models.Model):
@@ -41,16 +211,9 @@ class FertilizerRecommendation(models.Model):
     generated_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     
-    # Crop requirements (stored for historical reference)
-    crop_nitrogen_requirement = models.FloatField(default=0)
-    crop_phosphorus_requirement = models.FloatField(default=0)
-    crop_potassium_requirement = models.FloatField(default=0)
-    
-    # Current soil status (stored for historical reference)
-    soil_nitrogen_ppm = models.FloatField(default=0)
-    soil_phosphorus_ppm = models.FloatField(default=0)
-    soil_potassium_ppm = models.FloatField(default=0)
-    soil_ph = models.FloatField(default=7.0)
+    # Crop requirements and soil status at generation time, shared between
+    # recommendations with identical inputs
+    inputs = models.ForeignKey(InputSnapshot, on_delete=models.PROTECT, related_name='recommendations')
     
     # Calculated nutrient needs
     nitrogen_needed_kg = models.FloatField(default=0)
@@ -61,12 +224,27 @@ class FertilizerRecommendation(models.Model):
     estimated_total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
     notes = models.TextField(blank=True)
+
+    # Versions of the inputs this was computed from (see fertilizers.staleness)
+    parcel_version = models.PositiveIntegerField(default=0, editable=False)
+    crop_version = models.PositiveIntegerField(default=0, editable=False)
+    soil_test_version = models.PositiveIntegerField(default=0, editable=False)
+    is_stale = models.BooleanField(default=False, help_text="An input changed after this was computed")
     
     def __str__(self):
         return f"Recommendation for {self.parcel.name} - {self.generated_at.strftime('%Y-%m-%d')}"
 
     class Meta:
         ordering = ['-generated_at']
+        indexes = [
+            models.Index(fields=['user', '-generated_at'], name='fert_rec_user_generated_idx'),
+            models.Index(fields=['user', 'parcel', '-generated_at'], name='fert_rec_user_parcel_idx'),
+            # The history page's status filter
+            models.Index(fields=['user', 'status', '-generated_at'], name='fert_rec_user_status_idx'),
+            # The regeneration worker's queue
+            models.Index(fields=['id'], name='fert_rec_stale_draft_idx',
+                         condition=models.Q(is_stale=True, status='draft')),
+        ]
 
 
 class RecommendationItem(models.Model):
@@ -81,9 +259,267 @@ class RecommendationItem(models.Model):
     phosphorus_contribution_kg = models.FloatField(default=0)
     potassium_contribution_kg = models.FloatField(default=0)
 
+    # Version of the fertilizer this was computed from
+    fertilizer_version = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         return f"{self.fertilizer.name} - {self.quantity} {self.unit}"
 
     class Meta:
         ordering = ['recommendation', 'fertilizer']
+        indexes = [
+            models.Index(fields=['recommendation', 'fertilizer'], name='fert_rec_item_rec_idx'),
+        ]
+
+
+
+class ArchivedRecommendation(models.Model):
+    """
+    A recommendation moved out of the live tables by the archive command.
+    The recommendation and its items are kept as one zlib-compressed JSON
+    document (see fertilizers.archive); the columns beside it are what the
+    history page lists without decompressing anything.
+    """
+    original_id = models.PositiveIntegerField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_recommendations')
+    parcel = models.ForeignKey(LandParcel, on_delete=models.SET_NULL, null=True, blank=True,
+                               related_name='archived_recommendations')
+    parcel_name = models.CharField(max_length=200)
+    generated_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=FertilizerRecommendation.STATUS_CHOICES)
+    estimated_total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f"Archived recommendation for {self.parcel_name} - {self.generated_at.strftime('%Y-%m-%d')}"
+
+    class Meta:
+        ordering = ['-generated_at']
+        indexes = [
+            models.Index(fields=['user', '-generated_at'], name='fert_archive_user_gen_idx'),
+        ]
+
+
+class BulkJob(models.Model):
+    """
+    An admin bulk action over many parcels or recommendations, run in
+    batches outside the request by fertilizers.bulk_jobs.
+
+    selection is the ticked ids or, for "select all", the changelist's
+    filters and search term as JSON, so queuing it reads nothing; database
+    is where it runs, the shard the admin was working on. The worker walks it in
+    primary key order up to last_id, the highest id when it was queued;
+    cursor is the last id done and is saved in the same transaction as
+    each batch's work, by the worker holding the job's lease.
+    """
+    ACTION_CHOICES = [
+        ('regenerate', 'Regenerate recommendations'),
+        ('finalize', 'Finalize drafts'),
+        ('delete', 'Delete'),
+    ]
+    TARGET_CHOICES = [
+        ('parcel', 'Land parcels'),
+        ('recommendation', 'Recommendations'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='bulk_jobs')
+    selection = models.JSONField(default=dict)
+    database = models.CharField(max_length=50, default=DEFAULT_DB_ALIAS)
+    last_id = models.BigIntegerField(default=0, help_text="Highest id when the job was queued")
+    cursor = models.BigIntegerField(default=0, help_text="Last id processed")
+    # Set when a worker claims the job; only that worker can record progress
+    lease = models.CharField(max_length=32, blank=True)
+    total = models.PositiveIntegerField(null=True, blank=True, help_text="Counted when the job first runs")
+    processed = models.PositiveIntegerField(default=0)
+    changed = models.PositiveIntegerField(default=0, help_text="Rows regenerated, finalized or deleted")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        count = 'selected' if self.total is None else self.total
+        return f"{self.get_action_display()} - {count} {self.get_target_display().lower()}"
+
+    @property
+    def percent_done(self):
+        if self.status == 'done':
+            return 100
+        return int(100 * self.processed / self.total) if self.total else 0
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='fert_bulk_job_status_idx'),
+        ]
+
+
+class RecommendationStatusChangeQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError("The recommendation status log is append-only")
+
+    def delete(self):
+        raise TypeError("The recommendation status log is append-only")
+
+    def delete_moved(self):
+        """
+        Remove log rows that now live in another database. Only
+        fertilizer_planner.sharding.move_user() calls this, for a user's
+        rows once they are copied to the database the user moves to (in
+        the same pair of transactions), or for the copies an interrupted
+        move left on that database. Returns the number removed.
+        """
+        return super().delete()[0]
+
+
+class RecommendationStatusChange(models.Model):
+    """
+    One status transition of a recommendation, written by
+    fertilizers.transitions (or the admin) and never changed afterwards.
+    The references carry no database constraint and are left alone when a
+    recommendation is archived or deleted, or a user removed, so the log
+    outlives them.
+    """
+    SOURCE_CHOICES = [
+        ('api', 'API'),
+        ('web', 'Web'),
+        ('admin', 'Admin'),
+        ('bulk_job', 'Admin bulk job'),
+    ]
+
+    recommendation = models.ForeignKey(FertilizerRecommendation, on_delete=models.DO_NOTHING, db_constraint=False,
+                                       related_name='status_changes')
+    from_status = models.CharField(max_length=20, choices=FertilizerRecommendation.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=FertilizerRecommendation.STATUS_CHOICES)
+    changed_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                                   related_name='+')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    objects = RecommendationStatusChangeQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Recommendation {self.recommendation_id}: {self.from_status} -> {self.to_status}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("The recommendation status log is append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("The recommendation status log is append-only")
+
+    class Meta:
+        ordering = ['-changed_at']
+        indexes = [
+            models.Index(fields=['recommendation', 'changed_at'], name='fert_status_change_rec_idx'),
+        ]
+
+
+@receiver(post_save, sender=FertilizerProduct)
+@receiver(post_delete, sender=FertilizerProduct)
+def invalidate_catalog_cache(sender, instance, **kwargs):
+    bump_catalog_version()
+    invalidate_product(instance.pk)
+
+
+@receiver(post_save, sender=FertilizerProduct)
+@receiver(post_delete, sender=FertilizerProduct)
+def replicate_product(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        replicate_on_commit(sender, [instance.pk], deleted=kwargs['signal'] is post_delete)
+
+
+@receiver(pre_save, sender=FertilizerProduct)
+@receiver(pre_delete, sender=FertilizerProduct)
+def remember_engine_selection(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Skipped for edits that can't move the engine's pick, such as a price
+    # or description change
+    instance._previous_selection = None
+    if using != DEFAULT_DB_ALIAS:
+        return
+    if kwargs['signal'] is pre_delete or instance._state.adding:
+        may_change = instance.selectable
+    else:
+        may_change = instance.selection_fields_changed()
+    if not may_change:
+        return
+    from .staleness import engine_selection
+    instance._previous_selection = engine_selection()
+
+
+@receiver(pre_delete, sender=FertilizerProduct)
+def mark_product_users_stale(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Before the delete cascades to the items that say who used it. The
+    # delete in 'default' flags them on every shard, before the copies go.
+    if using != DEFAULT_DB_ALIAS:
+        return
+    from .staleness import mark_products_stale
+    mark_products_stale([instance.pk])
+
+
+@receiver(post_save, sender=FertilizerProduct)
+def mark_product_recommendations_stale(sender, instance, created, using=DEFAULT_DB_ALIAS, **kwargs):
+    if using != DEFAULT_DB_ALIAS:
+        return
+    if created or instance.version_changed:
+        from .staleness import mark_products_stale
+        mark_products_stale([instance.pk], instance._previous_selection)
+
+
+@receiver(post_delete, sender=FertilizerProduct)
+def mark_replaced_product_users_stale(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    if using != DEFAULT_DB_ALIAS or instance._previous_selection is None:
+        return
+    from .staleness import mark_products_stale
+    mark_products_stale([], instance._previous_selection)
+
+
+@receiver(post_save, sender=FertilizerProduct)
+def update_search_index(sender, instance, **kwargs):
+    from .search import index_product
+    index_product(instance)
+
+
+@receiver(post_delete, sender=FertilizerProduct)
+def remove_from_search_index(sender, instance, **kwargs):
+    from .search import remove_product
+    remove_product(instance.pk)
+
+
+@receiver(post_save, sender=FertilizerRecommendation)
+@receiver(post_delete, sender=FertilizerRecommendation)
+def invalidate_recommendation_owner_cache(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
+    invalidate_recommendations([instance.pk])
+
+
+@receiver(post_save, sender=RecommendationItem)
+@receiver(post_delete, sender=RecommendationItem)
+@on_sender_database
+def invalidate_item_owner_cache(sender, instance, **kwargs):
+    if is_cascaded_delete(sender, kwargs.get('origin')):
+        return  # the recommendation (or parcel/user) delete bumps the owner's pages
+    invalidate_recommendations([instance.recommendation_id])
+    if RecommendationItem.recommendation.is_cached(instance):
+        user_id = instance.recommendation.user_id
+    else:
+        user_id = FertilizerRecommendation.objects.filter(
+            pk=instance.recommendation_id).values_list('user_id', flat=True).first()
+    bump_user_version(user_id)
+
 
+@receiver(post_save, sender=ArchivedRecommendation)
+@receiver(post_delete, sender=ArchivedRecommendation)
+def invalidate_archive_owner_cache(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
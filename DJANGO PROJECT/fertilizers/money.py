@@ -0,0 +1,26 @@
+"""
+Fixed-point money.
+
+The recommendation engine works in integer cents: a product's price is
+converted to cents once, each item's cost is rounded to whole cents once,
+and totals are exact integer sums, so a recommendation's total always
+equals the sum of its items and the same inputs always give the same
+figures. Decimals are only built when a value is stored in a DecimalField.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def to_cents(amount):
+    """Whole cents in a Decimal (or numeric string) amount, rounding half up."""
+    return int((Decimal(amount) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def cents_to_decimal(cents):
+    """An exact two-place Decimal for an integer number of cents."""
+    return Decimal(cents).scaleb(-2)
+
+
+def cents_to_float(cents):
+    """Cents as a float number of currency units, for JSON."""
+    return cents / 100
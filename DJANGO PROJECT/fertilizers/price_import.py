@@ -0,0 +1,165 @@
+"""
+Price Sheet Importer
+
+Applies supplier price sheets to the fertilizer catalog. The sheet is a CSV
+with a `price` column and either an `id` column or `name` (+ optional
+`brand`) columns identifying the product:
+
+    name,brand,price
+    Urea,Generic,0.55
+
+Rows are streamed and processed in batches: each batch is matched with one
+query, changed prices are written with bulk_update and recorded in
+PriceHistory with bulk_create. bulk_update sends no signals, so the catalog
+cache version is bumped once at the end of the import rather than per row,
+and each batch bumps the changed products' versions, copies them to the
+shard databases and flags the recommendations that use them stale itself.
+"""
+
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from fertilizer_planner.sharding import replicate_on_commit
+
+from .cache import bump_catalog_version
+from .models import FertilizerProduct, PriceHistory
+from .staleness import mark_products_stale
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class PriceSheetError(Exception):
+    """Raised when a price sheet cannot be read."""
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(str(value).strip().lstrip('$')).quantize(Decimal('0.01'))
+    except (InvalidOperation, AttributeError):
+        return None
+    return price if price >= 0 else None
+
+
+def _iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _match_products(batch, by_id):
+    """Return {row index: product} for the rows of a batch."""
+    if by_id:
+        ids = [row['id'] for row in batch if str(row.get('id', '')).strip().isdigit()]
+        products = FertilizerProduct.objects.in_bulk([int(pk) for pk in ids])
+        return {
+            index: products.get(int(row['id']))
+            for index, row in enumerate(batch)
+            if str(row.get('id', '')).strip().isdigit()
+        }
+
+    names = {row.get('name', '').strip() for row in batch}
+    products = {}
+    for product in FertilizerProduct.objects.filter(name__in=names):
+        products.setdefault((product.name, product.brand), product)
+        products.setdefault((product.name, None), product)
+    matched = {}
+    for index, row in enumerate(batch):
+        name = row.get('name', '').strip()
+        # A blank or missing brand matches the product by name alone
+        brand = (row.get('brand') or '').strip() or None
+        matched[index] = products.get((name, brand))
+    return matched
+
+
+def apply_price_batch(batch, by_id, changed_at):
+    """
+    Apply one batch of price rows.
+
+    Returns (updated, unchanged, skipped, stale) counts, stale being the
+    recommendations flagged.
+    """
+    matched = _match_products(batch, by_id)
+    to_update = {}
+    history = []
+    skipped = 0
+
+    for index, row in enumerate(batch):
+        product = matched.get(index)
+        price = _parse_price(row.get('price'))
+        if product is None or price is None:
+            skipped += 1
+            continue
+        # A product listed twice in a sheet keeps the last price
+        product = to_update.get(product.pk, product)
+        if product.price_per_unit == price:
+            continue
+        history.append(PriceHistory(
+            product=product,
+            old_price=product.price_per_unit,
+            new_price=price,
+            changed_at=changed_at,
+        ))
+        if product.pk not in to_update:
+            product.version += 1
+        product.price_per_unit = price
+        product.updated_at = changed_at
+        product.update_nutrient_costs()
+        to_update[product.pk] = product
+
+    FertilizerProduct.objects.bulk_update(
+        to_update.values(),
+        ['price_per_unit', 'updated_at', 'version'] + FertilizerProduct.COST_FIELDS,
+    )
+    PriceHistory.objects.bulk_create(history)
+    replicate_on_commit(FertilizerProduct, to_update)
+    # Prices don't change which product the engine picks, only the
+    # recommendations using these products
+    stale = mark_products_stale(list(to_update)) if to_update else 0
+    unchanged = len(batch) - skipped - len(history)
+    return len(to_update), unchanged, skipped, stale
+
+
+def import_price_sheet(fileobj, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Import a CSV price sheet.
+
+    Args:
+        fileobj: Text or binary file object containing the CSV
+        batch_size: Number of rows matched and written per batch
+
+    Returns:
+        Dict with 'rows', 'updated', 'unchanged', 'skipped' and 'stale'
+        (recommendations flagged) counts
+    """
+    if isinstance(fileobj, (io.BufferedIOBase, io.RawIOBase)) or 'b' in getattr(fileobj, 'mode', ''):
+        fileobj = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(fileobj)
+    columns = {name.strip().lower() for name in reader.fieldnames or []}
+    if 'price' not in columns or not ({'id', 'name'} & columns):
+        raise PriceSheetError("Price sheet needs a 'price' column and an 'id' or 'name' column")
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    by_id = 'id' in columns
+
+    summary = {'rows': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'stale': 0}
+    changed_at = timezone.now()
+    for batch in _iter_batches(reader, batch_size):
+        with transaction.atomic():
+            updated, unchanged, skipped, stale = apply_price_batch(batch, by_id, changed_at)
+        summary['rows'] += len(batch)
+        summary['updated'] += updated
+        summary['unchanged'] += unchanged
+        summary['skipped'] += skipped
+        summary['stale'] += stale
+
+    if summary['updated']:
+        bump_catalog_version()
+    return summary
@@ -0,0 +1,124 @@
+"""
+Procurement planning.
+
+Sums the fertilizer quantities of many recommendations per product, for
+buying in bulk. Recommendation items are stored in the product's pricing
+unit at the time (kg, bag or ton), so quantities are converted to kg inside
+the aggregate query: one GROUP BY over the items, however many
+recommendations are selected. Totals are then rounded up to whole bags (or
+tons, for products sold by the ton) and priced at today's catalog price.
+"""
+
+import math
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Case, Count, F, FloatField, Sum, When
+
+from .models import UNIT_KG, RecommendationItem
+
+
+CENTS = Decimal('0.01')
+
+
+def quantity_in_kg():
+    """SQL expression for a RecommendationItem's quantity in kg."""
+    return Case(
+        *[When(unit=unit, then=F('quantity') * kg) for unit, kg in UNIT_KG.items() if kg != 1],
+        default=F('quantity'),
+        output_field=FloatField(),
+    )
+
+
+def purchase_unit(product_unit):
+    """Products sold by the ton are bought in tons, everything else in bags."""
+    return 'ton' if product_unit == 'ton' else 'bag'
+
+
+def procurement_lines(recommendations):
+    """
+    Aggregate the items of a queryset of recommendations per product.
+
+    Returns a list of dicts, largest total first, with the product's id,
+    name, brand, unit and price, 'total_kg', 'recommended_cost' (the sum of
+    the item costs), 'recommendations' (how many recommendations use it),
+    'purchase_unit', 'purchase_quantity' (whole bags or tons) and
+    'purchase_cost'.
+    """
+    rows = (
+        RecommendationItem.objects
+        .filter(recommendation__in=recommendations.values('pk'))
+        .values(
+            'fertilizer_id', 'fertilizer__name', 'fertilizer__brand',
+            'fertilizer__unit', 'fertilizer__price_per_unit',
+        )
+        .annotate(
+            total_kg=Sum(quantity_in_kg()),
+            recommended_cost=Sum('cost'),
+            recommendations=Count('recommendation', distinct=True),
+        )
+        .order_by('-total_kg')
+    )
+
+    return [
+        _line(
+            row['fertilizer_id'], row['fertilizer__name'], row['fertilizer__brand'], row['fertilizer__unit'],
+            row['fertilizer__price_per_unit'], row['total_kg'], row['recommended_cost'], row['recommendations'],
+        )
+        for row in rows
+    ]
+
+
+def _line(fertilizer_id, name, brand, unit, price_per_unit, total_kg, recommended_cost, recommendations):
+    pack_unit = purchase_unit(unit)
+    pack_kg = UNIT_KG[pack_unit]
+    # Round before ceil so float noise (100.0000001 kg) doesn't buy an extra bag
+    quantity = math.ceil(round(total_kg / pack_kg, 6))
+    price_per_kg = price_per_unit / UNIT_KG.get(unit, 1)
+    return {
+        'fertilizer_id': fertilizer_id,
+        'name': name,
+        'brand': brand,
+        'unit': unit,
+        'price_per_unit': price_per_unit,
+        'total_kg': total_kg,
+        'recommended_cost': recommended_cost.quantize(CENTS, ROUND_HALF_UP),
+        'recommendations': recommendations,
+        'purchase_unit': pack_unit,
+        'purchase_quantity': quantity,
+        'purchase_cost': (price_per_kg * quantity * pack_kg).quantize(CENTS, ROUND_HALF_UP),
+    }
+
+
+def merge_procurement_lines(*line_lists):
+    """
+    Combine the procurement_lines() of recommendations stored in different
+    databases (one list per shard) into one plan, re-rounding the purchase
+    quantities of the summed totals.
+    """
+    if len(line_lists) == 1:
+        return line_lists[0]
+    merged = {}
+    for line in (line for lines in line_lists for line in lines):
+        total = merged.get(line['fertilizer_id'])
+        if total is None:
+            merged[line['fertilizer_id']] = dict(line)
+        else:
+            for field in ('total_kg', 'recommended_cost', 'recommendations'):
+                total[field] += line[field]
+    lines = [
+        _line(
+            line['fertilizer_id'], line['name'], line['brand'], line['unit'], line['price_per_unit'],
+            line['total_kg'], line['recommended_cost'], line['recommendations'],
+        )
+        for line in merged.values()
+    ]
+    lines.sort(key=lambda line: line['total_kg'], reverse=True)
+    return lines
+
+
+def procurement_totals(lines):
+    return {
+        'total_kg': sum(line['total_kg'] for line in lines),
+        'recommended_cost': sum((line['recommended_cost'] for line in lines), Decimal(0)),
+        'purchase_cost': sum((line['purchase_cost'] for line in lines), Decimal(0)),
+    }
@@ -5,8 +5,25 @@ This module contains the logic for generating fertilizer recommendations
 based on soil test data, crop requirements, and available fertilizer products.
 """
 
+from django.conf import settings
+from django.db import transaction
+
+from fertilizer_planner.cache import get_or_set_versioned
+from fertilizer_planner.sharding import current_shard
 from parcels.models import LandParcel, SoilTest, Crop
-from .models import FertilizerProduct, FertilizerRecommendation, RecommendationItem
+from .cache import CATALOG_NAMESPACE
+from .money import cents_to_decimal
+from .models import (
+    FertilizerProduct, FertilizerRecommendation, InputSnapshot, RecommendationItem, P2O5_TO_P, K2O_TO_K,
+)
+
+
+# (nutrient, product grade field, oxide -> element factor, item contribution field)
+NUTRIENTS = [
+    ('nitrogen', 'nitrogen_percent', 1, 'nitrogen_contribution_kg'),
+    ('phosphorus', 'phosphorus_percent', P2O5_TO_P, 'phosphorus_contribution_kg'),
+    ('potassium', 'potassium_percent', K2O_TO_K, 'potassium_contribution_kg'),
+]
 
 
 def convert_ppm_to_kg_per_hectare(ppm_value, depth_cm=15, bulk_density=1.3):
@@ -48,7 +65,153 @@ def calculate_nutrient_deficit(crop_requirement, soil_content_kg_ha, area_hectar
     return adjusted_deficit * area_hectares
 
 
-def generate_recommendation(parcel_id, user, notes=''):
+def load_catalog():
+    """
+    Pick the fertilizer used for each nutrient: the active product with the
+    highest content of it. Cached until the catalog version changes.
+
+    Returns:
+        Dict mapping 'nitrogen'/'phosphorus'/'potassium' to a
+        FertilizerProduct (or None when no active product supplies it)
+    """
+    return get_or_set_versioned(CATALOG_NAMESPACE, ['engine'], select_products, settings.CATALOG_CACHE_TIMEOUT)
+
+
+def select_products():
+    """
+    The uncached selection behind load_catalog(): one LIMIT 1 lookup per
+    nutrient through the partial index on active products' grades, so it
+    doesn't grow with the catalog.
+    """
+    active = FertilizerProduct.objects.filter(is_active=True)
+    return {
+        nutrient: active.filter(**{f'{percent_field}__gt': 0})
+        .order_by(f'-{percent_field}', 'name', 'pk').first()
+        for nutrient, percent_field, _, _ in NUTRIENTS
+    }
+
+
+def compute_recommendation(crop_requirements, soil_ppm, area_ha, catalog=None):
+    """
+    Compute nutrient needs and fertilizer quantities without touching the
+    database (apart from loading the catalog when none is given).
+    
+    Args:
+        crop_requirements: Dict of 'nitrogen'/'phosphorus'/'potassium' kg/ha
+        soil_ppm: Dict of 'nitrogen'/'phosphorus'/'potassium' ppm
+        area_ha: Area in hectares
+        catalog: Result of load_catalog(), shared across a batch
+    
+    Returns:
+        Dict with '<nutrient>_needed_kg' values, 'items' (list of dicts
+        with fertilizer, quantity, unit, cost_cents and contribution) and
+        'total_cost_cents', the exact sum of the items' integer cents
+    """
+    if catalog is None:
+        catalog = load_catalog()
+    
+    result = {'items': [], 'total_cost_cents': 0}
+    
+    for nutrient, percent_field, oxide_factor, contribution_field in NUTRIENTS:
+        # Convert soil nutrients from ppm to kg/ha and work out the deficit
+        soil_kg_ha = convert_ppm_to_kg_per_hectare(soil_ppm[nutrient])
+        needed = calculate_nutrient_deficit(crop_requirements[nutrient], soil_kg_ha, area_ha)
+        result[f'{nutrient}_needed_kg'] = needed
+        
+        fert = catalog.get(nutrient)
+        if needed <= 0 or fert is None:
+            continue
+        
+        # Label grades are oxides for P and K; convert to the element
+        content = getattr(fert, percent_field) / 100 * oxide_factor
+        fert_quantity = fert.to_product_units(needed / content)
+        # Rounded to whole cents once per item; the total is an exact integer sum
+        cost_cents = round(fert_quantity * fert.price_cents)
+        
+        result['items'].append({
+            'fertilizer': fert,
+            'quantity': round(fert_quantity, 2),
+            'unit': fert.unit,
+            'cost_cents': cost_cents,
+            contribution_field: needed,
+        })
+        result['total_cost_cents'] += cost_cents
+    
+    return result
+
+
+def input_values(crop, soil_test):
+    """The InputSnapshot values for a crop and soil test."""
+    return {
+        'crop_nitrogen_requirement': crop.nitrogen_requirement,
+        'crop_phosphorus_requirement': crop.phosphorus_requirement,
+        'crop_potassium_requirement': crop.potassium_requirement,
+        'soil_nitrogen_ppm': soil_test.nitrogen_ppm,
+        'soil_phosphorus_ppm': soil_test.phosphorus_ppm,
+        'soil_potassium_ppm': soil_test.potassium_ppm,
+        'soil_ph': soil_test.ph_level,
+    }
+
+
+def recommendation_values(parcel, crop, soil_test, result):
+    """
+    The fields of a recommendation computed for a parcel, apart from its
+    inputs snapshot: the results and the versions they were computed from.
+    """
+    return {
+        'nitrogen_needed_kg': result['nitrogen_needed_kg'],
+        'phosphorus_needed_kg': result['phosphorus_needed_kg'],
+        'potassium_needed_kg': result['potassium_needed_kg'],
+        'estimated_total_cost': cents_to_decimal(result['total_cost_cents']),
+        'parcel_version': parcel.version,
+        'crop_version': crop.version,
+        'soil_test_version': soil_test.version,
+        'is_stale': False,
+    }
+
+
+def item_values(item):
+    """The fields of a RecommendationItem for one entry of result['items']."""
+    values = dict(item, cost=cents_to_decimal(item['cost_cents']), fertilizer_version=item['fertilizer'].version)
+    del values['cost_cents']
+    return values
+
+
+def save_recommendation(parcel, user, crop, soil_test, result, notes=''):
+    """Persist a computed recommendation and its items."""
+    with transaction.atomic(using=current_shard()):
+        [inputs] = InputSnapshot.objects.for_values([input_values(crop, soil_test)])
+        recommendation = FertilizerRecommendation.objects.create(
+            user=user,
+            parcel=parcel,
+            inputs=inputs,
+            notes=notes,
+            **recommendation_values(parcel, crop, soil_test, result),
+        )
+        RecommendationItem.objects.bulk_create([
+            RecommendationItem(recommendation=recommendation, **item_values(item))
+            for item in result['items']
+        ])
+    return recommendation
+
+
+def crop_requirements_of(crop):
+    return {
+        'nitrogen': crop.nitrogen_requirement,
+        'phosphorus': crop.phosphorus_requirement,
+        'potassium': crop.potassium_requirement,
+    }
+
+
+def soil_ppm_of(soil_test):
+    return {
+        'nitrogen': soil_test.nitrogen_ppm,
+        'phosphorus': soil_test.phosphorus_ppm,
+        'potassium': soil_test.potassium_ppm,
+    }
+
+
+def generate_recommendation(parcel_id, user, notes='', catalog=None):
     """
     Generate fertilizer recommendation for a land parcel.
     
@@ -56,12 +219,18 @@ def generate_recommendation(parcel_id, user, notes=''):
         parcel_id: ID of the LandParcel
         user: User object
         notes: Optional notes for the recommendation
+        catalog: Optional result of load_catalog(), to share one catalog
+            read across many parcels
     
     Returns:
         FertilizerRecommendation object
     """
-    parcel = LandParcel.objects.get(pk=parcel_id, user=user)
-    
+    parcel = LandParcel.objects.select_related('crop').get(pk=parcel_id, user=user)
+    return generate_for_parcel(parcel, user, notes, catalog)
+
+
+def generate_for_parcel(parcel, user, notes='', catalog=None):
+    """Generate and save a recommendation for an already loaded parcel."""
     # Check if parcel has crop and soil test
     if not parcel.crop:
         raise ValueError("Parcel must have a crop assigned")
@@ -71,171 +240,10 @@ def generate_recommendation(parcel_id, user, notes=''):
     except SoilTest.DoesNotExist:
         raise ValueError("Soil test data required for recommendation")
     
-    crop = parcel.crop
-    area_ha = parcel.area_hectares
-    
-    # Convert soil nutrients from ppm to kg/ha
-    soil_n_kg_ha = convert_ppm_to_kg_per_hectare(soil_test.nitrogen_ppm)
-    soil_p_kg_ha = convert_ppm_to_kg_per_hectare(soil_test.phosphorus_ppm)
-    soil_k_kg_ha = convert_ppm_to_kg_per_hectare(soil_test.potassium_ppm)
-    
-    # Calculate nutrient requirements
-    n_needed = calculate_nutrient_deficit(
-        crop.nitrogen_requirement, 
-        soil_n_kg_ha, 
-        area_ha
-    )
-    p_needed = calculate_nutrient_deficit(
-        crop.phosphorus_requirement, 
-        soil_p_kg_ha, 
-        area_ha
-    )
-    k_needed = calculate_nutrient_deficit(
-        crop.potassium_requirement, 
-        soil_k_kg_ha, 
-        area_ha
-    )
-    
-    # Create recommendation record
-    recommendation = FertilizerRecommendation.objects.create(
-        user=user,
-        parcel=parcel,
-        crop_nitrogen_requirement=crop.nitrogen_requirement,
-        crop_phosphorus_requirement=crop.phosphorus_requirement,
-        crop_potassium_requirement=crop.potassium_requirement,
-        soil_nitrogen_ppm=soil_test.nitrogen_ppm,
-        soil_phosphorus_ppm=soil_test.phosphorus_ppm,
-        soil_potassium_ppm=soil_test.potassium_ppm,
-        soil_ph=soil_test.ph_level,
-        nitrogen_needed_kg=n_needed,
-        phosphorus_needed_kg=p_needed,
-        potassium_needed_kg=k_needed,
-        notes=notes,
+    result = compute_recommendation(
+        crop_requirements_of(parcel.crop),
+        soil_ppm_of(soil_test),
+        parcel.area_hectares,
+        catalog,
     )
-    
-    # Get available fertilizers
-    fertilizers = FertilizerProduct.objects.filter(is_active=True)
-    
-    total_cost = 0
-    
-    # Generate recommendation items
-    # For each nutrient, find best matching fertilizers
-    items_created = []
-    
-    # For Nitrogen
-    if n_needed > 0:
-        n_fertilizers = fertilizers.filter(nitrogen_percent__gt=0).order_by('-nitrogen_percent')
-        remaining_n = n_needed
-        
-        for fert in n_fertilizers[:3]:  # Try top 3 N fertilizers
-            if remaining_n <= 0:
-                break
-            
-            # Calculate how much fertilizer needed to provide remaining N
-            n_content = fert.nitrogen_percent / 100
-            if n_content > 0:
-                fert_quantity_kg = remaining_n / n_content
-                
-                # Convert to appropriate unit
-                if fert.unit == 'bag':
-                    fert_quantity = fert_quantity_kg / 50  # 50kg per bag
-                elif fert.unit == 'ton':
-                    fert_quantity = fert_quantity_kg / 1000
-                else:
-                    fert_quantity = fert_quantity_kg
-                
-                cost = float(fert_quantity) * float(fert.price_per_unit)
-                
-                item = RecommendationItem.objects.create(
-                    recommendation=recommendation,
-                    fertilizer=fert,
-                    quantity=round(fert_quantity, 2),
-                    unit=fert.unit,
-                    cost=cost,
-                    nitrogen_contribution_kg=remaining_n if remaining_n <= n_needed else n_needed,
-                )
-                items_created.append(item)
-                total_cost += cost
-                remaining_n = 0
-                break
-    
-    # For Phosphorus
-    if p_needed > 0:
-        p_fertilizers = fertilizers.filter(phosphorus_percent__gt=0).order_by('-phosphorus_percent')
-        remaining_p = p_needed
-        
-        for fert in p_fertilizers[:3]:
-            if remaining_p <= 0:
-                break
-            
-            p_content = fert.phosphorus_percent / 100
-            if p_content > 0:
-                # Convert P2O5 to P (multiply by 0.436)
-                p_content_actual = p_content * 0.436
-                fert_quantity_kg = remaining_p / p_content_actual
-                
-                if fert.unit == 'bag':
-                    fert_quantity = fert_quantity_kg / 50
-                elif fert.unit == 'ton':
-                    fert_quantity = fert_quantity_kg / 1000
-                else:
-                    fert_quantity = fert_quantity_kg
-                
-                cost = float(fert_quantity) * float(fert.price_per_unit)
-                
-                item = RecommendationItem.objects.create(
-                    recommendation=recommendation,
-                    fertilizer=fert,
-                    quantity=round(fert_quantity, 2),
-                    unit=fert.unit,
-                    cost=cost,
-                    phosphorus_contribution_kg=remaining_p if remaining_p <= p_needed else p_needed,
-                )
-                items_created.append(item)
-                total_cost += cost
-                remaining_p = 0
-                break
-    
-    # For Potassium
-    if k_needed > 0:
-        k_fertilizers = fertilizers.filter(potassium_percent__gt=0).order_by('-potassium_percent')
-        remaining_k = k_needed
-        
-        for fert in k_fertilizers[:3]:
-            if remaining_k <= 0:
-                break
-            
-            k_content = fert.potassium_percent / 100
-            if k_content > 0:
-                # Convert K2O to K (multiply by 0.83)
-                k_content_actual = k_content * 0.83
-                fert_quantity_kg = remaining_k / k_content_actual
-                
-                if fert.unit == 'bag':
-                    fert_quantity = fert_quantity_kg / 50
-                elif fert.unit == 'ton':
-                    fert_quantity = fert_quantity_kg / 1000
-                else:
-                    fert_quantity = fert_quantity_kg
-                
-                cost = float(fert_quantity) * float(fert.price_per_unit)
-                
-                item = RecommendationItem.objects.create(
-                    recommendation=recommendation,
-                    fertilizer=fert,
-                    quantity=round(fert_quantity, 2),
-                    unit=fert.unit,
-                    cost=cost,
-                    potassium_contribution_kg=remaining_k if remaining_k <= k_needed else k_needed,
-                )
-                items_created.append(item)
-                total_cost += cost
-                remaining_k = 0
-                break
-    
-    # Update recommendation total cost
-    recommendation.estimated_total_cost = total_cost
-    recommendation.save()
-    
-    return recommendation
-
+    return save_recommendation(parcel, user, parcel.crop, soil_test, result, notes)
@@ -0,0 +1,231 @@
+"""
+Staleness tracking for recommendations.
+
+Each recommendation records the versions of the inputs it was computed
+from (parcel, crop and soil test, and on each item the fertilizer's), and
+those models bump their version when a field the engine reads changes. The
+receivers in parcels.models and fertilizers.models then flag only the
+recommendations built on the old values: a price change marks the
+recommendations that use that product, not the whole table. When a change
+makes the engine pick a different product for a nutrient, the
+recommendations using the product it replaced are flagged too.
+
+regenerate_stale() recomputes stale drafts in place, one batch per
+transaction; `manage.py regenerate_stale` runs it once or as a polling
+worker, and regenerate() recomputes any given list. Finalized
+recommendations are flagged but left as the farmer signed them off, and
+applied ones are history and never flagged.
+"""
+
+from django.db import transaction
+from django.db.models import Q
+
+from fertilizer_planner.cache import bump_user_version
+from fertilizer_planner.sharding import current_shard, data_aliases, use_shard
+from .cache import invalidate_recommendations
+from .models import FertilizerRecommendation, InputSnapshot, RecommendationItem
+from .recommendation_engine import (
+    NUTRIENTS, compute_recommendation, crop_requirements_of, input_values, item_values, load_catalog,
+    recommendation_values, select_products, soil_ppm_of,
+)
+
+
+DEFAULT_BATCH_SIZE = 200
+
+# Recommendations that get flagged; only drafts are regenerated
+TRACKED_STATUSES = ('draft', 'finalized')
+
+# Everything recommendation_values() sets, plus the inputs snapshot
+RECOMMENDATION_FIELDS = [
+    'inputs', 'nitrogen_needed_kg', 'phosphorus_needed_kg', 'potassium_needed_kg', 'estimated_total_cost',
+    'parcel_version', 'crop_version', 'soil_test_version', 'is_stale',
+]
+
+CONTRIBUTION_FIELDS = ['nitrogen_contribution_kg', 'phosphorus_contribution_kg', 'potassium_contribution_kg']
+
+ITEM_FIELDS = [
+    'fertilizer', 'quantity', 'unit', 'cost', 'fertilizer_version', *CONTRIBUTION_FIELDS,
+]
+
+
+def mark_stale(recommendations):
+    """
+    Flag a queryset of recommendations stale and invalidate their owners'
+    cached pages. Returns the number of recommendations flagged.
+    """
+    recommendations = recommendations.filter(is_stale=False, status__in=TRACKED_STATUSES)
+    rows = list(recommendations.values_list('pk', 'user_id').distinct())
+    if not rows:
+        return 0
+    count = FertilizerRecommendation.objects.filter(pk__in=recommendations.values('pk')).update(is_stale=True)
+    for user_id in {user_id for _, user_id in rows}:
+        bump_user_version(user_id)
+    # The detail pages show an "Out of date" badge
+    invalidate_recommendations(pk for pk, _ in rows)
+    return count
+
+
+def mark_parcel_stale(parcel_id):
+    return mark_stale(FertilizerRecommendation.objects.filter(parcel_id=parcel_id))
+
+
+def mark_crop_stale(crop_id):
+    return _mark_stale_everywhere(Q(parcel__crop_id=crop_id))
+
+
+def _mark_stale_everywhere(condition):
+    """mark_stale() the recommendations matching condition in every database that holds some."""
+    count = 0
+    for alias in data_aliases():
+        with use_shard(alias):
+            count += mark_stale(FertilizerRecommendation.objects.filter(condition))
+    return count
+
+
+def engine_selection():
+    """
+    The product id the engine currently uses for each nutrient (or None).
+    Read past the catalog cache, so it sees the current transaction.
+    """
+    return {
+        nutrient: product.pk if product is not None else None
+        for nutrient, product in select_products().items()
+    }
+
+
+def mark_products_stale(product_ids, previous_selection=None):
+    """
+    Flag the recommendations that use any of the given products. With the
+    engine_selection() from before the change, also flag those that use a
+    product the engine no longer picks, or that lacked a nutrient no active
+    product supplied.
+    """
+    affected = Q(items__fertilizer_id__in=product_ids)
+    if previous_selection is not None:
+        current = engine_selection()
+        for nutrient, _, _, contribution_field in NUTRIENTS:
+            previous_id = previous_selection[nutrient]
+            if previous_id == current[nutrient]:
+                continue
+            if previous_id is None:
+                affected |= Q(**{f'{nutrient}_needed_kg__gt': 0})
+            else:
+                affected |= Q(items__fertilizer_id=previous_id, **{f'items__{contribution_field}__gt': 0})
+    return _mark_stale_everywhere(affected)
+
+
+def _regenerate(recommendation, catalog):
+    """
+    Recompute a recommendation in place, apart from its inputs snapshot.
+    Returns the snapshot values and the item rows to update, create and
+    delete, or None when the parcel lost its crop or soil test.
+    """
+    parcel = recommendation.parcel
+    soil_test = getattr(parcel, 'soil_test', None)
+    if parcel.crop is None or soil_test is None:
+        return None
+
+    result = compute_recommendation(
+        crop_requirements_of(parcel.crop), soil_ppm_of(soil_test), parcel.area_hectares, catalog,
+    )
+    for field, value in recommendation_values(parcel, parcel.crop, soil_test, result).items():
+        setattr(recommendation, field, value)
+
+    # Reuse the existing item rows; there is at most one per nutrient
+    existing = list(recommendation.items.all())
+    to_update, to_create = [], []
+    for index, item in enumerate(result['items']):
+        values = dict.fromkeys(CONTRIBUTION_FIELDS, 0)
+        values.update(item_values(item))
+        if index < len(existing):
+            row = existing[index]
+            for field, value in values.items():
+                setattr(row, field, value)
+            to_update.append(row)
+        else:
+            to_create.append(RecommendationItem(recommendation=recommendation, **values))
+    to_delete = [row.pk for row in existing[len(result['items']):]]
+    return input_values(parcel.crop, soil_test), to_update, to_create, to_delete
+
+
+def regenerate(recommendations):
+    """
+    Recompute a list of recommendations in place, loaded with
+    select_related('parcel__crop', 'parcel__soil_test') and
+    prefetch_related('items'). Call it inside a transaction.
+
+    Returns the number regenerated; the rest were skipped because their
+    parcel lost its crop or soil test.
+    """
+    catalog = load_catalog()
+    regenerated, inputs = [], []
+    items_to_update, items_to_create, items_to_delete = [], [], []
+    for recommendation in recommendations:
+        changes = _regenerate(recommendation, catalog)
+        if changes is None:
+            continue
+        regenerated.append(recommendation)
+        inputs.append(changes[0])
+        items_to_update += changes[1]
+        items_to_create += changes[2]
+        items_to_delete += changes[3]
+
+    for recommendation, snapshot in zip(regenerated, InputSnapshot.objects.for_values(inputs)):
+        recommendation.inputs = snapshot
+    FertilizerRecommendation.objects.bulk_update(regenerated, RECOMMENDATION_FIELDS)
+    RecommendationItem.objects.bulk_update(items_to_update, ITEM_FIELDS)
+    RecommendationItem.objects.bulk_create(items_to_create)
+    if items_to_delete:
+        RecommendationItem.objects.filter(pk__in=items_to_delete).delete()
+    for user_id in {recommendation.user_id for recommendation in regenerated}:
+        bump_user_version(user_id)
+    invalidate_recommendations(recommendation.pk for recommendation in regenerated)
+    return len(regenerated)
+
+
+def regenerate_batch(after_id=0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Regenerate up to batch_size stale drafts with ids above after_id, in
+    one transaction.
+
+    Returns (regenerated, skipped, last_id); last_id is None when there was
+    nothing left to do.
+    """
+    with transaction.atomic(using=current_shard()):
+        recommendations = list(
+            FertilizerRecommendation.objects
+            .filter(is_stale=True, status='draft', pk__gt=after_id)
+            .select_related('parcel__crop', 'parcel__soil_test')
+            .prefetch_related('items')
+            .order_by('pk')[:batch_size]
+        )
+        if not recommendations:
+            return 0, 0, None
+        regenerated = regenerate(recommendations)
+
+    return regenerated, len(recommendations) - regenerated, recommendations[-1].pk
+
+
+def regenerate_stale(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Regenerate every stale draft, in every database that holds
+    recommendations, a batch at a time. Yields (regenerated, skipped) per
+    batch.
+    """
+    for alias in data_aliases():
+        last_id = 0
+        while True:
+            with use_shard(alias):
+                regenerated, skipped, last_id = regenerate_batch(last_id, batch_size)
+            if last_id is None:
+                break
+            yield regenerated, skipped
+
+
+def count_stale():
+    """The number of recommendations flagged stale, across every database."""
+    count = 0
+    for alias in data_aliases():
+        with use_shard(alias):
+            count += FertilizerRecommendation.objects.filter(is_stale=True).count()
+    return count
@@ -0,0 +1,370 @@
+import base64
+import json
+from datetime import date
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from fertilizer_planner.sharding import current_shard, data_aliases, shard_for_user, use_shard
+from parcels.models import Crop, LandParcel, SoilTest
+from .bulk_jobs import claim, run_job, selection_of
+from .management.commands.check_query_plans import full_scans, hot_queries
+from .management.commands.snapshot_stats import storage_estimate
+from .models import BulkJob, FertilizerProduct, FertilizerRecommendation, InputSnapshot, RecommendationStatusChange
+from .recommendation_engine import generate_recommendation, load_catalog, select_products
+from .search import index_available, search_products
+from .staleness import count_stale, regenerate_stale
+from .transitions import TransitionError, transition
+
+
+class FertilizerTestCase(TestCase):
+    """
+    A farmer with one cropped, soil-tested parcel and a straight N, P and K
+    product. The test runs on the farmer's shard when sharding is on.
+    """
+    databases = set(data_aliases())
+
+    def setUp(self):
+        # Versioned cache entries outlive each test's rolled back rows
+        cache.clear()
+        self.user = User.objects.create_user('farmer', password='Farm-Pass-123')
+        self.enterContext(use_shard(shard_for_user(self.user.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crop = Crop.objects.create(
+                name='Maize', nitrogen_requirement=150, phosphorus_requirement=60, potassium_requirement=80,
+            )
+        self.parcel = LandParcel.objects.create(
+            user=self.user, name='North field', location='Valley', area_hectares=2, crop=self.crop,
+        )
+        self.soil_test = SoilTest.objects.create(
+            parcel=self.parcel, test_date=date(2026, 1, 1), nitrogen_ppm=10, phosphorus_ppm=8, potassium_ppm=40,
+        )
+        self.urea = self.create_product('Urea', n=46)
+        self.tsp = self.create_product('Triple superphosphate', p=46)
+        self.mop = self.create_product('Muriate of potash', k=60)
+
+    def create_product(self, name, n=0, p=0, k=0, **kwargs):
+        kwargs.setdefault('price_per_unit', 25)
+        kwargs.setdefault('unit', 'bag')
+        # Run the on-commit copy to the shards
+        with self.captureOnCommitCallbacks(execute=True):
+            return FertilizerProduct.objects.create(
+                name=name, nitrogen_percent=n, phosphorus_percent=p, potassium_percent=k, **kwargs,
+            )
+
+    def recommend(self):
+        return generate_recommendation(self.parcel.pk, self.user)
+
+    def is_stale(self, recommendation):
+        return FertilizerRecommendation.objects.get(pk=recommendation.pk).is_stale
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_an_index(self):
+        for name, queryset in hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(full_scans(plan, limited=queryset.query.high_mark is not None), [], plan)
+
+    def test_full_scans(self):
+        plan = '3 0 0 SEARCH t USING INDEX t_idx (a>?)\n9 0 0 USE TEMP B-TREE FOR ORDER BY'
+        self.assertEqual(full_scans(plan), [])
+        self.assertEqual(full_scans(plan, limited=True), ['USE TEMP B-TREE FOR ORDER BY'])
+        self.assertEqual(full_scans('2 0 0 SCAN t USING INDEX t_idx'), ['SCAN t USING INDEX t_idx'])
+
+
+class EngineSelectionTests(FertilizerTestCase):
+    def test_picks_the_richest_active_product_per_nutrient(self):
+        self.create_product('NPK 15-15-15', n=15, p=15, k=15)
+        self.assertEqual(select_products(), {'nitrogen': self.urea, 'phosphorus': self.tsp, 'potassium': self.mop})
+
+    def test_ties_go_to_the_first_name(self):
+        ammonia = self.create_product('Aqua ammonia', n=46)
+        self.assertEqual(select_products()['nitrogen'], ammonia)
+
+    def test_skips_inactive_products(self):
+        dap = self.create_product('DAP', n=18, p=46)
+        self.urea.is_active = False
+        self.urea.save()
+        self.assertEqual(select_products()['nitrogen'], dap)
+
+    def test_no_active_source(self):
+        self.mop.delete()
+        self.assertIsNone(select_products()['potassium'])
+
+    def test_catalog_cache_follows_product_changes(self):
+        self.assertEqual(load_catalog()['nitrogen'], self.urea)
+        richer = self.create_product('Anhydrous ammonia', n=82)
+        self.assertEqual(load_catalog()['nitrogen'], richer)
+
+
+class InputSnapshotTests(FertilizerTestCase):
+    def test_recommendations_with_the_same_inputs_share_a_snapshot(self):
+        first, second = self.recommend(), self.recommend()
+        self.assertEqual(first.inputs_id, second.inputs_id)
+        self.assertEqual(InputSnapshot.objects.count(), 1)
+
+    def test_snapshot_stats(self):
+        for _ in range(3):
+            self.recommend()
+        copied, shared = storage_estimate(3, 1)
+        self.assertEqual(copied, 3 * len(InputSnapshot.VALUE_FIELDS) * 8)
+        self.assertLess(shared, copied)
+
+        out = StringIO()
+        call_command('snapshot_stats', stdout=out)
+        self.assertRegex(out.getvalue(), rf'{current_shard()} +3 +1 ')
+
+
+class StalenessTests(FertilizerTestCase):
+    def test_selection_read_only_when_the_pick_can_move(self):
+        self.urea.price_per_unit = 30
+        self.urea.save()
+        self.assertIsNone(self.urea._previous_selection)
+
+        self.urea.nitrogen_percent = 45
+        self.urea.save()
+        self.assertEqual(self.urea._previous_selection['nitrogen'], self.urea.pk)
+
+    def test_soil_test_change_marks_the_parcels_recommendations(self):
+        recommendation = self.recommend()
+        self.soil_test.nitrogen_ppm = 20
+        self.soil_test.save()
+        self.assertTrue(self.is_stale(recommendation))
+
+    def test_changes_the_engine_ignores_leave_recommendations_fresh(self):
+        recommendation = self.recommend()
+        self.soil_test.notes = 'Resampled'
+        self.soil_test.save()
+        self.urea.description = 'Granular'
+        self.urea.save()
+        self.assertFalse(self.is_stale(recommendation))
+
+    def test_price_change_marks_only_recommendations_using_the_product(self):
+        recommendation = self.recommend()
+        gypsum = self.create_product('Gypsum')
+        gypsum.price_per_unit = 12
+        gypsum.save()
+        self.assertFalse(self.is_stale(recommendation))
+
+        self.urea.price_per_unit = 30
+        self.urea.save()
+        self.assertTrue(self.is_stale(recommendation))
+
+    def test_richer_product_marks_users_of_the_one_it_replaces(self):
+        recommendation = self.recommend()
+        self.create_product('Anhydrous ammonia', n=82)
+        self.assertTrue(self.is_stale(recommendation))
+
+    def test_regenerate_stale_recomputes_drafts(self):
+        recommendation = self.recommend()
+        richer = self.create_product('Anhydrous ammonia', n=82)
+        self.assertEqual(count_stale(), 1)
+
+        self.assertEqual(list(regenerate_stale()), [(1, 0)])
+        recommendation.refresh_from_db()
+        self.assertFalse(recommendation.is_stale)
+        self.assertIn(richer.pk, recommendation.items.values_list('fertilizer_id', flat=True))
+        self.assertEqual(count_stale(), 0)
+
+    def test_finalized_recommendations_are_flagged_but_kept(self):
+        recommendation = self.recommend()
+        transition(FertilizerRecommendation.objects.filter(pk=recommendation.pk), 'finalized')
+        self.soil_test.nitrogen_ppm = 20
+        self.soil_test.save()
+
+        self.assertEqual(list(regenerate_stale()), [])
+        recommendation.refresh_from_db()
+        self.assertTrue(recommendation.is_stale)
+        self.assertEqual(recommendation.status, 'finalized')
+
+
+class TransitionTests(FertilizerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.recommendation = self.recommend()
+        self.recommendations = FertilizerRecommendation.objects.filter(pk=self.recommendation.pk)
+
+    def test_transition_updates_status_and_logs_it(self):
+        self.assertEqual(transition(self.recommendations, 'finalized', changed_by_id=self.user.pk, source='web'), 1)
+        self.recommendation.refresh_from_db()
+        self.assertEqual(self.recommendation.status, 'finalized')
+        self.assertEqual(
+            list(RecommendationStatusChange.objects.values_list(
+                'recommendation_id', 'from_status', 'to_status', 'changed_by_id', 'source')),
+            [(self.recommendation.pk, 'draft', 'finalized', self.user.pk, 'web')],
+        )
+
+    def test_disallowed_moves_are_skipped(self):
+        self.assertEqual(transition(self.recommendations, 'applied'), 0)
+        self.recommendation.refresh_from_db()
+        self.assertEqual(self.recommendation.status, 'draft')
+        self.assertFalse(RecommendationStatusChange.objects.exists())
+
+    def test_unknown_status(self):
+        with self.assertRaises(TransitionError):
+            transition(self.recommendations, 'archived')
+
+    def test_batches(self):
+        for _ in range(4):
+            self.recommend()
+        self.assertEqual(transition(FertilizerRecommendation.objects.all(), 'finalized', batch_size=2), 5)
+        self.assertEqual(RecommendationStatusChange.objects.count(), 5)
+
+    def test_log_is_append_only(self):
+        transition(self.recommendations, 'finalized')
+        change = RecommendationStatusChange.objects.get()
+        change.source = 'admin'
+        with self.assertRaises(TypeError):
+            change.save()
+        with self.assertRaises(TypeError):
+            change.delete()
+        with self.assertRaises(TypeError):
+            RecommendationStatusChange.objects.update(source='admin')
+        with self.assertRaises(TypeError):
+            RecommendationStatusChange.objects.all().delete()
+        self.assertEqual(RecommendationStatusChange.objects.get().source, 'api')
+
+    def test_moved_rows_can_be_removed(self):
+        transition(self.recommendations, 'finalized')
+        self.assertEqual(RecommendationStatusChange.objects.all().delete_moved(), 1)
+        self.assertFalse(RecommendationStatusChange.objects.exists())
+
+
+class SearchTests(FertilizerTestCase):
+    def setUp(self):
+        super().setUp()
+        if not index_available():
+            self.skipTest('No FTS5 search index')
+
+    def test_name_matches_rank_above_description_matches(self):
+        blend = self.create_product('Garden blend', n=10, p=10, k=10, description='Blended with potash')
+        results = search_products('potash')
+        self.assertEqual(results, [self.mop, blend])
+
+    def test_ranks_every_match_before_limiting(self):
+        for index in range(60):
+            self.create_product(f'Blend {index}', description='Contains some potash')
+        granular = self.create_product('Zeolite potash', k=50)
+        results = search_products('potash', limit=2)
+        self.assertCountEqual(results, [self.mop, granular])
+
+    def test_prefix_terms(self):
+        self.assertEqual(search_products('ure'), [self.urea])
+
+    def test_nutrient_filters(self):
+        self.create_product('Sulfate of potash', k=50)
+        self.assertEqual(search_products('potash K>=55'), [self.mop])
+        self.assertEqual(search_products('N>=40'), [self.urea])
+
+    def test_active_only(self):
+        self.mop.is_active = False
+        self.mop.save()
+        self.assertEqual(search_products('potash', active_only=True), [])
+
+    def test_results_are_cached_until_the_catalog_changes(self):
+        self.assertEqual(search_products('potash'), [self.mop])
+        with self.assertNumQueries(1):  # only the products, by id
+            self.assertEqual(search_products('potash'), [self.mop])
+        sulfate = self.create_product('Sulfate of potash', k=50)
+        self.assertEqual(search_products('potash'), [self.mop, sulfate])
+
+
+class BatchAPITests(FertilizerTestCase):
+    def setUp(self):
+        super().setUp()
+        # Like an external system: no session, no CSRF cookie, and the check enforced
+        self.client = Client(enforce_csrf_checks=True)
+        self.url = reverse('fertilizers:batch_recommendations')
+
+    def post(self, payload, password='Farm-Pass-123', **extra):
+        if password is not None:
+            credentials = base64.b64encode(f'farmer:{password}'.encode()).decode()
+            extra['HTTP_AUTHORIZATION'] = f'Basic {credentials}'
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json', **extra)
+
+    def lines(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_basic_auth_without_session_or_csrf_cookie(self):
+        response = self.post({'parcels': [self.parcel.pk]})
+        self.assertEqual(response.status_code, 200)
+        [line] = self.lines(response)
+        self.assertEqual(line['parcel'], self.parcel.pk)
+        self.assertTrue(FertilizerRecommendation.objects.filter(pk=line['recommendation_id']).exists())
+
+    def test_wrong_password(self):
+        response = self.post({'parcels': [self.parcel.pk]}, password='wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response['WWW-Authenticate'])
+
+    def test_session_callers_still_need_the_csrf_token(self):
+        self.client.login(username='farmer', password='Farm-Pass-123')
+        self.assertEqual(self.post({'parcels': [self.parcel.pk]}, password=None).status_code, 403)
+
+    def test_anonymous(self):
+        self.assertEqual(self.post({'parcels': [self.parcel.pk]}, password=None).status_code, 401)
+
+    def test_ids_are_checked_before_streaming(self):
+        soil = {'nitrogen_ppm': 10}
+        response = self.post({'inputs': [
+            {'crop_id': self.crop.pk, 'soil': soil, 'area_hectares': 1},
+            {'crop_id': [self.crop.pk], 'soil': soil, 'area_hectares': 1},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("'inputs'[1]", response.json()['error'])
+
+        for parcels in ([self.parcel.pk, {'id': 1}], [True]):
+            response = self.post({'parcels': parcels})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(f"'parcels'[{len(parcels) - 1}]", response.json()['error'])
+
+    def test_bad_entries_get_an_error_line(self):
+        response = self.post({'inputs': [
+            {'ref': 'a', 'crop_id': self.crop.pk, 'soil': {'nitrogen_ppm': 10}, 'area_hectares': 1},
+            {'ref': 'b', 'crop_id': self.crop.pk, 'soil': {'nitrogen_ppm': 'lots'}, 'area_hectares': 1},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        first, second = self.lines(response)
+        self.assertIn('items', first)
+        self.assertEqual(second, {'ref': 'b', 'error': "'nitrogen_ppm' must be a number"})
+
+
+class BulkJobTests(FertilizerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = LandParcel.objects.create(user=self.user, name='South field', location='Hill', area_hectares=1)
+        admin_user = User.objects.create_superuser('admin', password='Admin-Pass-123')
+        self.client.force_login(admin_user)
+        self.url = reverse('admin:parcels_landparcel_changelist')
+        if settings.SHARD_DATABASES:
+            # Switch the admin to the farmer's database
+            self.client.get(self.url, {'_shard': current_shard()})
+
+    def queue(self, query='', **data):
+        response = self.client.post(f'{self.url}?{query}', {'action': 'queue_delete', 'index': 0, **data})
+        self.assertRedirects(response, f'{self.url}?{query}', fetch_redirect_response=False)
+        return BulkJob.objects.get()
+
+    def test_ticked_rows_are_stored_as_ids(self):
+        job = self.queue(_selected_action=[self.other.pk])
+        self.assertEqual(job.selection, {'ids': [self.other.pk]})
+        self.assertEqual(list(selection_of(job)), [self.other])
+
+    def test_select_all_stores_the_changelist_filters(self):
+        job = self.queue(
+            f'crop__id__exact={self.crop.pk}&q=north&o=1&p=1', _selected_action=[self.parcel.pk], select_across='1',
+        )
+        self.assertEqual(job.selection, {'filters': {'crop__id__exact': str(self.crop.pk)}, 'search': 'north'})
+        self.assertEqual(list(selection_of(job)), [self.parcel])
+
+        run_job(claim(job.pk))
+
+        self.assertEqual(list(LandParcel.objects.all()), [self.other])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total, job.changed), ('done', 1, 1))
@@ -0,0 +1,84 @@
+"""
+Recommendation status transitions.
+
+transition() moves many recommendations to a new status a batch at a time.
+Each batch is one transaction: the ids and current statuses of the rows
+allowed to make the move are read, changed with a single UPDATE, and
+recorded in the append-only RecommendationStatusChange log with a single
+bulk_create. Rows whose status doesn't allow the move are skipped.
+
+Nothing reads the log to find a recommendation's status: the status column
+stays the current state, and the history page filters on it through the
+(user, status, generated_at) index, so the log can grow without slowing
+that page down.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from fertilizer_planner.cache import bump_user_version
+from fertilizer_planner.sharding import current_shard
+from .cache import invalidate_recommendations
+from .models import FertilizerRecommendation, RecommendationStatusChange
+
+
+DEFAULT_BATCH_SIZE = 500
+
+# Target status -> the statuses it can be reached from
+ALLOWED_TRANSITIONS = {
+    'finalized': ('draft',),
+    'applied': ('finalized',),
+    # Reopen a finalized recommendation for changes
+    'draft': ('finalized',),
+}
+
+
+class TransitionError(ValueError):
+    """Raised for a status no recommendation can be moved to."""
+
+
+def transition(recommendations, to_status, changed_by_id=None, source='api', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move the recommendations in a queryset to to_status, batch_size rows per
+    transaction, logging each change. Returns the number moved.
+    """
+    if to_status not in ALLOWED_TRANSITIONS:
+        raise TransitionError(f"Recommendations can't be moved to '{to_status}'")
+    eligible = recommendations.filter(status__in=ALLOWED_TRANSITIONS[to_status]).order_by('pk')
+
+    moved = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=current_shard()):
+            rows = list(eligible.filter(pk__gt=last_pk).values_list('pk', 'user_id', 'status')[:batch_size])
+            if not rows:
+                break
+            _apply(rows, to_status, changed_by_id, source)
+        moved += len(rows)
+        last_pk = rows[-1][0]
+        if len(rows) < batch_size:
+            break
+    return moved
+
+
+def _apply(rows, to_status, changed_by_id, source):
+    pks = [pk for pk, _, _ in rows]
+    FertilizerRecommendation.objects.filter(pk__in=pks).update(status=to_status)
+
+    changed_at = timezone.now()
+    RecommendationStatusChange.objects.bulk_create([
+        RecommendationStatusChange(
+            recommendation_id=pk,
+            from_status=from_status,
+            to_status=to_status,
+            changed_by_id=changed_by_id,
+            source=source,
+            changed_at=changed_at,
+        )
+        for pk, _, from_status in rows
+    ])
+
+    # update() sends no signals
+    for user_id in {user_id for _, user_id, _ in rows}:
+        bump_user_version(user_id)
+    invalidate_recommendations(pks)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, api
 
 app_name = 'fertilizers'
 
@@ -10,5 +10,7 @@ urlpatterns = [
     path('<int:pk>/delete/', views.product_delete, name='product_delete'),
     path('generate/<int:pk>/', views.generate_recommendation_view, name='generate_recommendation'),
     path('recommendations/', views.recommendation_list, name='recommendation_list'),
+    path('api/recommendations/batch/', api.batch_recommendations, name='batch_recommendations'),
+    path('api/recommendations/transition/', api.transition_recommendations, name='transition_recommendations'),
 ]
 
@@ -1,31 +1,32 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
+from django.http import Http404
+from fertilizer_planner.async_utils import async_login_required
 from .models import FertilizerProduct, FertilizerRecommendation
 from .forms import FertilizerProductForm, RecommendationNoteForm
-from .recommendation_engine import generate_recommendation
+from .recommendation_engine import generate_for_parcel
+from .cache import get_products, catalog_version
+from .search import search_products
 from parcels.models import LandParcel
 
 
 @login_required
 def product_list(request):
     search_query = request.GET.get('search', '')
-    products = FertilizerProduct.objects.all()
+    active_only = request.GET.get('active_only', '') == 'true'
     
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(brand__icontains=search_query)
-        )
-    
-    active_only = request.GET.get('active_only', '')
-    if active_only == 'true':
-        products = products.filter(is_active=True)
+        products = search_products(search_query, active_only=active_only)
+    else:
+        products = get_products(active_only=active_only)
     
     return render(request, 'fertilizers/product_list.html', {
         'products': products,
         'search_query': search_query,
+        'active_only': active_only,
+        'catalog_version': catalog_version(),
     })
 
 
@@ -66,9 +67,12 @@ def product_delete(request, pk):
     return render(request, 'fertilizers/product_confirm_delete.html', {'product': product})
 
 
-@login_required
-def generate_recommendation_view(request, pk):
-    parcel = get_object_or_404(LandParcel, pk=pk, user=request.user)
+@async_login_required
+async def generate_recommendation_view(request, pk):
+    try:
+        parcel = await LandParcel.objects.select_related('crop', 'soil_test').aget(pk=pk, user=request.user)
+    except LandParcel.DoesNotExist:
+        raise Http404("No parcel matches the given query.")
     
     # Check prerequisites
     if not parcel.crop:
@@ -84,14 +88,14 @@ def generate_recommendation_view(request, pk):
     if request.method == 'POST':
         notes = request.POST.get('notes', '')
         try:
-            recommendation = generate_recommendation(pk, request.user, notes)
+            recommendation = await sync_to_async(generate_for_parcel)(parcel, request.user, notes)
             messages.success(request, 'Fertilizer recommendation generated successfully!')
             return redirect('reports:recommendation_detail', pk=recommendation.pk)
         except Exception as e:
             messages.error(request, f'Error generating recommendation: {str(e)}')
             return redirect('parcels:parcel_detail', pk=pk)
     
-    return render(request, 'fertilizers/generate_recommendation.html', {'parcel': parcel})
+    return await sync_to_async(render)(request, 'fertilizers/generate_recommendation.html', {'parcel': parcel})
 
 
 @login_required
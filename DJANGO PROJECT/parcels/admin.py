@@ -1,4 +1,6 @@
 from django.contrib import admin
+from fertilizer_planner.admin_tools import EstimatedCountPaginator, ShardedModelAdmin
+from fertilizers.bulk_jobs import admin_action
 from .models import Crop, LandParcel, SoilTest
 
 
@@ -9,16 +11,29 @@ class CropAdmin(admin.ModelAdmin):
 
 
 @admin.register(LandParcel)
-class LandParcelAdmin(admin.ModelAdmin):
+class LandParcelAdmin(ShardedModelAdmin):
     list_display = ['name', 'user', 'location', 'area_hectares', 'crop', 'soil_type', 'created_at']
     list_filter = ['soil_type', 'crop', 'created_at']
     search_fields = ['name', 'location', 'user__username']
     readonly_fields = ['created_at', 'updated_at']
+    list_select_related = ['user', 'crop']
+    autocomplete_fields = ['user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [
+        admin_action('regenerate', 'Generate new recommendations in the background', 'change'),
+        admin_action('finalize', "Finalize each parcel's latest draft in the background", 'change'),
+        admin_action('delete', 'Delete selected parcels in the background', 'delete'),
+    ]
 
 
 @admin.register(SoilTest)
-class SoilTestAdmin(admin.ModelAdmin):
+class SoilTestAdmin(ShardedModelAdmin):
     list_display = ['parcel', 'test_date', 'nitrogen_ppm', 'phosphorus_ppm', 'potassium_ppm', 'ph_level']
     list_filter = ['test_date']
     search_fields = ['parcel__name', 'parcel__user__username']
+    list_select_related = ['parcel__user']
+    autocomplete_fields = ['parcel']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
@@ -0,0 +1,56 @@
+"""
+Cached crop lookups.
+
+Crops change rarely, so the choice list used by LandParcelForm and the
+listing used by crop_list are cached under the 'crops' namespace. The
+namespace version is bumped by the Crop save/delete signals.
+
+Each parcel also has a 'parcel:<id>' namespace, bumped when it is saved or
+deleted, for cached pages that show the parcel's details.
+"""
+
+from django.conf import settings
+
+from fertilizer_planner.cache import bump_version, get_or_set_versioned, get_version, invalidate_on_commit
+
+
+CROPS_NAMESPACE = 'crops'
+
+
+def crops_version():
+    return get_version(CROPS_NAMESPACE)
+
+
+def bump_crops_version():
+    return bump_version(CROPS_NAMESPACE)
+
+
+def parcel_namespace(parcel_id):
+    return f'parcel:{parcel_id}'
+
+
+def invalidate_parcel(parcel_id):
+    """Invalidate pages showing a parcel's details once the current transaction commits."""
+    invalidate_on_commit([parcel_namespace(parcel_id)])
+
+
+def get_crops():
+    """All crops, as a cached list."""
+    from .models import Crop
+
+    return get_or_set_versioned(
+        CROPS_NAMESPACE, ['list'],
+        lambda: list(Crop.objects.all()),
+        settings.CATALOG_CACHE_TIMEOUT,
+    )
+
+
+def get_crop_choices():
+    """(pk, name) pairs for a crop <select>, as a cached list."""
+    from .models import Crop
+
+    return get_or_set_versioned(
+        CROPS_NAMESPACE, ['choices'],
+        lambda: list(Crop.objects.values_list('pk', 'name')),
+        settings.CATALOG_CACHE_TIMEOUT,
+    )
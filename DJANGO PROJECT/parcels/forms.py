@@ -1,5 +1,7 @@
 from django import forms
 from .models import LandParcel, Crop, SoilTest
+from .cache import get_crop_choices
+from .report_parser import is_supported_report
 
 
 class LandParcelForm(forms.ModelForm):
@@ -15,6 +17,13 @@ class LandParcelForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Render the <select> from the cached crop list instead of querying
+        # Crop on every render; validation still goes through the queryset.
+        crop_field = self.fields['crop']
+        crop_field.choices = [('', crop_field.empty_label)] + get_crop_choices()
+
 
 class SoilTestForm(forms.ModelForm):
     class Meta:
@@ -32,6 +41,31 @@ class SoilTestForm(forms.ModelForm):
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
+    # Values that can be filled in from an uploaded CSV/XLSX lab report
+    REPORT_FIELDS = ['nitrogen_ppm', 'phosphorus_ppm', 'potassium_ppm', 'ph_level', 'organic_matter_percent']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.REPORT_FIELDS:
+            self.fields[field].required = False
+            self.fields[field].help_text = 'Leave blank to read it from an uploaded CSV/XLSX report.'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        report = cleaned_data.get('test_report')
+        has_report = bool(report) and is_supported_report(report.name)
+        # The values the report worker may fill in; those typed in are kept
+        self.report_fields_blank = []
+        for field in self.REPORT_FIELDS:
+            if cleaned_data.get(field) is not None:
+                continue
+            if has_report:
+                cleaned_data[field] = getattr(self.instance, field)
+                self.report_fields_blank.append(field)
+            else:
+                self.add_error(field, 'This field is required unless a CSV/XLSX report is uploaded.')
+        return cleaned_data
+
 
 class CropForm(forms.ModelForm):
     class Meta:
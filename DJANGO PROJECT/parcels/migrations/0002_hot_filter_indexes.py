@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parcels', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='landparcel',
+            index=models.Index(fields=['user', '-created_at'], name='parcel_user_created_idx'),
+        ),
+    ]
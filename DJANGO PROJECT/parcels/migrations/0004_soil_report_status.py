@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parcels', '0003_input_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='soiltest',
+            name='report_error',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='soiltest',
+            name='report_status',
+            field=models.CharField(blank=True, choices=[('', 'No report to read'), ('pending', 'Waiting to be read'), ('done', 'Read'), ('failed', 'Could not be read')], editable=False, max_length=20),
+        ),
+    ]
@@ -1,8 +1,17 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from fertilizer_planner.cache import bump_user_version, is_cascaded_delete
+from fertilizer_planner.sharding import on_sender_database, replicate_on_commit
+from fertilizer_planner.versioning import VersionedModel
+from .cache import bump_crops_version, invalidate_parcel
 
 
-class Crop(models.Model):
+class Crop(VersionedModel):
+    # Fields the recommendation engine reads
+    VERSIONED_FIELDS = ('nitrogen_requirement', 'phosphorus_requirement', 'potassium_requirement')
+
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     nitrogen_requirement = models.FloatField(default=0, help_text="kg/ha")
@@ -16,7 +25,9 @@ class Crop(models.Model):
         ordering = ['name']
 
 
-class LandParcel(models.Model):
+class LandParcel(VersionedModel):
+    VERSIONED_FIELDS = ('area_hectares', 'crop_id')
+
     SOIL_TYPE_CHOICES = [
         ('sandy', 'Sandy'),
         ('loamy', 'Loamy'),
@@ -40,9 +51,22 @@ class LandParcel(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='parcel_user_created_idx'),
+        ]
+
 
+class SoilTest(VersionedModel):
+    VERSIONED_FIELDS = ('nitrogen_ppm', 'phosphorus_ppm', 'potassium_ppm', 'ph_level')
+
+    # Reading an uploaded report in the background (parcels.report_worker)
+    REPORT_STATUS_CHOICES = [
+        ('', 'No report to read'),
+        ('pending', 'Waiting to be read'),
+        ('done', 'Read'),
+        ('failed', 'Could not be read'),
+    ]
 
-class SoilTest(models.Model):
     parcel = models.OneToOneField(LandParcel, on_delete=models.CASCADE, related_name='soil_test')
     test_date = models.DateField()
     nitrogen_ppm = models.FloatField(help_text="Nitrogen in ppm (parts per million)", default=0)
@@ -51,6 +75,8 @@ class SoilTest(models.Model):
     ph_level = models.FloatField(help_text="pH level (0-14)", default=7.0)
     organic_matter_percent = models.FloatField(help_text="Organic matter percentage", default=0)
     test_report = models.FileField(upload_to='soil_tests/', blank=True, null=True)
+    report_status = models.CharField(max_length=20, choices=REPORT_STATUS_CHOICES, blank=True, editable=False)
+    report_error = models.CharField(max_length=255, blank=True, editable=False)
     notes = models.TextField(blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -60,3 +86,61 @@ class SoilTest(models.Model):
     class Meta:
         ordering = ['-test_date']
 
+
+
+@receiver(post_save, sender=Crop)
+@receiver(post_delete, sender=Crop)
+def invalidate_crop_cache(sender, instance, **kwargs):
+    bump_crops_version()
+
+
+@receiver(post_save, sender=LandParcel)
+@receiver(post_delete, sender=LandParcel)
+def invalidate_parcel_owner_cache(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
+    invalidate_parcel(instance.pk)
+
+
+@receiver(post_save, sender=SoilTest)
+@receiver(post_delete, sender=SoilTest)
+@on_sender_database
+def invalidate_soil_test_owner_cache(sender, instance, **kwargs):
+    if is_cascaded_delete(sender, kwargs.get('origin')):
+        return  # the parcel (or user) delete bumps the owner's pages
+    if SoilTest.parcel.is_cached(instance):
+        user_id = instance.parcel.user_id
+    else:
+        user_id = LandParcel.objects.filter(pk=instance.parcel_id).values_list('user_id', flat=True).first()
+    bump_user_version(user_id)
+
+
+@receiver(post_save, sender=Crop)
+@receiver(post_delete, sender=Crop)
+def replicate_crop(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Deletes of the shards' copies come back through here
+    if using == DEFAULT_DB_ALIAS:
+        replicate_on_commit(sender, [instance.pk], deleted=kwargs['signal'] is post_delete)
+
+
+@receiver(post_save, sender=Crop)
+def mark_crop_recommendations_stale(sender, instance, **kwargs):
+    if instance.version_changed:
+        from fertilizers.staleness import mark_crop_stale
+        mark_crop_stale(instance.pk)
+
+
+@receiver(post_save, sender=LandParcel)
+@on_sender_database
+def mark_parcel_recommendations_stale(sender, instance, **kwargs):
+    if instance.version_changed:
+        from fertilizers.staleness import mark_parcel_stale
+        mark_parcel_stale(instance.pk)
+
+
+@receiver(post_save, sender=SoilTest)
+@on_sender_database
+def mark_soil_test_recommendations_stale(sender, instance, created, **kwargs):
+    # A new soil test replaces a deleted one the parcel's recommendations were built on
+    if created or instance.version_changed:
+        from fertilizers.staleness import mark_parcel_stale
+        mark_parcel_stale(instance.parcel_id)
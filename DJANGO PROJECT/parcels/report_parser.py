@@ -0,0 +1,200 @@
+"""
+Soil Lab Report Parser
+
+Extracts soil test values (N, P, K, pH, organic matter) from uploaded
+CSV and XLSX lab reports. Two layouts are understood:
+
+- key/value rows:   "Nitrogen (ppm)", 42.0
+- a header row followed by a value row:  N, P, K, pH, OM / 42, 18, 160, 6.5, 2.1
+
+Files are read row by row and scanning stops as soon as every value has
+been found (or after MAX_ROWS rows), so large reports cost no more than
+small ones.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from xml.etree import ElementTree
+
+
+MAX_ROWS = 500
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx')
+
+# SoilTest field -> label tokens that identify it
+FIELD_ALIASES = {
+    'nitrogen_ppm': {'n', 'nitrogen', 'no3', 'nitrate'},
+    'phosphorus_ppm': {'p', 'phosphorus', 'phosphate', 'olsen', 'bray'},
+    'potassium_ppm': {'k', 'potassium', 'potash'},
+    'ph_level': {'ph'},
+    'organic_matter_percent': {'om', 'som', 'organic'},
+}
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+_XLSX_NS = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+class ReportParseError(Exception):
+    """Raised when a lab report cannot be read."""
+
+
+def is_supported_report(filename):
+    return bool(filename) and filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def match_field(label):
+    """Return the SoilTest field a column/row label refers to, or None."""
+    tokens = re.sub(r'[^a-z0-9]+', ' ', str(label).lower()).split()
+    if not tokens:
+        return None
+    for field, aliases in FIELD_ALIASES.items():
+        # Single-letter aliases ("N", "P", "K") only count as the whole label
+        # or its first token, so "pH" or "K (ppm)" are not misread.
+        if tokens[0] in aliases or any(len(t) > 2 and t in aliases for t in tokens):
+            return field
+    return None
+
+
+def parse_number(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value))
+    return float(match.group()) if match else None
+
+
+def extract_values(rows):
+    """
+    Extract soil test values from an iterable of rows (lists of cells).
+
+    Returns a dict of SoilTest field names to floats; fields that were not
+    found in the report are left out.
+    """
+    values = {}
+    header = None
+
+    for index, row in enumerate(rows):
+        if index >= MAX_ROWS or len(values) == len(FIELD_ALIASES):
+            break
+        cells = [cell for cell in row if cell not in (None, '')]
+        if not cells:
+            continue
+
+        if header is not None:
+            for column, field in header.items():
+                if field not in values and column < len(row):
+                    number = parse_number(row[column])
+                    if number is not None:
+                        values[field] = number
+            header = None
+            continue
+
+        fields = [match_field(cell) for cell in row]
+        matched = [field for field in fields if field]
+        if len(matched) >= 2:
+            # Header row: the values are on the next non-empty row
+            header = {column: field for column, field in enumerate(fields) if field}
+            continue
+
+        field = match_field(cells[0])
+        if field and field not in values:
+            for cell in cells[1:]:
+                number = parse_number(cell)
+                if number is not None:
+                    values[field] = number
+                    break
+
+    return values
+
+
+def iter_csv_rows(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()
+
+
+def iter_xlsx_rows(fileobj):
+    """Yield the rows of the first worksheet of an XLSX file."""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise ReportParseError(f"Not a valid XLSX file: {e}")
+
+    with archive:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            with archive.open('xl/sharedStrings.xml') as fh:
+                for _, elem in ElementTree.iterparse(fh):
+                    if elem.tag == f"{{{_XLSX_NS['m']}}}si":
+                        shared_strings.append(''.join(t.text or '' for t in elem.iter(f"{{{_XLSX_NS['m']}}}t")))
+                        elem.clear()
+
+        sheets = sorted(name for name in archive.namelist() if name.startswith('xl/worksheets/sheet'))
+        if not sheets:
+            raise ReportParseError("XLSX file has no worksheets")
+
+        with archive.open(sheets[0]) as fh:
+            for _, elem in ElementTree.iterparse(fh):
+                if elem.tag != f"{{{_XLSX_NS['m']}}}row":
+                    continue
+                row = []
+                for cell in elem.findall('m:c', _XLSX_NS):
+                    column = _column_index(cell.get('r', ''))
+                    while len(row) < column:
+                        row.append(None)
+                    row.append(_cell_value(cell, shared_strings))
+                elem.clear()
+                yield row
+
+
+def _column_index(ref):
+    index = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - ord('A') + 1)
+    return max(index - 1, 0)
+
+
+def _cell_value(cell, shared_strings):
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        return ''.join(t.text or '' for t in cell.iter(f"{{{_XLSX_NS['m']}}}t"))
+    value = cell.find('m:v', _XLSX_NS)
+    if value is None or value.text is None:
+        return None
+    if cell_type == 's':
+        return shared_strings[int(value.text)]
+    if cell_type in ('str', 'b', 'e'):
+        return value.text
+    return parse_number(value.text)
+
+
+def parse_report(fileobj, filename):
+    """
+    Parse a CSV or XLSX lab report.
+
+    Args:
+        fileobj: Binary file object positioned at the start of the report
+        filename: Original file name, used to pick the format
+
+    Returns:
+        Dict of SoilTest field names to values found in the report
+    """
+    name = filename.lower()
+    if name.endswith('.csv'):
+        rows = iter_csv_rows(fileobj)
+    elif name.endswith('.xlsx'):
+        rows = iter_xlsx_rows(fileobj)
+    else:
+        raise ReportParseError(f"Unsupported report format: {filename}")
+
+    try:
+        return extract_values(rows)
+    except (csv.Error, ElementTree.ParseError, UnicodeError) as e:
+        raise ReportParseError(str(e))
@@ -0,0 +1,158 @@
+"""
+Background Soil Report Worker
+
+Parses uploaded lab reports outside the request/response cycle. The upload
+view only saves the file and enqueues the SoilTest id (with the database
+it was saved to, which is the owner's shard when sharding is on); a small
+pool of daemon threads picks ids off a bounded queue, parses the report and
+writes the extracted values back onto the SoilTest, filling only the fields
+left blank in the form.
+
+When the queue is full the job is dropped (the values typed into the form
+are kept), so a burst of uploads can never make the request wait. The
+SoilTest's report_status and report_error say whether the report is still
+waiting, was read, or why it wasn't, for the parcel page to show.
+"""
+
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+from fertilizer_planner.sharding import use_shard
+
+from .report_parser import ReportParseError, is_supported_report, parse_report
+
+
+logger = logging.getLogger(__name__)
+
+_queue = None
+_workers = []
+_lock = threading.Lock()
+
+
+def _get_queue():
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = queue.Queue(maxsize=settings.SOIL_REPORT_QUEUE_SIZE)
+            for index in range(settings.SOIL_REPORT_WORKERS):
+                worker = threading.Thread(
+                    target=_worker_loop,
+                    name=f'soil-report-worker-{index}',
+                    daemon=True,
+                )
+                worker.start()
+                _workers.append(worker)
+        return _queue
+
+
+def _worker_loop():
+    jobs = _queue
+    while True:
+        database, soil_test_id, fields = jobs.get()
+        try:
+            close_old_connections()
+            with use_shard(database):
+                process_report(soil_test_id, fields)
+        except Exception:
+            logger.exception("Failed to process soil report for SoilTest %s", soil_test_id)
+            try:
+                with use_shard(database):
+                    record_failure(soil_test_id, 'The report could not be processed.')
+            except Exception:
+                logger.exception("Could not record the failure on SoilTest %s", soil_test_id)
+        finally:
+            close_old_connections()
+            jobs.task_done()
+
+
+def set_report_status(soil_test, status, error='', values=None):
+    """Save the report status (and any values read from the report) on a SoilTest."""
+    values = values or {}
+    for field, value in values.items():
+        setattr(soil_test, field, value)
+    soil_test.report_status = status
+    soil_test.report_error = error[:255]
+    # A save rather than update() so the version bump and the staleness
+    # and cache receivers see the new values
+    soil_test.save(update_fields=[*values, 'report_status', 'report_error'])
+
+
+def record_failure(soil_test_id, error):
+    from .models import SoilTest
+
+    soil_test = SoilTest.objects.filter(pk=soil_test_id).first()
+    if soil_test is not None:
+        set_report_status(soil_test, 'failed', error)
+
+
+def process_report(soil_test_id, fields=None):
+    """
+    Parse the report attached to a SoilTest and store the extracted values
+    of fields, the report fields left blank in the form (all of them if
+    None).
+
+    Returns the dict of values written (empty if nothing was found).
+    """
+    from .models import SoilTest
+
+    soil_test = SoilTest.objects.filter(pk=soil_test_id).first()
+    if soil_test is None or not soil_test.test_report:
+        return {}
+    if not is_supported_report(soil_test.test_report.name):
+        return {}
+
+    try:
+        with soil_test.test_report.open('rb') as fh:
+            values = parse_report(fh, soil_test.test_report.name)
+    except (ReportParseError, OSError) as e:
+        logger.warning("Could not parse soil report %s: %s", soil_test.test_report.name, e)
+        set_report_status(soil_test, 'failed', str(e))
+        return {}
+
+    if not values:
+        set_report_status(soil_test, 'failed', 'No soil values were found in the report.')
+        return {}
+    if fields is not None:
+        values = {field: value for field, value in values.items() if field in fields}
+    set_report_status(soil_test, 'done', values=values)
+    return values
+
+
+def enqueue_report(soil_test, fields=None):
+    """
+    Schedule background parsing of a SoilTest's report, to fill in fields
+    (all the report fields if None), once the current transaction commits.
+    Returns False if there is nothing to parse or to fill in.
+    """
+    if not soil_test.test_report or not is_supported_report(soil_test.test_report.name):
+        return False
+    if fields is not None and not fields:
+        if soil_test.report_status:
+            set_report_status(soil_test, '')  # about an earlier report
+        return False
+    set_report_status(soil_test, 'pending')
+    soil_test_id = soil_test.pk
+    database = soil_test._state.db or DEFAULT_DB_ALIAS
+    fields = None if fields is None else list(fields)
+    transaction.on_commit(lambda: submit(soil_test_id, database, fields), using=database)
+    return True
+
+
+def submit(soil_test_id, database=DEFAULT_DB_ALIAS, fields=None):
+    """
+    Put a SoilTest id on the queue without blocking. Returns False if full,
+    after recording on the SoilTest that its report was not read.
+    """
+    try:
+        _get_queue().put_nowait((database, soil_test_id, fields))
+    except queue.Full:
+        logger.warning("Soil report queue full; skipping SoilTest %s", soil_test_id)
+        with use_shard(database):
+            record_failure(
+                soil_test_id, 'Too many reports were waiting to be read. Upload it again or enter the values.',
+            )
+        return False
+    return True
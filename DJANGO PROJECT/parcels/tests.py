@@ -0,0 +1,83 @@
+import queue
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from fertilizer_planner.sharding import data_aliases, shard_for_user, use_shard
+from .models import LandParcel, SoilTest
+from .report_worker import process_report, submit
+
+
+REPORT = b'N,P,K,pH,OM\n42,18,160,6.5,2.1\n'
+
+
+class SoilReportTests(TestCase):
+    databases = set(data_aliases())
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.user = User.objects.create_user('farmer', password='Farm-Pass-123')
+        self.database = shard_for_user(self.user.pk)
+        self.enterContext(use_shard(self.database))
+        self.parcel = LandParcel.objects.create(user=self.user, name='North field', location='Valley', area_hectares=2)
+        self.client.force_login(self.user)
+
+    def upload(self, report=REPORT, **values):
+        """Post the soil test form; returns the SoilTest and the job that would be queued."""
+        data = {'test_date': '2026-01-01', 'notes': '', **values}
+        data['test_report'] = SimpleUploadedFile('report.csv', report, content_type='text/csv')
+        with mock.patch('parcels.report_worker.submit') as queued:
+            with self.captureOnCommitCallbacks(using=self.database, execute=True):
+                response = self.client.post(reverse('parcels:soil_test_create', args=[self.parcel.pk]), data)
+        self.assertRedirects(response, reverse('parcels:parcel_detail', args=[self.parcel.pk]))
+        return SoilTest.objects.get(parcel=self.parcel), queued.call_args
+
+    def test_only_blank_fields_are_filled_in(self):
+        soil_test, job = self.upload(nitrogen_ppm=25, ph_level=7.2)
+        self.assertEqual(soil_test.report_status, 'pending')
+        soil_test_id, database, fields = job.args
+        self.assertEqual(fields, ['phosphorus_ppm', 'potassium_ppm', 'organic_matter_percent'])
+
+        process_report(soil_test_id, fields)
+
+        soil_test.refresh_from_db()
+        self.assertEqual((soil_test.nitrogen_ppm, soil_test.ph_level), (25, 7.2))
+        self.assertEqual((soil_test.phosphorus_ppm, soil_test.potassium_ppm), (18, 160))
+        self.assertEqual(soil_test.report_status, 'done')
+
+    def test_nothing_to_fill_in(self):
+        soil_test, job = self.upload(
+            nitrogen_ppm=25, phosphorus_ppm=10, potassium_ppm=90, ph_level=7.2, organic_matter_percent=1,
+        )
+        self.assertIsNone(job)
+        self.assertEqual(soil_test.report_status, '')
+
+    def test_unreadable_report_is_shown_on_the_parcel(self):
+        soil_test, job = self.upload(report=b'nothing useful here\n')
+        process_report(*job.args[::2])
+
+        soil_test.refresh_from_db()
+        self.assertEqual(soil_test.report_status, 'failed')
+        response = self.client.get(reverse('parcels:parcel_detail', args=[self.parcel.pk]))
+        self.assertContains(response, 'could not be read: No soil values were found in the report.')
+
+    def test_full_queue_is_recorded(self):
+        soil_test, job = self.upload()
+        full = queue.Queue(maxsize=1)
+        full.put(None)
+        with mock.patch('parcels.report_worker._get_queue', return_value=full):
+            with self.assertLogs('parcels.report_worker', 'WARNING'):
+                self.assertFalse(submit(*job.args))
+
+        soil_test.refresh_from_db()
+        self.assertEqual(soil_test.report_status, 'failed')
+        self.assertIn('Too many reports', soil_test.report_error)
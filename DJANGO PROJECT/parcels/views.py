@@ -1,11 +1,16 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import LandParcel, SoilTest, Crop
+from django.conf import settings
+from fertilizer_planner.cache import cache_per_user
+from .models import LandParcel, SoilTest
 from .forms import LandParcelForm, SoilTestForm, CropForm
+from .report_worker import enqueue_report
+from .cache import CROPS_NAMESPACE, get_crops, crops_version
 
 
 @login_required
+@cache_per_user('dashboard', timeout=settings.PAGE_CACHE_TIMEOUT, depends_on=[CROPS_NAMESPACE])
 def dashboard(request):
     parcels = LandParcel.objects.filter(user=request.user)
     total_parcels = parcels.count()
@@ -25,7 +30,7 @@ def dashboard(request):
 
 @login_required
 def parcel_list(request):
-    parcels = LandParcel.objects.filter(user=request.user)
+    parcels = LandParcel.objects.filter(user=request.user).select_related('crop', 'soil_test')
     return render(request, 'parcels/parcel_list.html', {'parcels': parcels})
 
 
@@ -103,6 +108,8 @@ def soil_test_create(request, pk):
             soil_test.parcel = parcel
             soil_test.save()
             messages.success(request, 'Soil test uploaded successfully!')
+            if enqueue_report(soil_test, form.report_fields_blank):
+                messages.info(request, 'Report values will be filled in once the file has been processed.')
             return redirect('parcels:parcel_detail', pk=parcel.pk)
     else:
         form = SoilTestForm()
@@ -118,6 +125,8 @@ def soil_test_update(request, pk):
         if form.is_valid():
             form.save()
             messages.success(request, 'Soil test updated successfully!')
+            if 'test_report' in form.changed_data and enqueue_report(soil_test, form.report_fields_blank):
+                messages.info(request, 'Report values will be filled in once the file has been processed.')
             return redirect('parcels:parcel_detail', pk=soil_test.parcel.pk)
     else:
         form = SoilTestForm(instance=soil_test)
@@ -127,8 +136,10 @@ def soil_test_update(request, pk):
 
 @login_required
 def crop_list(request):
-    crops = Crop.objects.all()
-    return render(request, 'parcels/crop_list.html', {'crops': crops})
+    return render(request, 'parcels/crop_list.html', {
+        'crops': get_crops(),
+        'crops_version': crops_version(),
+    })
 
 
 @login_required
@@ -0,0 +1,52 @@
+"""
+Export Format Registry
+
+Each export format names its backend by dotted path. The backend module,
+and whatever it depends on (ReportLab for PDF), is imported the first time
+the format is used rather than when the views are loaded, so worker
+processes that never export a PDF never pay for ReportLab.
+
+A backend is a function taking (recommendation, items) and returning the
+file content as bytes. Formats marked cpu_bound are built in the bounded
+export pool.
+"""
+
+from django.http import Http404
+from django.utils.module_loading import import_string
+
+
+class ExportFormat:
+    def __init__(self, name, backend, content_type, cpu_bound=False):
+        self.name = name
+        self.backend = backend
+        self.content_type = content_type
+        self.cpu_bound = cpu_bound
+
+    def filename(self, recommendation):
+        return f'fertilizer_recommendation_{recommendation.pk}.{self.name}'
+
+
+EXPORT_FORMATS = {
+    export_format.name: export_format
+    for export_format in [
+        ExportFormat('pdf', 'reports.exporters.pdf.build_pdf', 'application/pdf', cpu_bound=True),
+        ExportFormat('csv', 'reports.exporters.csv.build_csv', 'text/csv'),
+        ExportFormat('ndjson', 'reports.exporters.ndjson.build_ndjson', 'application/x-ndjson'),
+    ]
+}
+
+
+def build_export(backend, recommendation, items):
+    """
+    Import a backend by dotted path and build an export with it. Module-level
+    so it can be sent to a process pool, where the import then happens in the
+    worker rather than in the web process.
+    """
+    return import_string(backend)(recommendation, items)
+
+
+def get_export_format(name):
+    try:
+        return EXPORT_FORMATS[name]
+    except KeyError:
+        raise Http404(f"Unknown export format '{name}'")
@@ -0,0 +1,77 @@
+"""CSV export."""
+
+import csv
+from io import StringIO
+
+
+def write_csv(recommendation, items, out):
+    """Write a recommendation report as CSV to a file-like object."""
+    writer = csv.writer(out)
+    
+    # Write header
+    writer.writerow(['Fertilizer Recommendation Report'])
+    writer.writerow([])
+    writer.writerow(['Parcel Information'])
+    writer.writerow(['Parcel Name', recommendation.parcel.name])
+    writer.writerow(['Location', recommendation.parcel.location])
+    writer.writerow(['Area (hectares)', recommendation.parcel.area_hectares])
+    writer.writerow(['Crop', recommendation.parcel.crop.name if recommendation.parcel.crop else 'N/A'])
+    writer.writerow(['Soil Type', recommendation.parcel.get_soil_type_display()])
+    writer.writerow([])
+    
+    writer.writerow(['Soil Test Data'])
+    writer.writerow(['Nitrogen (ppm)', recommendation.inputs.soil_nitrogen_ppm])
+    writer.writerow(['Phosphorus (ppm)', recommendation.inputs.soil_phosphorus_ppm])
+    writer.writerow(['Potassium (ppm)', recommendation.inputs.soil_potassium_ppm])
+    writer.writerow(['pH Level', recommendation.inputs.soil_ph])
+    writer.writerow([])
+    
+    writer.writerow(['Nutrient Requirements'])
+    writer.writerow(['Nutrient', 'Required (kg)', 'Deficit (kg)', 'Recommended (kg)'])
+    writer.writerow(['Nitrogen', recommendation.inputs.crop_nitrogen_requirement, 
+                    recommendation.nitrogen_needed_kg, recommendation.nitrogen_needed_kg])
+    writer.writerow(['Phosphorus', recommendation.inputs.crop_phosphorus_requirement,
+                    recommendation.phosphorus_needed_kg, recommendation.phosphorus_needed_kg])
+    writer.writerow(['Potassium', recommendation.inputs.crop_potassium_requirement,
+                    recommendation.potassium_needed_kg, recommendation.potassium_needed_kg])
+    writer.writerow([])
+    
+    writer.writerow(['Recommended Fertilizers'])
+    writer.writerow(['Fertilizer', 'Quantity', 'Unit', 'Cost (USD)'])
+    for item in items:
+        writer.writerow([item.fertilizer.name, item.quantity, item.unit, item.cost])
+    
+    writer.writerow([])
+    writer.writerow(['Estimated Total Cost (USD)', recommendation.estimated_total_cost])
+    writer.writerow(['Generated on', recommendation.generated_at.strftime('%Y-%m-%d %H:%M:%S')])
+    
+    if recommendation.notes:
+        writer.writerow([])
+        writer.writerow(['Notes', recommendation.notes])
+
+
+def build_csv(recommendation, items):
+    """Render a recommendation report as CSV bytes."""
+    out = StringIO()
+    write_csv(recommendation, items, out)
+    return out.getvalue().encode('utf-8')
+
+
+def build_procurement_csv(lines, totals):
+    """Render a procurement plan (see fertilizers.procurement) as CSV bytes."""
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['Fertilizer', 'Brand', 'Recommendations', 'Total (kg)', 'Purchase Quantity',
+                     'Purchase Unit', 'Price per Unit (USD)', 'Price Unit', 'Recommended Cost (USD)',
+                     'Purchase Cost (USD)'])
+    for line in lines:
+        writer.writerow([
+            line['name'], line['brand'], line['recommendations'], round(line['total_kg'], 2),
+            line['purchase_quantity'], line['purchase_unit'], line['price_per_unit'], line['unit'],
+            line['recommended_cost'], line['purchase_cost'],
+        ])
+    writer.writerow([])
+    writer.writerow(['Total (kg)', round(totals['total_kg'], 2)])
+    writer.writerow(['Recommended Cost (USD)', totals['recommended_cost']])
+    writer.writerow(['Purchase Cost (USD)', totals['purchase_cost']])
+    return out.getvalue().encode('utf-8')
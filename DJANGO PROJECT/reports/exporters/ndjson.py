@@ -0,0 +1,34 @@
+"""
+NDJSON export: one line describing the recommendation, then one line per
+recommended fertilizer, in the same shape as the batch API results.
+"""
+
+import json
+
+
+def build_ndjson(recommendation, items):
+    """Render a recommendation report as NDJSON bytes."""
+    parcel = recommendation.parcel
+    lines = [{
+        'recommendation_id': recommendation.pk,
+        'parcel': parcel.pk,
+        'parcel_name': parcel.name,
+        'crop': parcel.crop.name if parcel.crop else None,
+        'area_hectares': parcel.area_hectares,
+        'status': recommendation.status,
+        'generated_at': recommendation.generated_at.isoformat(),
+        'nitrogen_needed_kg': round(recommendation.nitrogen_needed_kg, 2),
+        'phosphorus_needed_kg': round(recommendation.phosphorus_needed_kg, 2),
+        'potassium_needed_kg': round(recommendation.potassium_needed_kg, 2),
+        'estimated_total_cost': float(recommendation.estimated_total_cost),
+        'notes': recommendation.notes,
+    }]
+    for item in items:
+        lines.append({
+            'fertilizer_id': item.fertilizer_id,
+            'fertilizer': item.fertilizer.name,
+            'quantity': item.quantity,
+            'unit': item.unit,
+            'cost': float(item.cost),
+        })
+    return ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8')
@@ -0,0 +1,66 @@
+from django import forms
+from django.contrib.auth.models import User
+from fertilizer_planner.sharding import current_shard, data_aliases, shard_for_user
+
+
+class ProcurementFilterForm(forms.Form):
+    region = forms.CharField(
+        required=False,
+        help_text="Matches the parcel location",
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Any region'}),
+    )
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    user = forms.CharField(
+        required=False,
+        help_text="Username; leave blank for all users",
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'All users'}),
+    )
+
+    def __init__(self, *args, request_user, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_user = request_user
+        # Only staff (e.g. a cooperative's buyer) plan across users
+        if not request_user.is_staff:
+            del self.fields['user']
+
+    def clean_user(self):
+        """Resolve the username to a User (one indexed lookup), or None for all users."""
+        username = self.cleaned_data['user'].strip()
+        if not username:
+            return None
+        user = User.objects.only('pk', 'username').filter(username=username).first()
+        if user is None:
+            raise forms.ValidationError(f'No user named "{username}".')
+        return user
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError("The start date must be before the end date.")
+        return cleaned_data
+
+    def databases(self):
+        """The databases (see fertilizer_planner.sharding) holding the recommendations the filters can match."""
+        data = self.cleaned_data if self.is_valid() else {}
+        if 'user' not in self.fields:
+            return [current_shard()]
+        if data.get('user'):
+            return [shard_for_user(data['user'].pk)]
+        return data_aliases()
+
+    def filter(self, recommendations):
+        """Narrow a queryset of recommendations to the (valid) filters."""
+        data = self.cleaned_data if self.is_valid() else {}
+        if 'user' not in self.fields:
+            recommendations = recommendations.filter(user=self.request_user)
+        elif data.get('user'):
+            recommendations = recommendations.filter(user=data['user'])
+        if data.get('region'):
+            recommendations = recommendations.filter(parcel__location__icontains=data['region'])
+        if data.get('date_from'):
+            recommendations = recommendations.filter(generated_at__date__gte=data['date_from'])
+        if data.get('date_to'):
+            recommendations = recommendations.filter(generated_at__date__lte=data['date_to'])
+        return recommendations
@@ -0,0 +1,60 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from fertilizer_planner.cache import bump_version, measure_db_time
+from fertilizers.cache import recommendation_namespace
+from fertilizers.models import FertilizerRecommendation
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the recommendation detail page with its rendered body cached against '
+        're-rendering it on every request (the body invalidated before each one). Reports '
+        'latency and queries per request; the session lookup is the only query left on a hit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--recommendation', type=int, help='Recommendation id (default: the latest one)')
+
+    def handle(self, *args, **options):
+        recommendations = FertilizerRecommendation.objects.select_related('user').order_by('-pk')
+        if options['recommendation']:
+            recommendations = recommendations.filter(pk=options['recommendation'])
+        recommendation = recommendations.first()
+        if recommendation is None:
+            raise CommandError('No recommendation to request; run `manage.py load_sample_data` and generate one first.')
+
+        client = Client()
+        client.force_login(recommendation.user)
+        url = reverse('reports:recommendation_detail', args=[recommendation.pk])
+        namespace = recommendation_namespace(recommendation.pk)
+        client.get(url)  # warm templates, URL resolvers and the session
+
+        self.stdout.write(f'{url} ({recommendation.items.count()} items), {options["requests"]} requests each')
+        self.stdout.write(f'{"":<10} {"median ms":>10} {"p95 ms":>10} {"queries":>8}')
+        medians = {}
+        for label, invalidate in (('uncached', True), ('cached', False)):
+            latencies, queries = [], []
+            for _ in range(options['requests']):
+                if invalidate:
+                    bump_version(namespace)
+                with measure_db_time() as timings:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+                queries.append(len(timings))
+            latencies.sort()
+            medians[label] = statistics.median(latencies)
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            self.stdout.write(f'{label:<10} {medians[label]:>10.2f} {p95:>10.2f} {statistics.mean(queries):>8.1f}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Cached body: {medians["uncached"] / medians["cached"]:.1f}x faster '
+            f'({medians["uncached"] - medians["cached"]:.2f} ms saved per request)'
+        ))
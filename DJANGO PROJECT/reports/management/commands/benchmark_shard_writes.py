@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from fertilizer_planner.sharding import data_aliases, move_user, shard_for_user, target_shard, use_shard
+from fertilizers.models import FertilizerRecommendation
+from fertilizers.recommendation_engine import generate_for_parcel, load_catalog
+from parcels.models import Crop, LandParcel, SoilTest
+
+
+USERNAME_PREFIX = 'shardbench-'
+
+
+def run_workload(users, duration, catalog):
+    """
+    One writer thread per user, each generating recommendations for its
+    parcel on the shard the router picks for the user.
+    Returns (commits, lock_errors, sorted commit latencies in ms).
+    """
+    counts = {'commits': 0, 'locked': 0}
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def writer(user):
+        with use_shard(shard_for_user(user.pk)):
+            parcel = LandParcel.objects.select_related('crop', 'soil_test').get(user=user)
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    generate_for_parcel(parcel, user, catalog=catalog)
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    with lock:
+                        counts['locked'] += 1
+                    continue
+                with lock:
+                    counts['commits'] += 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+        connections.close_all()
+
+    threads = [threading.Thread(target=writer, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return counts['commits'], counts['locked'], latencies
+
+
+def recommendations_by_database(users):
+    """
+    {alias: number of the users' recommendations stored there}, and how
+    many of those are outside their user's database.
+    """
+    homes = {user.pk: shard_for_user(user.pk) for user in users}
+    stored, misplaced = Counter(), 0
+    for alias in data_aliases():
+        user_ids = FertilizerRecommendation.objects.using(alias).filter(
+            user_id__in=homes).values_list('user_id', flat=True)
+        for user_id in user_ids:
+            stored[alias] += 1
+            misplaced += homes[user_id] != alias
+    return stored, misplaced
+
+
+def delete_recommendations(users):
+    for alias in data_aliases():
+        with use_shard(alias):
+            FertilizerRecommendation.objects.filter(user__in=users).delete()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent recommendation writes by many users kept in the main database against '
+        'the same users on their SQLITE_SHARDS shards. Each writer generates recommendations through '
+        'the ORM, so rows go where ShardRouter sends them; the command checks that every row landed '
+        f'in its user\'s database. Creates users named {USERNAME_PREFIX}N with one parcel each and '
+        'deletes them afterwards. Uses the database settings; set SQLITE_SYNCHRONOUS=FULL to include '
+        'an fsync per commit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help='Concurrent writers, one per user')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per configuration')
+
+    def handle(self, *args, **options):
+        if not settings.SHARD_DATABASES:
+            raise CommandError('Sharding is off: set SQLITE_SHARDS and run `manage.py rebalance_shards` first.')
+        crop = Crop.objects.first()
+        if crop is None:
+            raise CommandError('No crops found; run `manage.py load_sample_data` first.')
+        catalog = load_catalog()
+
+        # Left over from an interrupted run
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        users = self.create_users(options['users'], crop)
+        try:
+            self.benchmark(users, options['duration'], catalog)
+        finally:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def create_users(self, count, crop):
+        users = []
+        for i in range(count):
+            user = User.objects.create_user(username=f'{USERNAME_PREFIX}{i}')
+            # No use_shard(): saved rows go to their owner's shard
+            parcel = LandParcel(
+                user=user, name='Benchmark field', location='Synthetic farm', area_hectares=5, crop=crop,
+            )
+            parcel.save()
+            SoilTest(parcel=parcel, test_date=date.today(), nitrogen_ppm=10, phosphorus_ppm=8,
+                     potassium_ppm=60).save()
+            users.append(user)
+        return users
+
+    def benchmark(self, users, duration, catalog):
+        pragmas = settings.SQLITE_PRAGMAS
+        shards = len(settings.SHARD_DATABASES)
+        self.stdout.write(
+            f'{len(users)} users writing for {duration:.0f}s each, '
+            f'journal_mode={pragmas["journal_mode"]} synchronous={pragmas["synchronous"]}'
+        )
+        self.stdout.write(f'{"databases":>9} {"commits/s":>10} {"p50 ms":>8} {"p95 ms":>8} {"lock errors":>12}')
+        throughput = {}
+        for databases in (1, shards):
+            for user in users:
+                source = shard_for_user(user.pk)
+                target = DEFAULT_DB_ALIAS if databases == 1 else target_shard(user.pk)
+                if source != target:
+                    move_user(user.pk, source, target)
+
+            commits, locked, latencies = run_workload(users, duration, catalog)
+
+            stored, misplaced = recommendations_by_database(users)
+            if sum(stored.values()) != commits or misplaced:
+                raise CommandError(
+                    f'{commits} commits, but {dict(stored)} recommendations stored by database, '
+                    f'{misplaced} of them outside their user\'s database'
+                )
+            delete_recommendations(users)
+
+            throughput[databases] = commits / duration
+            p50 = latencies[len(latencies) // 2] if latencies else 0
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+            self.stdout.write(
+                f'{databases:>9} {throughput[databases]:>10.1f} {p50:>8.2f} {p95:>8.2f} {locked:>12}'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{shards} shards: {throughput[shards] / (throughput[1] or 1):.2f}x '
+            f'the commits per second of one database'
+        ))
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+CONFIGURATIONS = {
+    # Django's stock sqlite3 setup: rollback journal, deferred BEGIN
+    'default': {
+        'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+        'begin': 'BEGIN',
+    },
+    # The tuned setup from settings.DATABASES
+    'tuned': {
+        'pragmas': None,
+        'begin': 'BEGIN IMMEDIATE',
+    },
+}
+
+
+def run_workload(path, config, writers, readers, duration, timeout):
+    """Run concurrent writers and readers; return (writes, reads, lock_errors)."""
+    pragmas = config['pragmas'] if config['pragmas'] is not None else settings.SQLITE_PRAGMAS
+    counts = {'writes': 0, 'reads': 0, 'locked': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def connect():
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def writer():
+        conn = connect()
+        while time.monotonic() < deadline:
+            try:
+                # Shaped like generate_recommendation: read, then insert
+                conn.execute(config['begin'])
+                conn.execute('SELECT COUNT(*) FROM recommendation WHERE parcel = 1').fetchone()
+                conn.execute('INSERT INTO recommendation (parcel, cost) VALUES (1, 10.5)')
+                conn.execute('COMMIT')
+                bump('writes')
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                if 'locked' in str(e):
+                    bump('locked')
+                else:
+                    raise
+        conn.close()
+
+    def reader():
+        conn = connect()
+        while time.monotonic() < deadline:
+            try:
+                conn.execute('SELECT parcel, SUM(cost), COUNT(*) FROM recommendation GROUP BY parcel').fetchall()
+                bump('reads')
+            except sqlite3.OperationalError as e:
+                if 'locked' in str(e):
+                    bump('locked')
+                else:
+                    raise
+        conn.close()
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+class Command(BaseCommand):
+    help = 'Compare "database is locked" errors of stock and tuned SQLite settings under concurrent load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per configuration')
+        parser.add_argument('--timeout', type=float, default=settings.SQLITE_BUSY_TIMEOUT / 1000,
+                            help='Busy timeout in seconds')
+
+    def handle(self, *args, **options):
+        for name, config in CONFIGURATIONS.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.sqlite3')
+                conn = sqlite3.connect(path)
+                conn.execute('CREATE TABLE recommendation (id INTEGER PRIMARY KEY, parcel INTEGER, cost REAL)')
+                conn.executemany('INSERT INTO recommendation (parcel, cost) VALUES (?, ?)',
+                                 [(i % 50, 1.0) for i in range(20000)])
+                conn.commit()
+                conn.close()
+
+                counts = run_workload(path, config, options['writers'], options['readers'],
+                                      options['duration'], options['timeout'])
+
+            self.stdout.write(
+                f"{name:8} writes/s {counts['writes'] / options['duration']:8.1f}  "
+                f"reads/s {counts['reads'] / options['duration']:8.1f}  "
+                f"lock errors {counts['locked']}"
+            )
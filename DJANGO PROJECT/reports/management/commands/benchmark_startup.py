@@ -0,0 +1,97 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Loads the WSGI application and the URLconf (and with it every view
+# module), which is what a worker does before serving its first request.
+WSGI_LOAD = (
+    "from django.core.wsgi import get_wsgi_application\n"
+    "application = get_wsgi_application()\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+)
+
+TARGETS = {
+    'manage.py check': ['manage.py', 'check'],
+    'wsgi app load': ['-c', WSGI_LOAD],
+}
+
+HEAVY_PACKAGES = ['reportlab']
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output into a list of (module, self_us,
+    cumulative_us, depth) tuples.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        self_us = int(self_us)
+        name = name[1:]  # drop the separator's space
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), self_us, int(cumulative_us), depth))
+    return imports
+
+
+def run_target(args):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+        'DJANGO_SETTINGS_MODULE', 'fertilizer_planner.settings'))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise CommandError(f'{" ".join(args)} failed:\n{result.stderr[-2000:]}')
+    return wall, parse_importtime(result.stderr)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure process startup with python -X importtime: total import time, wall time '
+        'and the slowest top-level imports for `manage.py check` and for loading the WSGI '
+        'application, and whether heavy optional packages (ReportLab) are imported at boot.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Runs per target; medians are reported')
+        parser.add_argument('--top', type=int, default=10, help='Number of slowest top-level imports to list')
+
+    def handle(self, *args, **options):
+        for label, target in TARGETS.items():
+            walls, totals = [], []
+            imports = []
+            for _ in range(options['runs']):
+                wall, imports = run_target(target)
+                walls.append(wall)
+                totals.append(sum(self_us for _, self_us, _, _ in imports))
+
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(f'  wall time:    {statistics.median(walls) * 1000:8.1f} ms')
+            self.stdout.write(f'  import time:  {statistics.median(totals) / 1000:8.1f} ms '
+                              f'({len(imports)} modules)')
+
+            loaded = {name.split('.')[0] for name, _, _, _ in imports}
+            for package in HEAVY_PACKAGES:
+                if package in loaded:
+                    self.stdout.write(self.style.WARNING(f'  {package} is imported at startup'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'  {package} is not imported at startup'))
+
+            top_level = sorted(
+                (entry for entry in imports if entry[3] == 0),
+                key=lambda entry: entry[2], reverse=True,
+            )[:options['top']]
+            self.stdout.write('  slowest top-level imports (last run, cumulative):')
+            for name, _, cumulative_us, _ in top_level:
+                self.stdout.write(f'    {cumulative_us / 1000:8.1f} ms  {name}')
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from fertilizer_planner.cache import cache_stats, reset_cache_stats
+from fertilizers.models import FertilizerRecommendation
+
+
+def cached_urls(user):
+    """The pages served from the per-user, fragment and catalog caches."""
+    urls = [
+        reverse('parcels:dashboard'),
+        reverse('parcels:parcel_list'),
+        reverse('parcels:crop_list'),
+        reverse('fertilizers:product_list'),
+        reverse('reports:recommendation_history'),
+    ]
+    latest = FertilizerRecommendation.objects.filter(user=user).values_list('pk', flat=True).first()
+    if latest:
+        urls.append(reverse('reports:recommendation_detail', args=[latest]))
+    return urls
+
+
+class Command(BaseCommand):
+    help = (
+        'Report cache hit rates and the database time the caches save. Stats are kept in '
+        'the cache itself, for the share of lookups set by CACHE_STATS_SAMPLE_PERCENT, so with '
+        'CACHE_BACKEND=file or redis this reports on the running servers; with the per-process '
+        'locmem cache (or sampling off) use --exercise to browse the cached pages as a user in '
+        'this process first, counting every lookup.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exercise', metavar='USERNAME',
+                            help='Request the cached pages as this user before reporting')
+        parser.add_argument('--rounds', type=int, default=20,
+                            help='Number of times each page is requested with --exercise')
+        parser.add_argument('--reset', action='store_true', help='Clear the collected stats and exit')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Cache stats cleared.'))
+            return
+
+        if options['exercise']:
+            try:
+                user = User.objects.get(username=options['exercise'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['exercise']}' does not exist.")
+            client = Client()
+            client.force_login(user)
+            with override_settings(CACHE_STATS_SAMPLE_PERCENT=100):
+                for _ in range(options['rounds']):
+                    for url in cached_urls(user):
+                        response = client.get(url)
+                        if response.status_code != 200:
+                            raise CommandError(f'{url} returned {response.status_code}')
+
+        stats = cache_stats()
+        if not stats:
+            self.stdout.write('No cache activity recorded yet (is CACHE_STATS_SAMPLE_PERCENT set?).')
+            return
+        percent = settings.CACHE_STATS_SAMPLE_PERCENT
+        if not options['exercise'] and 0 < percent < 100:
+            self.stdout.write(f'Counts cover {percent:g}% of lookups.')
+
+        self.stdout.write(f'{"cache":<30} {"hits":>8} {"misses":>8} {"hit rate":>9} '
+                          f'{"DB ms/miss":>11} {"DB ms saved":>12}')
+        total_saved = 0.0
+        for name, counts in stats.items():
+            hits, misses = counts['hits'], counts['misses']
+            per_miss = counts['db_us'] / 1000 / misses if misses else 0.0
+            saved = hits * per_miss
+            total_saved += saved
+            rate = hits / (hits + misses) if hits + misses else 0.0
+            self.stdout.write(f'{name:<30} {hits:>8} {misses:>8} {rate:>9.1%} '
+                              f'{per_miss:>11.2f} {saved:>12.1f}')
+        self.stdout.write(self.style.SUCCESS(f'Estimated database time saved: {total_saved:.1f} ms'))
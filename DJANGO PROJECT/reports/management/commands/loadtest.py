@@ -0,0 +1,250 @@
+import http.cookiejar
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+from fertilizer_planner.sharding import data_aliases, shard_for_user, use_shard
+from parcels.models import Crop, LandParcel
+
+
+USERNAME_PREFIX = 'loadtest-'
+
+
+class KeepRedirects(urllib.request.HTTPErrorProcessor):
+    """Return 3xx/4xx/5xx responses as they are, so every hop is timed on its own."""
+
+    def http_response(self, request, response):
+        return response
+
+    https_response = http_response
+
+
+def url_name(url):
+    path = urllib.parse.urlsplit(url).path
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return path
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name, seconds, ok):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+
+class VirtualUser:
+    """One browser session walking through the farm workflow."""
+
+    def __init__(self, base_url, username, password, parcel_ids, recorder):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.parcel_ids = parcel_ids
+        self.recorder = recorder
+        self.recommendation_id = None
+
+    def request(self, path, data=None):
+        url = urllib.parse.urljoin(self.base_url, path)
+        body = None
+        headers = {}
+        if data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers['X-CSRFToken'] = self.csrf_token()
+            headers['Referer'] = url
+        start = time.perf_counter()
+        try:
+            with self.opener.open(urllib.request.Request(url, data=body, headers=headers)) as response:
+                response.read()
+                status, location = response.status, response.headers.get('Location')
+        except (urllib.error.URLError, OSError):
+            status, location = None, None
+        elapsed = time.perf_counter() - start
+        ok = status is not None and status < 400
+        name = url_name(url) if data is None else f'{url_name(url)} (POST)'
+        self.recorder.add(name, elapsed, ok)
+        return status, location
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.jar if cookie.name == 'csrftoken'), '')
+
+    def login(self):
+        self.jar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.jar), KeepRedirects)
+        self.request('/login/')
+        status, _ = self.request('/login/', {'username': self.username, 'password': self.password})
+        return status == 302
+
+    def run_scenario(self):
+        if not self.login():
+            return False
+        self.request('/parcels/')
+        self.request('/parcels/list/')
+
+        parcel_id = random.choice(self.parcel_ids)
+        soil_test = {
+            'test_date': date.today().isoformat(),
+            'nitrogen_ppm': round(random.uniform(5, 40), 1),
+            'phosphorus_ppm': round(random.uniform(3, 30), 1),
+            'potassium_ppm': round(random.uniform(20, 200), 1),
+            'ph_level': round(random.uniform(5.5, 7.5), 1),
+            'organic_matter_percent': round(random.uniform(1, 5), 1),
+            'notes': 'load test',
+        }
+        status, location = self.request(f'/parcels/{parcel_id}/soil-test/', soil_test)
+        if status == 302 and location and location.rstrip('/').endswith('/update'):
+            # The parcel already has a soil test: update it instead
+            self.request(location, soil_test)
+
+        status, location = self.request(f'/fertilizers/generate/{parcel_id}/', {'notes': 'load test'})
+        if status != 302 or not location or '/reports/recommendation/' not in location:
+            return False
+        self.recommendation_id = location.rstrip('/').rsplit('/', 1)[-1]
+        self.request(location)
+        self.request('/reports/history/')
+        self.request(f'/reports/export/pdf/{self.recommendation_id}/')
+        return True
+
+    def run_export(self, export_format):
+        """Export this user's recommendation, running the workflow once first to create it."""
+        if self.recommendation_id is None and not self.run_scenario():
+            return False
+        status, _ = self.request(f'/reports/export/{export_format}/{self.recommendation_id}/')
+        return status == 200
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive a running server (runserver, gunicorn or uvicorn) through the farm workflow: '
+        'log in, view the dashboard, list parcels, upload a soil test, generate a '
+        'recommendation, view it and the history, and export a PDF. Each virtual user is a '
+        'thread with its own session. Reports p50/p95/p99 latency and throughput per URL name. '
+        'Use --create-users first to add the synthetic loadtest-N users and their parcels. '
+        'With --scenario export each virtual user only exports its recommendation; run it once '
+        'against a single-worker WSGI server (gunicorn fertilizer_planner.wsgi -w 1 --threads 8) '
+        'and once against a single-worker ASGI server (uvicorn fertilizer_planner.asgi:application '
+        '--workers 1) to compare export throughput per worker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=8, help='Concurrent virtual users')
+        parser.add_argument('--iterations', type=int, default=10, help='Scenarios run by each virtual user')
+        parser.add_argument('--scenario', choices=['workflow', 'export'], default='workflow',
+                            help='The full farm workflow, or repeated exports of one recommendation')
+        parser.add_argument('--format', choices=['pdf', 'csv', 'ndjson'], default='pdf',
+                            help='Export format for --scenario export')
+        parser.add_argument('--password', default='loadtest-Pass-123')
+        parser.add_argument('--think-time', type=float, default=0.0,
+                            help='Seconds each virtual user waits between scenarios')
+        parser.add_argument('--create-users', type=int, metavar='N',
+                            help='Create N synthetic users (with parcels) and exit')
+        parser.add_argument('--parcels', type=int, default=5, help='Parcels per synthetic user')
+
+    def handle(self, *args, **options):
+        if options['create_users']:
+            self.create_users(options['create_users'], options['parcels'], options['password'])
+            return
+
+        parcels = defaultdict(list)
+        for alias in data_aliases():
+            for username, parcel_id in LandParcel.objects.using(alias).filter(
+                user__username__startswith=USERNAME_PREFIX, crop__isnull=False,
+            ).values_list('user__username', 'pk'):
+                parcels[username].append(parcel_id)
+        usernames = sorted(parcels)[:options['users']]
+        if len(usernames) < options['users']:
+            raise CommandError(
+                f'Only {len(usernames)} synthetic users with parcels exist; '
+                f'run with --create-users {options["users"]} first.'
+            )
+
+        recorder = Recorder()
+        failed = []
+
+        def worker(username):
+            virtual_user = VirtualUser(options['base_url'], username, options['password'], parcels[username], recorder)
+            for _ in range(options['iterations']):
+                if options['scenario'] == 'export':
+                    ok = virtual_user.run_export(options['format'])
+                else:
+                    ok = virtual_user.run_scenario()
+                if not ok:
+                    failed.append(username)
+                if options['think_time']:
+                    time.sleep(options['think_time'])
+
+        threads = [threading.Thread(target=worker, args=(username,)) for username in usernames]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if not recorder.latencies:
+            raise CommandError('No requests completed; is the server running?')
+
+        self.stdout.write(
+            f'{"url name":<44} {"reqs":>6} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>7}'
+        )
+        for name, latencies in sorted(recorder.latencies.items(), key=lambda item: -statistics.median(item[1])):
+            self.stdout.write(
+                f'{name:<44} {len(latencies):>6} {recorder.errors[name]:>6} '
+                f'{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} '
+                f'{percentile(latencies, 0.99) * 1000:>8.1f} {len(latencies) / elapsed:>7.1f}'
+            )
+
+        total = sum(len(latencies) for latencies in recorder.latencies.values())
+        scenarios = len(usernames) * options['iterations']
+        self.stdout.write(
+            f'{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s), '
+            f'{scenarios} scenarios ({scenarios / elapsed:.2f}/s), {len(failed)} failed'
+        )
+
+    def create_users(self, count, parcels_per_user, password):
+        crops = list(Crop.objects.all())
+        if not crops:
+            raise CommandError('No crops found; run `manage.py load_sample_data` first.')
+
+        created = 0
+        for i in range(count):
+            username = f'{USERNAME_PREFIX}{i}'
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                user = User.objects.create_user(username=username, password=password)
+                created += 1
+            with use_shard(shard_for_user(user.pk)):
+                missing = parcels_per_user - user.land_parcels.count()
+                for j in range(missing):
+                    LandParcel.objects.create(
+                        user=user,
+                        name=f'Field {j + 1}',
+                        location='Synthetic farm',
+                        area_hectares=round(random.uniform(0.5, 20), 2),
+                        crop=random.choice(crops),
+                    )
+        self.stdout.write(self.style.SUCCESS(
+            f'{created} users created; {count} synthetic users with {parcels_per_user} parcels each.'
+        ))
@@ -0,0 +1,85 @@
+import io
+import json
+import os
+import pstats
+import statistics
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from fertilizer_planner.profiling import ROTATED_TIMINGS_FILE, TIMINGS_FILE
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Summarize the timings and cProfile dumps of the requests sampled by the '
+        'profiling middleware (PROFILING_ENABLED), grouped by URL name.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url-name', help="Only report this URL name, e.g. 'parcels:dashboard'")
+        parser.add_argument('--top', type=int, default=15, help='Functions listed per URL name')
+        parser.add_argument('--sort', choices=['cumulative', 'tottime', 'ncalls'], default='cumulative')
+        parser.add_argument('--clear', action='store_true', help='Delete the collected data and exit')
+
+    def handle(self, *args, **options):
+        directory = settings.PROFILING_DIR
+        if not os.path.isdir(directory):
+            raise CommandError(f'No profiling data in {directory}; set PROFILING_ENABLED=True first.')
+
+        if options['clear']:
+            for name in os.listdir(directory):
+                if name in (TIMINGS_FILE, ROTATED_TIMINGS_FILE) or name.endswith('.prof'):
+                    os.remove(os.path.join(directory, name))
+            self.stdout.write(self.style.SUCCESS('Profiling data cleared.'))
+            return
+
+        requests = defaultdict(list)
+        dumps = defaultdict(list)
+        for timings_file in (ROTATED_TIMINGS_FILE, TIMINGS_FILE):
+            timings_path = os.path.join(directory, timings_file)
+            if not os.path.exists(timings_path):
+                continue
+            with open(timings_path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if options['url_name'] and record['url_name'] != options['url_name']:
+                        continue
+                    requests[record['url_name']].append(record)
+                    if record['profile']:
+                        dumps[record['url_name']].append(os.path.join(directory, record['profile']))
+
+        if not requests:
+            self.stdout.write('No requests recorded yet.')
+            return
+
+        self.stdout.write(
+            f'{"url name":<40} {"reqs":>6} {"p50 ms":>8} {"p95 ms":>8} '
+            f'{"queries":>8} {"db ms":>8} {"tpl ms":>8} {"dumps":>6}'
+        )
+        by_total = sorted(requests.items(), key=lambda item: -sum(r['total_ms'] for r in item[1]))
+        for name, records in by_total:
+            totals = [r['total_ms'] for r in records]
+            self.stdout.write(
+                f'{name:<40} {len(records):>6} {percentile(totals, 0.5):>8.1f} {percentile(totals, 0.95):>8.1f} '
+                f'{statistics.mean(r["queries"] for r in records):>8.1f} '
+                f'{statistics.mean(r["db_ms"] for r in records):>8.1f} '
+                f'{statistics.mean(r["template_ms"] for r in records):>8.1f} '
+                f'{len(dumps[name]):>6}'
+            )
+
+        for name, _ in by_total:
+            files = [path for path in dumps[name] if os.path.exists(path)]
+            if not files:
+                continue
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} ({len(files)} sampled requests)'))
+            output = io.StringIO()
+            stats = pstats.Stats(*files, stream=output)
+            stats.strip_dirs().sort_stats(options['sort']).print_stats(options['top'])
+            self.stdout.write(output.getvalue())
@@ -6,7 +6,12 @@ app_name = 'reports'
 urlpatterns = [
     path('recommendation/<int:pk>/', views.recommendation_detail, name='recommendation_detail'),
     path('history/', views.recommendation_history, name='recommendation_history'),
-    path('export/pdf/<int:pk>/', views.export_pdf, name='export_pdf'),
-    path('export/csv/<int:pk>/', views.export_csv, name='export_csv'),
+    path('history/status/', views.transition_recommendations, name='transition_recommendations'),
+    path('archive/<int:pk>/', views.archived_recommendation_detail, name='archived_recommendation_detail'),
+    path('export/pdf/<int:pk>/', views.export_recommendation, {'format_name': 'pdf'}, name='export_pdf'),
+    path('export/csv/<int:pk>/', views.export_recommendation, {'format_name': 'csv'}, name='export_csv'),
+    path('export/ndjson/<int:pk>/', views.export_recommendation, {'format_name': 'ndjson'}, name='export_ndjson'),
+    path('procurement/', views.procurement_plan, name='procurement_plan'),
+    path('procurement/export/csv/', views.export_procurement_csv, name='export_procurement_csv'),
 ]
 
@@ -1,257 +1,223 @@
-from django.shortcuts import render, get_object_or_404
+from urllib.parse import urlencode
+
+from django.contrib import messages
+from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, FileResponse
+from django.http import HttpResponse, FileResponse, Http404
 from django.template.loader import render_to_string
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-from reportlab.lib import colors
-from io import BytesIO
-import csv
-from fertilizers.models import FertilizerRecommendation
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from fertilizer_planner.async_utils import async_login_required, run_cpu_bound
+from fertilizer_planner.cache import dependency_versions, get_with_dependencies, measure_db_time, set_with_dependencies
+from fertilizer_planner.routers import read_only_database
+from fertilizer_planner.sharding import use_shard
+from fertilizers.cache import product_namespace, recommendation_namespace
+from fertilizers.archive import decompress
+from fertilizers.models import ArchivedRecommendation, FertilizerRecommendation
+from fertilizers.procurement import merge_procurement_lines, procurement_lines, procurement_totals
+from fertilizers.transitions import ALLOWED_TRANSITIONS, transition
+from parcels.cache import CROPS_NAMESPACE, parcel_namespace
+from .exporters import build_export, get_export_format
+from .exporters.csv import build_procurement_csv
+from .forms import ProcurementFilterForm
 
 
-@login_required
-def recommendation_detail(request, pk):
-    recommendation = get_object_or_404(FertilizerRecommendation, pk=pk, user=request.user)
-    items = recommendation.items.all()
-    
-    context = {
+def recommendation_detail_body(recommendation_id, user_id):
+    """
+    The rendered body of a recommendation's detail page, or None if the
+    recommendation doesn't exist or isn't the user's.
+
+    Cached per recommendation with the versions of what it shows: the
+    recommendation and its items, its parcel, the crops and each product
+    listed. A hit is two cache reads and no queries, and lasts until one
+    of those changes rather than until anything of the user's does.
+    """
+    key = f'recommendation-detail:{recommendation_id}'
+    cached = get_with_dependencies('recommendation_detail', key)
+    if cached is not None:
+        owner_id, body = cached
+        return body if owner_id == user_id else None
+
+    versions = dependency_versions([recommendation_namespace(recommendation_id), CROPS_NAMESPACE])
+    with measure_db_time() as timings:
+        recommendation = (
+            FertilizerRecommendation.objects.select_related('inputs', 'parcel__crop')
+            .filter(pk=recommendation_id, user_id=user_id).first()
+        )
+        if recommendation is None:
+            return None
+        items = list(recommendation.items.select_related('fertilizer'))
+    versions.update(dependency_versions(
+        [parcel_namespace(recommendation.parcel_id)] + [product_namespace(item.fertilizer_id) for item in items]
+    ))
+
+    body = render_to_string('reports/recommendation_detail_body.html', {
         'recommendation': recommendation,
         'items': items,
-    }
-    return render(request, 'reports/recommendation_detail.html', context)
+    })
+    set_with_dependencies('recommendation_detail', key, (recommendation.user_id, body), versions,
+                          settings.RECOMMENDATION_PAGE_CACHE_TIMEOUT, sum(timings))
+    return body
+
+
+@login_required
+@read_only_database
+def recommendation_detail(request, pk):
+    body = recommendation_detail_body(pk, request.user.pk)
+    if body is None:
+        raise Http404("No recommendation found.")
+    response = render(request, 'reports/recommendation_detail.html', {'body': body})
+    patch_cache_control(response, private=True)
+    return response
 
 
+# Sync on purpose: the querysets stay lazy for the cached table fragment, so
+# a cache hit runs no query, and the template evaluates them on a miss
 @login_required
+@read_only_database
 def recommendation_history(request):
-    recommendations = FertilizerRecommendation.objects.filter(user=request.user)
+    recommendations = FertilizerRecommendation.objects.filter(user=request.user).select_related('parcel__crop')
     
     # Filter by parcel if provided
     parcel_id = request.GET.get('parcel')
     if parcel_id:
         recommendations = recommendations.filter(parcel_id=parcel_id)
-    
+
+    # The current status is a column on the recommendation (indexed with the
+    # user); the status change log is never consulted here
+    status = request.GET.get('status')
+    if status not in dict(FertilizerRecommendation.STATUS_CHOICES):
+        status = ''
+    if status:
+        recommendations = recommendations.filter(status=status)
+    
+    # Archived recommendations are only listed on request; their compressed
+    # documents are left unloaded until one is opened
+    show_archived = request.GET.get('archived') == '1'
+    archived = ArchivedRecommendation.objects.none()
+    if show_archived:
+        archived = ArchivedRecommendation.objects.filter(user=request.user).defer('data')
+        if parcel_id:
+            archived = archived.filter(parcel_id=parcel_id)
+
+    # Left lazy: the table is a cached fragment, so a hit runs no query
     context = {
         'recommendations': recommendations,
+        'parcel_filter': parcel_id or '',
+        'status_filter': status,
+        'status_choices': FertilizerRecommendation.STATUS_CHOICES,
+        'transition_choices': [
+            (value, label) for value, label in FertilizerRecommendation.STATUS_CHOICES if value in ALLOWED_TRANSITIONS
+        ],
+        'show_archived': show_archived,
+        'archived_recommendations': archived,
     }
     return render(request, 'reports/recommendation_history.html', context)
 
 
 @login_required
-def export_pdf(request, pk):
-    recommendation = get_object_or_404(FertilizerRecommendation, pk=pk, user=request.user)
-    items = recommendation.items.all()
-    
-    # Create a BytesIO buffer
-    buffer = BytesIO()
-    
-    # Create PDF document
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch)
-    story = []
-    
-    # Define styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#2c3e50'),
-        spaceAfter=12,
-    )
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#34495e'),
-        spaceAfter=6,
-    )
-    
-    # Title
-    story.append(Paragraph("Fertilizer Recommendation Report", title_style))
-    story.append(Spacer(1, 0.2*inch))
-    
-    # Parcel Information
-    story.append(Paragraph("Parcel Information", heading_style))
-    parcel_data = [
-        ['Parcel Name:', recommendation.parcel.name],
-        ['Location:', recommendation.parcel.location],
-        ['Area:', f"{recommendation.parcel.area_hectares} hectares"],
-        ['Crop:', recommendation.parcel.crop.name if recommendation.parcel.crop else 'N/A'],
-        ['Soil Type:', recommendation.parcel.get_soil_type_display()],
-    ]
-    parcel_table = Table(parcel_data, colWidths=[2*inch, 4*inch])
-    parcel_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#ecf0f1')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(parcel_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Soil Test Data
-    story.append(Paragraph("Soil Test Data", heading_style))
-    soil_data = [
-        ['Parameter', 'Value', 'Unit'],
-        ['Nitrogen', f"{recommendation.soil_nitrogen_ppm:.2f}", "ppm"],
-        ['Phosphorus', f"{recommendation.soil_phosphorus_ppm:.2f}", "ppm"],
-        ['Potassium', f"{recommendation.soil_potassium_ppm:.2f}", "ppm"],
-        ['pH Level', f"{recommendation.soil_ph:.2f}", ""],
-    ]
-    soil_table = Table(soil_data, colWidths=[2*inch, 2*inch, 2*inch])
-    soil_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-    ]))
-    story.append(soil_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Nutrient Requirements
-    story.append(Paragraph("Nutrient Requirements", heading_style))
-    req_data = [
-        ['Nutrient', 'Required (kg)', 'Soil Available (kg)', 'Deficit (kg)', 'Recommended (kg)'],
-        ['Nitrogen', f"{recommendation.crop_nitrogen_requirement:.2f}", 
-         f"{recommendation.soil_nitrogen_ppm * 1.95:.2f}", 
-         f"{recommendation.nitrogen_needed_kg:.2f}", f"{recommendation.nitrogen_needed_kg:.2f}"],
-        ['Phosphorus', f"{recommendation.crop_phosphorus_requirement:.2f}",
-         f"{recommendation.soil_phosphorus_ppm * 1.95:.2f}",
-         f"{recommendation.phosphorus_needed_kg:.2f}", f"{recommendation.phosphorus_needed_kg:.2f}"],
-        ['Potassium', f"{recommendation.crop_potassium_requirement:.2f}",
-         f"{recommendation.soil_potassium_ppm * 1.95:.2f}",
-         f"{recommendation.potassium_needed_kg:.2f}", f"{recommendation.potassium_needed_kg:.2f}"],
-    ]
-    req_table = Table(req_data, colWidths=[1.2*inch, 1.2*inch, 1.2*inch, 1.2*inch, 1.2*inch])
-    req_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#27ae60')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('TOPPADDING', (0, 0), (-1, -1), 6),
-        ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-    ]))
-    story.append(req_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Recommended Fertilizers
-    story.append(Paragraph("Recommended Fertilizers", heading_style))
-    if items:
-        fert_data = [['Fertilizer', 'Quantity', 'Unit', 'Cost (USD)']]
-        for item in items:
-            fert_data.append([
-                item.fertilizer.name,
-                f"{item.quantity:.2f}",
-                item.unit,
-                f"${item.cost:.2f}"
-            ])
-        
-        fert_table = Table(fert_data, colWidths=[3*inch, 1*inch, 1*inch, 1*inch])
-        fert_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e74c3c')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-        ]))
-        story.append(fert_table)
+@require_POST
+def transition_recommendations(request):
+    """Move the recommendations ticked on the history page to another status."""
+    status = request.POST.get('status')
+    ids = [int(pk) for pk in request.POST.getlist('recommendations') if pk.isdigit()]
+    query = {key: request.POST[key] for key in ('parcel', 'status_filter') if request.POST.get(key)}
+    if 'status_filter' in query:
+        query['status'] = query.pop('status_filter')
+    history_url = reverse('reports:recommendation_history') + (f'?{urlencode(query)}' if query else '')
+
+    if status not in ALLOWED_TRANSITIONS:
+        messages.error(request, 'Choose a status to move the selected recommendations to.')
+        return redirect(history_url)
+    if not ids:
+        messages.error(request, 'Select at least one recommendation.')
+        return redirect(history_url)
+
+    recommendations = FertilizerRecommendation.objects.filter(user=request.user, pk__in=ids)
+    moved = transition(recommendations, status, request.user.pk, source='web')
+    label = dict(FertilizerRecommendation.STATUS_CHOICES)[status]
+    messages.success(request, f'{moved} recommendation(s) moved to {label}.')
+    if moved < len(set(ids)):
+        messages.info(request, f'{len(set(ids)) - moved} could not be moved to {label} from their current status.')
+    return redirect(history_url)
+
+
+@login_required
+@read_only_database
+def archived_recommendation_detail(request, pk):
+    archived = get_object_or_404(ArchivedRecommendation, pk=pk, user=request.user)
+    document = decompress(archived.data)
+    context = {
+        'archived': archived,
+        'recommendation': document['recommendation'],
+        'parcel': document['parcel'],
+        'items': document['items'],
+    }
+    return render(request, 'reports/archived_recommendation.html', context)
+
+
+async def aget_recommendation_with_items(request, pk):
+    """Load a user's recommendation and its items with the async ORM."""
+    try:
+        recommendation = await FertilizerRecommendation.objects.select_related('inputs', 'parcel__crop').aget(
+            pk=pk, user=request.user,
+        )
+    except FertilizerRecommendation.DoesNotExist:
+        raise Http404("No recommendation matches the given query.")
+    items = [item async for item in recommendation.items.select_related('fertilizer')]
+    return recommendation, items
+
+
+@async_login_required
+@read_only_database
+async def export_recommendation(request, pk, format_name):
+    export_format = get_export_format(format_name)
+    recommendation, items = await aget_recommendation_with_items(request, pk)
+
+    # The backend (and e.g. ReportLab) is imported on first use, in the
+    # bounded export pool for CPU-bound formats
+    if export_format.cpu_bound:
+        content = await run_cpu_bound(build_export, export_format.backend, recommendation, items)
     else:
-        story.append(Paragraph("No fertilizers recommended.", styles['Normal']))
-    
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Total Cost
-    story.append(Paragraph(f"<b>Estimated Total Cost: ${recommendation.estimated_total_cost:.2f}</b>", 
-                          ParagraphStyle('TotalStyle', parent=styles['Normal'], fontSize=12)))
-    
-    story.append(Spacer(1, 0.2*inch))
-    
-    # Notes
-    if recommendation.notes:
-        story.append(Paragraph("Notes", heading_style))
-        story.append(Paragraph(recommendation.notes, styles['Normal']))
-    
-    story.append(Spacer(1, 0.3*inch))
-    story.append(Paragraph(f"Generated on: {recommendation.generated_at.strftime('%Y-%m-%d %H:%M:%S')}", 
-                          styles['Normal']))
-    
-    # Build PDF
-    doc.build(story)
-    
-    # Get the value of the BytesIO buffer
-    buffer.seek(0)
-    
-    # Create response
-    response = HttpResponse(buffer.read(), content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="fertilizer_recommendation_{recommendation.pk}.pdf"'
+        content = build_export(export_format.backend, recommendation, items)
+
+    response = HttpResponse(content, content_type=export_format.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export_format.filename(recommendation)}"'
     return response
 
 
+def procurement_plan_for(request):
+    """The filter form and the aggregated plan for a procurement request."""
+    form = ProcurementFilterForm(request.GET or None, request_user=request.user)
+    # One aggregate per database: a staff plan across users spans every shard
+    line_lists = []
+    for alias in form.databases():
+        with use_shard(alias):
+            recommendations = form.filter(FertilizerRecommendation.objects.filter(status='finalized'))
+            line_lists.append(procurement_lines(recommendations))
+    lines = merge_procurement_lines(*line_lists)
+    return form, lines, procurement_totals(lines)
+
+
 @login_required
-def export_csv(request, pk):
-    recommendation = get_object_or_404(FertilizerRecommendation, pk=pk, user=request.user)
-    items = recommendation.items.all()
-    
-    # Create HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="fertilizer_recommendation_{recommendation.pk}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write header
-    writer.writerow(['Fertilizer Recommendation Report'])
-    writer.writerow([])
-    writer.writerow(['Parcel Information'])
-    writer.writerow(['Parcel Name', recommendation.parcel.name])
-    writer.writerow(['Location', recommendation.parcel.location])
-    writer.writerow(['Area (hectares)', recommendation.parcel.area_hectares])
-    writer.writerow(['Crop', recommendation.parcel.crop.name if recommendation.parcel.crop else 'N/A'])
-    writer.writerow(['Soil Type', recommendation.parcel.get_soil_type_display()])
-    writer.writerow([])
-    
-    writer.writerow(['Soil Test Data'])
-    writer.writerow(['Nitrogen (ppm)', recommendation.soil_nitrogen_ppm])
-    writer.writerow(['Phosphorus (ppm)', recommendation.soil_phosphorus_ppm])
-    writer.writerow(['Potassium (ppm)', recommendation.soil_potassium_ppm])
-    writer.writerow(['pH Level', recommendation.soil_ph])
-    writer.writerow([])
-    
-    writer.writerow(['Nutrient Requirements'])
-    writer.writerow(['Nutrient', 'Required (kg)', 'Deficit (kg)', 'Recommended (kg)'])
-    writer.writerow(['Nitrogen', recommendation.crop_nitrogen_requirement, 
-                    recommendation.nitrogen_needed_kg, recommendation.nitrogen_needed_kg])
-    writer.writerow(['Phosphorus', recommendation.crop_phosphorus_requirement,
-                    recommendation.phosphorus_needed_kg, recommendation.phosphorus_needed_kg])
-    writer.writerow(['Potassium', recommendation.crop_potassium_requirement,
-                    recommendation.potassium_needed_kg, recommendation.potassium_needed_kg])
-    writer.writerow([])
-    
-    writer.writerow(['Recommended Fertilizers'])
-    writer.writerow(['Fertilizer', 'Quantity', 'Unit', 'Cost (USD)'])
-    for item in items:
-        writer.writerow([item.fertilizer.name, item.quantity, item.unit, item.cost])
-    
-    writer.writerow([])
-    writer.writerow(['Estimated Total Cost (USD)', recommendation.estimated_total_cost])
-    writer.writerow(['Generated on', recommendation.generated_at.strftime('%Y-%m-%d %H:%M:%S')])
-    
-    if recommendation.notes:
-        writer.writerow([])
-        writer.writerow(['Notes', recommendation.notes])
-    
-    return response
+@read_only_database
+def procurement_plan(request):
+    form, lines, totals = procurement_plan_for(request)
+    context = {
+        'form': form,
+        'lines': lines,
+        'totals': totals,
+        'query_string': request.GET.urlencode(),
+    }
+    return render(request, 'reports/procurement.html', context)
 
+
+@login_required
+@read_only_database
+def export_procurement_csv(request):
+    _, lines, totals = procurement_plan_for(request)
+    response = HttpResponse(build_procurement_csv(lines, totals), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="procurement_plan.csv"'
+    return response